@@ -0,0 +1,111 @@
+from datetime import datetime
+import numpy as np
+from sqlalchemy import func, select
+from models import db, Appointment, Patient, User, NO_SHOW_STATUS
+
+# Indicadores da clínica calculados sobre extratos colunares (um array NumPy por coluna), sem objetos do ORM.
+# Cada função recebe o período [start, end) em UTC "naive", como está gravado, e o desvio do fuso do navegador
+# (mesma convenção do timezone_offset da agenda: local = UTC - desvio), e devolve dados prontos para JSON.
+
+WEEKDAY_NAMES = ['Domingo', 'Segunda', 'Terça', 'Quarta', 'Quinta', 'Sexta', 'Sábado']
+
+
+def _extract(statement, *dtypes):
+    rows = db.session.execute(statement).all()
+    if not rows:
+        return [np.array([], dtype=dtype) for dtype in dtypes]
+    return [np.array(column, dtype=dtype) for column, dtype in zip(zip(*rows), dtypes)]
+
+
+def _local(times, utc_offset):
+    return times - np.timedelta64(int(utc_offset.total_seconds()), 's')
+
+
+def _rate(part, total):
+    return np.round(np.divide(part, total, out=np.zeros(len(total)), where=total > 0), 4)
+
+
+def attendance_rates(clinic_id, start, end, utc_offset):
+    # Taxas de cancelamento e de falta por profissional e dia da semana (0 = domingo, como na agenda).
+    user_ids, starts, statuses = _extract(
+        select(Appointment.user_id, Appointment.start_time, Appointment.status)
+        .where(Appointment.clinic_id == clinic_id, Appointment.start_time >= start, Appointment.start_time < end),
+        np.int64, 'datetime64[s]', object)
+    # 1970-01-01 foi uma quinta-feira.
+    weekdays = (_local(starts, utc_offset).astype('datetime64[D]').astype(np.int64) + 4) % 7
+    groups, inverse = np.unique(np.stack([user_ids, weekdays], axis=1).reshape(-1, 2), axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    totals = np.bincount(inverse, minlength=len(groups))
+    cancelled = np.bincount(inverse, weights=statuses == 'Cancelado', minlength=len(groups)).astype(np.int64)
+    no_show = np.bincount(inverse, weights=statuses == NO_SHOW_STATUS, minlength=len(groups)).astype(np.int64)
+    names = dict(db.session.execute(select(User.id, User.name).where(User.clinic_id == clinic_id)).all())
+    cancel_rates, no_show_rates = _rate(cancelled, totals), _rate(no_show, totals)
+    return [{
+        'professional_id': int(user_id),
+        'professional': names.get(int(user_id)),
+        'weekday': int(weekday),
+        'weekday_name': WEEKDAY_NAMES[weekday],
+        'total': int(totals[i]),
+        'cancelled': int(cancelled[i]),
+        'no_show': int(no_show[i]),
+        'cancel_rate': float(cancel_rates[i]),
+        'no_show_rate': float(no_show_rates[i]),
+    } for i, (user_id, weekday) in enumerate(groups)]
+
+
+def revenue_by_specialty(clinic_id, start, end, utc_offset):
+    # Faturado segue a regra do saldo do paciente (sessões canceladas não são cobradas); recebido soma amount_paid.
+    specialties, statuses, prices, paid = _extract(
+        select(func.coalesce(func.nullif(Patient.specialty, ''), 'N/A'), Appointment.status, func.coalesce(Appointment.session_price, 0.0), func.coalesce(Appointment.amount_paid, 0.0))
+        .join(Patient, Appointment.patient_id == Patient.id)
+        .where(Appointment.clinic_id == clinic_id, Appointment.start_time >= start, Appointment.start_time < end),
+        str, object, np.float64, np.float64)
+    labels, inverse = np.unique(specialties, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    billed = np.bincount(inverse, weights=np.where(statuses != 'Cancelado', prices, 0.0), minlength=len(labels))
+    received = np.bincount(inverse, weights=paid, minlength=len(labels))
+    completed = np.bincount(inverse, weights=statuses == 'Concluído', minlength=len(labels)).astype(np.int64)
+    order = np.argsort(-billed, kind='stable')
+    return [{
+        'specialty': str(labels[i]),
+        'billed': round(float(billed[i]), 2),
+        'received': round(float(received[i]), 2),
+        'completed_sessions': int(completed[i]),
+    } for i in order]
+
+
+def cohort_retention(clinic_id, start, end, utc_offset, weeks=12):
+    # Coortes pelo mês da primeira sessão concluída (dentro do período). retention[n] é a fração dos pacientes
+    # que ainda tiveram sessão n ou mais semanas depois da primeira; None quando a semana n ainda não chegou.
+    first_session, last_session = func.min(Appointment.start_time), func.max(Appointment.start_time)
+    firsts, lasts = _extract(
+        select(first_session, last_session)
+        .where(Appointment.clinic_id == clinic_id, Appointment.status == 'Concluído')
+        .group_by(Appointment.patient_id)
+        .having(first_session >= start, first_session < end),
+        'datetime64[s]', 'datetime64[s]')
+    week = np.timedelta64(7, 'D')
+    span_weeks = (lasts - firsts) // week
+    observable_weeks = (np.datetime64(datetime.utcnow(), 's') - firsts) // week
+    cohorts, cohort_index = np.unique(_local(firsts, utc_offset).astype('datetime64[M]'), return_inverse=True)
+    cohort_index = cohort_index.reshape(-1)
+    offsets = np.arange(weeks + 1)
+    observed = observable_weeks[:, None] >= offsets
+    retained = observed & (span_weeks[:, None] >= offsets)
+    observed_counts = np.zeros((len(cohorts), weeks + 1), dtype=np.int64)
+    retained_counts = np.zeros((len(cohorts), weeks + 1), dtype=np.int64)
+    np.add.at(observed_counts, cohort_index, observed)
+    np.add.at(retained_counts, cohort_index, retained)
+    sizes = np.bincount(cohort_index, minlength=len(cohorts))
+    return [{
+        'cohort': str(cohort),
+        'patients': int(sizes[i]),
+        'retention': [round(float(retained_counts[i, n] / observed_counts[i, n]), 4) if observed_counts[i, n] else None for n in offsets],
+    } for i, cohort in enumerate(cohorts)]
+
+
+METRICS = {
+    'attendance': attendance_rates,
+    'revenue': revenue_by_specialty,
+    'retention': cohort_retention,
+}
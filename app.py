@@ -1,16 +1,23 @@
 import os
 from dotenv import load_dotenv
 import uuid
-from flask import Flask, render_template, redirect, url_for, flash, jsonify, request, abort
+import json
+import base64
+import csv
+import io
+import click
+from time import monotonic
+from flask import Flask, render_template, redirect, url_for, flash, jsonify, request, abort, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager, current_user, login_user, logout_user, login_required
 from flask_bcrypt import Bcrypt
-from datetime import datetime, date, time, timedelta
+from datetime import datetime, date, time, timedelta, timezone
 import cloudinary
 import cloudinary.uploader
 import cloudinary.api
-from sqlalchemy import func, extract
+from sqlalchemy import func
+from sqlalchemy.orm import undefer_group, selectinload
 from collections import defaultdict
 import mercadopago
 from functools import wraps
@@ -26,12 +33,67 @@ if render_db_url and render_db_url.startswith("postgres://"):
     render_db_url = render_db_url.replace("postgres://", "postgresql://", 1)
 app.config['SQLALCHEMY_DATABASE_URI'] = render_db_url or 'sqlite:///' + os.path.join(basedir, 'app.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['AGENDA_BROKER_URL'] = os.environ.get('AGENDA_BROKER_URL')
+app.config['AGENDA_STREAM_HEARTBEAT'] = int(os.environ.get('AGENDA_STREAM_HEARTBEAT', 15))
+# Cada ligação SSE termina ao fim deste tempo e o EventSource volta a ligar: nenhum separador prende um worker para sempre.
+app.config['AGENDA_STREAM_MAX_SECONDS'] = int(os.environ.get('AGENDA_STREAM_MAX_SECONDS', 300))
+# Tombstones de agendamentos apagados mais antigos do que isto são removidos pelo comando prune-tombstones.
+app.config['TOMBSTONE_RETENTION_DAYS'] = int(os.environ.get('TOMBSTONE_RETENTION_DAYS', 30))
+app.config['MAX_RECURRENCE_WEEKS'] = int(os.environ.get('MAX_RECURRENCE_WEEKS', 104))
+app.config['APPOINTMENT_DURATION_MINUTES'] = int(os.environ.get('APPOINTMENT_DURATION_MINUTES', 60))
+# Opcional: com '1', duas sessões no mesmo local (sala) e horário também conflitam; o local genérico 'Clínica' nunca conta.
+app.config['CHECK_LOCATION_CONFLICTS'] = os.environ.get('CHECK_LOCATION_CONFLICTS', '0') == '1'
+app.config['PATIENTS_PER_PAGE'] = int(os.environ.get('PATIENTS_PER_PAGE', 10))
+app.config['MAX_PATIENTS_PER_PAGE'] = int(os.environ.get('MAX_PATIENTS_PER_PAGE', 100))
+app.config['PATIENT_TYPEAHEAD_LIMIT'] = int(os.environ.get('PATIENT_TYPEAHEAD_LIMIT', 20))
+app.config['PATIENT_TYPEAHEAD_TTL'] = int(os.environ.get('PATIENT_TYPEAHEAD_TTL', 300))
+app.config['NOTES_SEARCH_LIMIT'] = int(os.environ.get('NOTES_SEARCH_LIMIT', 50))
+app.config['EXERCISES_PER_PAGE'] = int(os.environ.get('EXERCISES_PER_PAGE', 25))
+app.config['LIST_COUNT_TTL'] = int(os.environ.get('LIST_COUNT_TTL', 300))
+app.config['CACHE_URL'] = os.environ.get('CACHE_URL')
+app.config['CACHE_MAX_ENTRIES'] = int(os.environ.get('CACHE_MAX_ENTRIES', 2000))
+app.config['CACHE_DEFAULT_TTL'] = int(os.environ.get('CACHE_DEFAULT_TTL', 60))
+app.config['DASHBOARD_CACHE_TTL'] = int(os.environ.get('DASHBOARD_CACHE_TTL', 300))
+app.config['REPORTS_CACHE_TTL'] = int(os.environ.get('REPORTS_CACHE_TTL', 300))
+app.config['REPORT_ROWS_PER_PAGE'] = int(os.environ.get('REPORT_ROWS_PER_PAGE', 50))
+app.config['REPORT_EXPORT_BATCH'] = int(os.environ.get('REPORT_EXPORT_BATCH', 1000))
+app.config['ANALYTICS_CACHE_TTL'] = int(os.environ.get('ANALYTICS_CACHE_TTL', 600))
+app.config['TIMELINE_PAGE_SIZE'] = int(os.environ.get('TIMELINE_PAGE_SIZE', 20))
+app.config['TIMELINE_SNIPPET_LENGTH'] = int(os.environ.get('TIMELINE_SNIPPET_LENGTH', 120))
+app.config['STORAGE_BACKEND'] = os.environ.get('STORAGE_BACKEND', 'cloudinary')
+app.config['STORAGE_LOCAL_DIR'] = os.environ.get('STORAGE_LOCAL_DIR') or os.path.join(basedir, 'uploads')
+app.config['STORAGE_ACCEL_PREFIX'] = os.environ.get('STORAGE_ACCEL_PREFIX')
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE') == '1'
+app.config['UPLOAD_WORKERS'] = int(os.environ.get('UPLOAD_WORKERS', 4))
+app.config['UPLOAD_MAX_PENDING'] = int(os.environ.get('UPLOAD_MAX_PENDING', 64))
+# Envios 'pending' há mais do que isto são retomados (ou dados como falhados) pelo comando sweep-uploads.
+app.config['UPLOAD_STALE_MINUTES'] = int(os.environ.get('UPLOAD_STALE_MINUTES', 30))
+app.config['DERIVATIVE_WORKERS'] = int(os.environ.get('DERIVATIVE_WORKERS', 2))
 
 # --- INICIALIZAÇÃO DAS EXTENSÕES ---
-from models import db, User, Patient, Appointment, ElectronicRecord, Assessment, UploadedFile, Clinic, Exercise
+from models import db, User, Patient, Appointment, AppointmentTombstone, ElectronicRecord, Assessment, UploadedFile, FileVariant, Clinic, Exercise, PatientBalance, ClinicStat, PatientSessionStat, MonthlyFinancialStat, AGE_BANDS, FINANCIAL_STATUS_COLUMNS, reserve_change_seq, prune_tombstones, apply_balance_delta, apply_financial_delta, month_of, rebuild_patient_balances, rebuild_clinic_stats, refresh_age_bands, rebuild_monthly_financials
 db.init_app(app)
 migrate = Migrate(app, db)
 bcrypt = Bcrypt(app)
+from realtime import create_broker
+from scheduling import find_conflicts, DEFAULT_LOCATION
+from search import search_patients, search_clinical_notes, install_search_indexes
+from analytics import METRICS as ANALYTICS_METRICS
+from cache import create_cache
+from storage import create_storages, spooling_request_class
+from jobs import JobQueue
+from uploads import UploadQueue, UPLOAD_PENDING, UPLOAD_READY
+from derivatives import generate_variants, pick_variant, VARIANT_FAILED
+clinic_cache = create_cache(app.config['CACHE_URL'], app.config['CACHE_MAX_ENTRIES'], app.config['CACHE_DEFAULT_TTL'])
+agenda_broker = create_broker(app.config['AGENDA_BROKER_URL'])
+storages = create_storages(app.config['STORAGE_LOCAL_DIR'], app.config['STORAGE_ACCEL_PREFIX'])
+if app.config['STORAGE_BACKEND'] not in storages:
+    raise ValueError(f"STORAGE_BACKEND não suportado: {app.config['STORAGE_BACKEND']}")
+# Filas separadas: o envio submete as variantes, e uma tarefa nunca deve esperar por vaga na própria fila.
+upload_jobs = JobQueue(app, 'upload', app.config['UPLOAD_WORKERS'], app.config['UPLOAD_MAX_PENDING'])
+derivative_jobs = JobQueue(app, 'derivative', app.config['DERIVATIVE_WORKERS'], app.config['UPLOAD_MAX_PENDING'])
+upload_queue = UploadQueue(storages[app.config['STORAGE_BACKEND']], upload_jobs, on_ready=lambda upload_id: derivative_jobs.submit(generate_variants, storages, upload_id))
+app.request_class = spooling_request_class(upload_queue.storage.incoming_dir)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 login_manager.login_message = 'Por favor, faça o login para aceder a esta página.'
@@ -57,6 +119,80 @@ def format_datetime_filter(s, format='%d/%m/%Y'):
     if hasattr(s, 'strftime'): return s.strftime(format)
     return s
 
+# --- PAGINAÇÃO POR CURSOR ---
+def _encode_cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value, default=lambda v: v.isoformat()).encode()).decode()
+
+def _decode_cursor(cursor):
+    # Cursores são ['after' | 'before', [valores da chave]] ou ['offset', n]; qualquer outra coisa volta ao início.
+    try:
+        mode, position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError, AttributeError):
+        return None, None
+    return mode, position
+
+def _cursor_position(order_columns, position):
+    # Datas viajam no cursor em ISO 8601 e voltam a datetime para comparar com a coluna.
+    if not isinstance(position, list) or len(position) != len(order_columns):
+        return None
+    try:
+        return [datetime.fromisoformat(value) if isinstance(column.type, db.DateTime) and value is not None else value for column, value in zip(order_columns, position)]
+    except (TypeError, ValueError):
+        return None
+
+def _keyset_page(query, order_columns, cursor, limit, descending=False):
+    # WHERE (col1, col2) > (última linha vista) percorre o índice a partir desse ponto: qualquer página custa o mesmo.
+    mode, position = _decode_cursor(cursor) if cursor else (None, None)
+    position = _cursor_position(order_columns, position) if mode in ('after', 'before') else None
+    if position is None:
+        mode = 'after'
+    key = db.tuple_(*order_columns)
+    forward = [column.desc() if descending else column for column in order_columns]
+    backward = [column if descending else column.desc() for column in order_columns]
+    if mode == 'before':
+        rows = query.filter(key > tuple(position) if descending else key < tuple(position)).order_by(*backward).limit(limit + 1).all()
+        has_prev, has_next = len(rows) > limit, True
+        rows = rows[:limit][::-1]
+    else:
+        if position is not None:
+            query = query.filter(key < tuple(position) if descending else key > tuple(position))
+        rows = query.order_by(*forward).limit(limit + 1).all()
+        has_prev, has_next = position is not None, len(rows) > limit
+        rows = rows[:limit]
+    key_values = lambda row: [getattr(row, column.key) for column in order_columns]
+    next_cursor = _encode_cursor(['after', key_values(rows[-1])]) if rows and has_next else None
+    prev_cursor = _encode_cursor(['before', key_values(rows[0])]) if rows and has_prev else None
+    return rows, next_cursor, prev_cursor
+
+def _offset_page(query, cursor, limit):
+    # Resultados ordenados por relevância não têm chave estável; a pesquisa pagina por deslocamento, sempre com limite.
+    mode, position = _decode_cursor(cursor) if cursor else (None, None)
+    offset = position if mode == 'offset' and isinstance(position, int) and position > 0 else 0
+    rows = query.offset(offset).limit(limit + 1).all()
+    next_cursor = _encode_cursor(['offset', offset + limit]) if len(rows) > limit else None
+    prev_cursor = _encode_cursor(['offset', max(offset - limit, 0)]) if offset else None
+    return rows[:limit], next_cursor, prev_cursor
+
+def _patient_page(clinic_id, search_query, cursor, limit):
+    if search_query:
+        return _offset_page(search_patients(clinic_id, search_query), cursor, limit)
+    return _keyset_page(Patient.query.filter_by(clinic_id=clinic_id), [Patient.full_name, Patient.id], cursor, limit)
+
+# Dados em cache afetados por cada tipo de gravação (apagar um profissional apaga os seus pacientes e sessões).
+CACHE_DEPENDENCIES = {
+    'patient': ('patients', 'dashboard', 'reports', 'analytics'),
+    'appointment': ('dashboard', 'reports', 'analytics'),
+    'professional': ('professionals', 'patients', 'dashboard', 'reports', 'analytics'),
+    'exercise': ('exercises',),
+}
+
+def _invalidate_cached(clinic_id, entity):
+    for namespace in CACHE_DEPENDENCIES[entity]:
+        clinic_cache.invalidate(namespace, clinic_id)
+
+def _cached_count(namespace, clinic_id, build_query):
+    return clinic_cache.get_or_set(namespace, clinic_id, ('count',), lambda: build_query().count(), ttl=app.config['LIST_COUNT_TTL'])
+
 # --- DECORADORES DE ACESSO (DESABILITADOS PARA TESTE) ---
 def access_required(f):
     @wraps(f)
@@ -204,44 +340,60 @@ def logout():
 def index():
     return render_template('index.html')
 
+def _dashboard_data(clinic_id, professional_id, month, year):
+    hoje = date.today()
+    # O painel lê as estatísticas pré-calculadas (ClinicStat e PatientSessionStat), mantidas a cada gravação.
+    stats = defaultdict(dict)
+    for dimension, bucket, value in db.session.query(ClinicStat.dimension, ClinicStat.bucket, ClinicStat.value).filter(ClinicStat.clinic_id == clinic_id, ClinicStat.value > 0):
+        stats[dimension][bucket] = value
+    gender_data = stats['gender']
+    total_patients = sum(gender_data.values())
+    specialty_chart_data = stats['specialty']
+    age_groups = {band: stats['age_band'].get(band, 0) for band in AGE_BANDS}
+
+    professionals = [{'id': prof_id, 'name': name} for prof_id, name in db.session.query(User.id, User.name).filter(User.clinic_id == clinic_id).order_by(User.name)]
+    selected_professional_id = professional_id if professional_id in {prof['id'] for prof in professionals} else None
+    selected_month = month if month and 1 <= month <= 12 else hoje.month
+    # min/max isolados resolvem-se com uma leitura em cada ponta do índice (clinic_id, start_time).
+    first_start = db.session.query(func.min(Appointment.start_time)).filter(Appointment.clinic_id == clinic_id).scalar()
+    last_start = db.session.query(func.max(Appointment.start_time)).filter(Appointment.clinic_id == clinic_id).scalar()
+    year_range = list(range(min(first_start.year if first_start else hoje.year, hoje.year), max(last_start.year if last_start else hoje.year, hoje.year) + 1))
+    selected_year = year if year in year_range else hoje.year
+
+    if selected_professional_id is None:
+        appointments_per_patient = db.session.query(Patient.full_name, PatientSessionStat.completed).join(Patient, PatientSessionStat.patient_id == Patient.id).filter(PatientSessionStat.clinic_id == clinic_id, PatientSessionStat.month == date(selected_year, selected_month, 1), PatientSessionStat.completed > 0).order_by(PatientSessionStat.completed.desc(), Patient.full_name).all()
+    else:
+        # Servido só pelo índice (user_id, status, start_time, patient_id); o profissional já foi validado contra a clínica.
+        month_start = datetime(selected_year, selected_month, 1)
+        next_month_start = (month_start + timedelta(days=32)).replace(day=1)
+        completed_sessions = func.count().label('completed_sessions')
+        sessions = db.session.query(Appointment.patient_id, completed_sessions).filter(Appointment.user_id == selected_professional_id, Appointment.status == 'Concluído', Appointment.start_time >= month_start, Appointment.start_time < next_month_start).group_by(Appointment.patient_id).subquery()
+        appointments_per_patient = db.session.query(Patient.full_name, sessions.c.completed_sessions).join(sessions, sessions.c.patient_id == Patient.id).order_by(sessions.c.completed_sessions.desc(), Patient.full_name).all()
+
+    return dict(
+        gender_data=gender_data,
+        total_patients=total_patients,
+        specialty_data=specialty_chart_data,
+        age_data=age_groups,
+        patient_appointment_counts=[tuple(row) for row in appointments_per_patient],
+        professionals=professionals,
+        selected_professional_id=selected_professional_id,
+        selected_month=selected_month,
+        selected_year=selected_year,
+        year_range=year_range
+    )
+
 @app.route('/dashboard')
 #@login_required
 #@access_required
 def dashboard():
-    hoje = date.today()
     clinic_id = 1 # ID fixo para testes
     if current_user.is_authenticated:
         clinic_id = current_user.clinic_id
-    
-    all_patients = Patient.query.filter_by(clinic_id=clinic_id).all()
-    total_patients = len(all_patients)
-    
-    gender_data = defaultdict(int)
-    for patient in all_patients:
-        gender_data[patient.gender or "Não Esp."] += 1
-
-    specialty_data = db.session.query(Patient.specialty, func.count(Patient.id)).filter(Patient.clinic_id == clinic_id).group_by(Patient.specialty).all()
-    specialty_chart_data = {label if label else "N/A": count for label, count in specialty_data}
-
-    age_groups = {"0-18": 0, "19-30": 0, "31-50": 0, "51+": 0}
-    for patient in all_patients:
-        age = patient.age
-        if age <= 18: age_groups["0-18"] += 1
-        elif age <= 30: age_groups["19-30"] += 1
-        elif age <= 50: age_groups["31-50"] += 1
-        else: age_groups["51+"] += 1
-    start_of_month = hoje.replace(day=1)
-    appointments_per_patient = db.session.query(Patient, func.count(Appointment.id)).outerjoin(Appointment, (Patient.id == Appointment.patient_id) & (Appointment.status == 'Concluído') & (extract('month', Appointment.start_time) == hoje.month) & (extract('year', Appointment.start_time) == hoje.year)).filter(Patient.clinic_id == clinic_id).group_by(Patient.id).order_by(func.count(Appointment.id).desc()).all()
-    
-    return render_template(
-        'dashboard.html',
-        title="Dashboard",
-        gender_data=dict(gender_data),
-        total_patients=total_patients,
-        specialty_data=specialty_chart_data,
-        age_data=age_groups,
-        patient_appointment_counts=appointments_per_patient
-    )
+    professional_id, month, year = request.args.get('professional_id', type=int), request.args.get('month', type=int), request.args.get('year', type=int)
+    # A data entra na chave: o mês e o ano por omissão mudam com ela.
+    data = clinic_cache.get_or_set('dashboard', clinic_id, (professional_id, month, year, date.today()), lambda: _dashboard_data(clinic_id, professional_id, month, year), ttl=app.config['DASHBOARD_CACHE_TTL'])
+    return render_template('dashboard.html', title="Dashboard", **data)
 
 @app.route('/agenda')
 #@login_required
@@ -253,27 +405,29 @@ def agenda():
 #@login_required
 #@access_required
 def list_patients():
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
+    per_page = max(1, min(request.args.get('per_page', app.config['PATIENTS_PER_PAGE'], type=int), app.config['MAX_PATIENTS_PER_PAGE']))
     search_query = request.args.get('q', '')
     clinic_id_to_use = current_user.clinic_id if current_user.is_authenticated else 1
-    patients_query = Patient.query.filter_by(clinic_id=clinic_id_to_use)
-    if search_query:
-        patients_query = patients_query.filter(Patient.full_name.ilike(f'%{search_query}%'))
-    patients_pagination = patients_query.order_by(Patient.full_name).paginate(page=page, per_page=10)
-    patients_enriched = []
-    for patient in patients_pagination.items:
-        appointment_count = patient.appointments.count()
-        latest_record = patient.records.order_by(ElectronicRecord.record_date.desc()).first()
-        latest_diagnosis = latest_record.medical_diagnosis if (latest_record and latest_record.medical_diagnosis) else "N/A"
-        patients_enriched.append({'data': patient, 'appointment_count': appointment_count, 'latest_diagnosis': latest_diagnosis})
-    return render_template('list_patients.html', patients_pagination=patients_pagination, patients_enriched=patients_enriched, search_query=search_query, title="Painel de Pacientes")
+    patients, next_cursor, prev_cursor = _patient_page(clinic_id_to_use, search_query, cursor, per_page)
+    total_patients = None if search_query else _cached_count('patients', clinic_id_to_use, lambda: Patient.query.filter_by(clinic_id=clinic_id_to_use))
+    # Contagens e último diagnóstico da página inteira em duas consultas agrupadas, independentemente do tamanho da página.
+    page_ids = [patient.id for patient in patients]
+    appointment_counts, latest_diagnoses = {}, {}
+    if page_ids:
+        appointment_counts = dict(db.session.query(Appointment.patient_id, func.count(Appointment.id)).filter(Appointment.patient_id.in_(page_ids)).group_by(Appointment.patient_id).all())
+        ranked_records = db.session.query(ElectronicRecord.patient_id, ElectronicRecord.medical_diagnosis, func.row_number().over(partition_by=ElectronicRecord.patient_id, order_by=(ElectronicRecord.record_date.desc(), ElectronicRecord.id.desc())).label('position')).filter(ElectronicRecord.patient_id.in_(page_ids)).subquery()
+        latest_diagnoses = dict(db.session.query(ranked_records.c.patient_id, ranked_records.c.medical_diagnosis).filter(ranked_records.c.position == 1).all())
+    patients_enriched = [{'data': patient, 'appointment_count': appointment_counts.get(patient.id, 0), 'latest_diagnosis': latest_diagnoses.get(patient.id) or "N/A"} for patient in patients]
+    return render_template('list_patients.html', patients_enriched=patients_enriched, next_cursor=next_cursor, prev_cursor=prev_cursor, total_patients=total_patients, search_query=search_query, per_page=per_page, title="Painel de Pacientes")
 
 @app.route('/professionals')
 #@login_required
 #@admin_required
 def list_professionals():
     clinic_id_to_use = current_user.clinic_id if current_user.is_authenticated else 1
-    professionals = User.query.filter_by(clinic_id=clinic_id_to_use).all()
+    load_professionals = lambda: [{'id': member.id, 'name': member.name, 'email': member.email, 'role': member.role, 'phone': member.phone, 'crefito': member.crefito} for member in User.query.filter_by(clinic_id=clinic_id_to_use)]
+    professionals = clinic_cache.get_or_set('professionals', clinic_id_to_use, ('list',), load_professionals)
     return render_template('list_professionals.html', professionals=professionals, title="Gerir Profissionais")
 
 @app.route('/professional/add', methods=['GET', 'POST'])
@@ -291,6 +445,7 @@ def add_professional():
             new_professional.set_password('fisiomanager123')
         db.session.add(new_professional)
         db.session.commit()
+        _invalidate_cached(clinic_id_to_use, 'professional')
         flash('Novo profissional adicionado com sucesso!', 'success')
         return redirect(url_for('list_professionals'))
     return render_template('add_edit_professional.html', form=form, title="Adicionar Profissional")
@@ -315,6 +470,7 @@ def edit_professional(professional_id):
         if form.password.data:
             professional.set_password(form.password.data)
         db.session.commit()
+        _invalidate_cached(professional.clinic_id, 'professional')
         flash('Dados do profissional atualizados com sucesso!', 'success')
         return redirect(url_for('list_professionals'))
     return render_template('add_edit_professional.html', form=form, title="Editar Profissional")
@@ -329,6 +485,7 @@ def delete_professional(professional_id):
     #     return redirect(url_for('list_professionals'))
     db.session.delete(professional)
     db.session.commit()
+    _invalidate_cached(professional.clinic_id, 'professional')
     flash('Profissional apagado com sucesso.', 'success')
     return redirect(url_for('list_professionals'))
 
@@ -337,8 +494,13 @@ def delete_professional(professional_id):
 #@access_required
 def list_exercises():
     clinic_id_to_use = current_user.clinic_id if current_user.is_authenticated else 1
-    exercises = Exercise.query.filter_by(clinic_id=clinic_id_to_use).order_by(Exercise.name).all()
-    return render_template('list_exercises.html', exercises=exercises, title="Biblioteca de Exercícios")
+    cursor = request.args.get('cursor')
+    def load_page():
+        exercises, next_cursor, prev_cursor = _keyset_page(Exercise.query.filter_by(clinic_id=clinic_id_to_use), [Exercise.name, Exercise.id], cursor, app.config['EXERCISES_PER_PAGE'])
+        return {'exercises': [{'id': exercise.id, 'name': exercise.name, 'description': exercise.description} for exercise in exercises], 'next_cursor': next_cursor, 'prev_cursor': prev_cursor}
+    page = clinic_cache.get_or_set('exercises', clinic_id_to_use, ('page', cursor), load_page)
+    total_exercises = _cached_count('exercises', clinic_id_to_use, lambda: Exercise.query.filter_by(clinic_id=clinic_id_to_use))
+    return render_template('list_exercises.html', **page, total_exercises=total_exercises, title="Biblioteca de Exercícios")
 
 @app.route('/exercise/add', methods=['GET', 'POST'])
 #@login_required
@@ -351,6 +513,7 @@ def add_exercise():
         new_exercise = Exercise(name=form.name.data, description=form.description.data, instructions=form.instructions.data, video_url=form.video_url.data, clinic_id=clinic_id_to_use)
         db.session.add(new_exercise)
         db.session.commit()
+        _invalidate_cached(clinic_id_to_use, 'exercise')
         flash('Exercício adicionado com sucesso!', 'success')
         return redirect(url_for('list_exercises'))
     return render_template('add_edit_exercise.html', form=form, title="Adicionar Exercício")
@@ -369,6 +532,7 @@ def edit_exercise(exercise_id):
         exercise.instructions = form.instructions.data
         exercise.video_url = form.video_url.data
         db.session.commit()
+        _invalidate_cached(exercise.clinic_id, 'exercise')
         flash('Exercício atualizado com sucesso!', 'success')
         return redirect(url_for('list_exercises'))
     return render_template('add_edit_exercise.html', form=form, title="Editar Exercício")
@@ -381,6 +545,7 @@ def delete_exercise(exercise_id):
     # if exercise.clinic_id != current_user.clinic_id: abort(403)
     db.session.delete(exercise)
     db.session.commit()
+    _invalidate_cached(exercise.clinic_id, 'exercise')
     flash('Exercício apagado com sucesso.', 'success')
     return redirect(url_for('list_exercises'))
 
@@ -396,6 +561,7 @@ def add_patient():
         new_patient = Patient(full_name=form.full_name.data, date_of_birth=form.date_of_birth.data, gender=form.gender.data, phone=form.phone.data, specialty=form.specialty.data, professional=user_to_use, clinic_id=clinic_id_to_use)
         db.session.add(new_patient)
         db.session.commit()
+        _invalidate_cached(clinic_id_to_use, 'patient')
         flash('Paciente cadastrado com sucesso!', 'success')
         return redirect(url_for('list_patients'))
     return render_template('add_edit_patient.html', form=form, title="Adicionar Paciente")
@@ -409,12 +575,21 @@ def edit_patient(patient_id):
     from forms import PatientForm
     form = PatientForm(obj=patient)
     if form.validate_on_submit():
+        renamed = patient.full_name != form.full_name.data
         patient.full_name = form.full_name.data
         patient.date_of_birth = form.date_of_birth.data
         patient.gender = form.gender.data
         patient.phone = form.phone.data
         patient.specialty = form.specialty.data
+        # O nome é o título dos eventos da agenda: as sessões do paciente ganham uma nova versão na mesma transação,
+        # para que o ETag de /api/appointments mude e /api/appointments/changes as reenvie.
+        appointment_ids = [appointment_id for (appointment_id,) in db.session.query(Appointment.id).filter(Appointment.patient_id == patient.id)] if renamed else []
+        if appointment_ids:
+            seq = reserve_change_seq(db.session, patient.clinic_id)
+            db.session.execute(db.update(Appointment).where(Appointment.patient_id == patient.id).values(updated_seq=seq).execution_options(synchronize_session=False))
         db.session.commit()
+        _invalidate_cached(patient.clinic_id, 'patient')
+        if appointment_ids: _publish_agenda_change(patient.clinic_id, 'updated', appointment_ids)
         flash('Dados do paciente atualizados com sucesso!', 'success')
         return redirect(url_for('list_patients'))
     return render_template('add_edit_patient.html', form=form, title="Editar Paciente")
@@ -425,20 +600,74 @@ def edit_patient(patient_id):
 def delete_patient(patient_id):
     patient = Patient.query.get_or_404(patient_id)
     # if patient.clinic_id != current_user.clinic_id: abort(403)
+    # As sessões vão em cascata (com tombstones, ver stamp_appointment_changes); as agendas abertas são avisadas.
+    appointment_ids = [appointment_id for (appointment_id,) in db.session.query(Appointment.id).filter(Appointment.patient_id == patient.id)]
     db.session.delete(patient)
     db.session.commit()
+    _invalidate_cached(patient.clinic_id, 'patient')
+    if appointment_ids: _publish_agenda_change(patient.clinic_id, 'deleted', appointment_ids)
     flash(f'O paciente {patient.full_name} e todos os seus registos foram apagados com sucesso.', 'success')
     return redirect(url_for('list_patients'))
 
+# --- LINHA DO TEMPO CLÍNICA ---
+# Só cabeçalhos (id, data, início do diagnóstico), paginados por cursor: a primeira renderização custa o mesmo
+# para um paciente novo ou com anos de sessões. Os textos completos chegam como fragmentos, a pedido.
+def _record_headers_page(patient_id, cursor):
+    headers = db.session.query(ElectronicRecord.id, ElectronicRecord.record_date, func.substr(ElectronicRecord.medical_diagnosis, 1, app.config['TIMELINE_SNIPPET_LENGTH']).label('diagnosis_snippet')).filter(ElectronicRecord.patient_id == patient_id)
+    return _keyset_page(headers, [ElectronicRecord.record_date, ElectronicRecord.id], cursor, app.config['TIMELINE_PAGE_SIZE'], descending=True)
+
+def _assessment_headers_page(patient_id, cursor):
+    headers = db.session.query(Assessment.id, Assessment.created_at).filter(Assessment.patient_id == patient_id)
+    return _keyset_page(headers, [Assessment.created_at, Assessment.id], cursor, app.config['TIMELINE_PAGE_SIZE'], descending=True)
+
 @app.route('/patient/<int:patient_id>')
 #@login_required
 #@access_required
 def patient_detail(patient_id):
     patient = Patient.query.get_or_404(patient_id)
     # if patient.clinic_id != current_user.clinic_id: abort(403)
-    records = patient.records.order_by(ElectronicRecord.record_date.desc()).all()
-    assessments = patient.assessments.order_by(Assessment.created_at.desc()).all()
-    return render_template('patient_detail.html', patient=patient, records=records, assessments=assessments)
+    records, next_records_cursor, _ = _record_headers_page(patient.id, None)
+    assessments, next_assessments_cursor, _ = _assessment_headers_page(patient.id, None)
+    return render_template('patient_detail.html', patient=patient, records=records, next_cursor=next_records_cursor, assessments=assessments, next_assessments_cursor=next_assessments_cursor)
+
+@app.route('/patient/<int:patient_id>/records')
+#@login_required
+#@access_required
+def patient_records_page(patient_id):
+    # Fragmento com a página seguinte de cabeçalhos, acrescentado ao acordeão pela linha do tempo.
+    records, next_cursor, _ = _record_headers_page(patient_id, request.args.get('cursor'))
+    return render_template('partials/_records_list.html', records=records, next_cursor=next_cursor, patient_id=patient_id, append=True)
+
+@app.route('/patient/<int:patient_id>/record/<int:record_id>')
+#@login_required
+#@access_required
+def patient_record_body(patient_id, record_id):
+    record = ElectronicRecord.query.options(undefer_group('body')).filter_by(id=record_id, patient_id=patient_id).first_or_404()
+    return render_template('partials/_record_body.html', record=record)
+
+@app.route('/patient/<int:patient_id>/assessments')
+#@login_required
+#@access_required
+def patient_assessments_page(patient_id):
+    assessments, next_cursor, _ = _assessment_headers_page(patient_id, request.args.get('cursor'))
+    return render_template('partials/_assessments_list.html', assessments=assessments, next_cursor=next_cursor, patient_id=patient_id, append=True)
+
+@app.route('/notes/search')
+#@login_required
+#@access_required
+def search_notes():
+    search_query = request.args.get('q', '').strip()
+    clinic_id_to_use = current_user.clinic_id if current_user.is_authenticated else 1
+    hits = search_clinical_notes(clinic_id_to_use, search_query, app.config['NOTES_SEARCH_LIMIT']) if search_query else []
+    return render_template('search_notes.html', title='Pesquisar Notas Clínicas', hits=hits, search_query=search_query)
+
+@app.route('/api/notes/search')
+#@login_required
+def api_search_notes():
+    clinic_id_to_use = current_user.clinic_id if current_user.is_authenticated else 1
+    limit = max(1, min(request.args.get('limit', app.config['NOTES_SEARCH_LIMIT'], type=int), 100))
+    hits = search_clinical_notes(clinic_id_to_use, request.args.get('q', ''), limit)
+    return jsonify({'results': [dict(hit, date=hit['date'].isoformat() if hit['date'] else None, snippet=str(hit['snippet']) if hit['snippet'] else None) for hit in hits]})
 
 @app.route('/patient/<int:patient_id>/add_record', methods=['GET', 'POST'])
 #@login_required
@@ -449,7 +678,7 @@ def add_record(patient_id):
     from forms import ElectronicRecordForm
     form = ElectronicRecordForm()
     if form.validate_on_submit():
-        record = ElectronicRecord(record_date=datetime.utcnow(), medical_diagnosis=form.medical_diagnosis.data, subjective_notes=form.subjective_notes.data, objective_notes=form.objective_notes.data, assessment=form.assessment.data, plan=form.plan.data, patient_id=patient.id)
+        record = ElectronicRecord(record_date=datetime.utcnow(), medical_diagnosis=form.medical_diagnosis.data, subjective_notes=form.subjective_notes.data, objective_notes=form.objective_notes.data, assessment=form.assessment.data, plan=form.plan.data, patient_id=patient.id, clinic_id=patient.clinic_id)
         db.session.add(record)
         db.session.commit()
         flash('Registro adicionado ao prontuário com sucesso!', 'success')
@@ -465,17 +694,17 @@ def add_assessment(patient_id):
     from forms import AssessmentForm
     form = AssessmentForm()
     if form.validate_on_submit():
-        assessment = Assessment(patient_id=patient.id, main_complaint=form.main_complaint.data, history_of_present_illness=form.history_of_present_illness.data, past_medical_history=form.past_medical_history.data, medications=form.medications.data, social_history=form.social_history.data, inspection_notes=form.inspection_notes.data, palpation_notes=form.palpation_notes.data, mobility_assessment=form.mobility_assessment.data, strength_assessment=form.strength_assessment.data, neuro_assessment=form.neuro_assessment.data, functional_assessment=form.functional_assessment.data, diagnosis=form.diagnosis.data, goals=form.goals.data, treatment_plan=form.treatment_plan.data)
+        assessment = Assessment(patient_id=patient.id, clinic_id=patient.clinic_id, main_complaint=form.main_complaint.data, history_of_present_illness=form.history_of_present_illness.data, past_medical_history=form.past_medical_history.data, medications=form.medications.data, social_history=form.social_history.data, inspection_notes=form.inspection_notes.data, palpation_notes=form.palpation_notes.data, mobility_assessment=form.mobility_assessment.data, strength_assessment=form.strength_assessment.data, neuro_assessment=form.neuro_assessment.data, functional_assessment=form.functional_assessment.data, diagnosis=form.diagnosis.data, goals=form.goals.data, treatment_plan=form.treatment_plan.data)
         db.session.add(assessment)
+        # Os anexos ficam 'pending' e são enviados em segundo plano; a avaliação fica gravada já.
+        spooled = [(file.filename, upload_queue.spool(file)) for file in request.files.getlist(form.files.name) if file]
+        pending = [(UploadedFile(status=UPLOAD_PENDING, original_filename=filename, spool_path=path[0], assessment=assessment), path) for filename, path in spooled]
+        db.session.add_all(uploaded for uploaded, _ in pending)
         db.session.commit()
-        files = request.files.getlist(form.files.name)
-        for file in files:
-            if file:
-                upload_result = cloudinary.uploader.upload(file)
-                new_file = UploadedFile(public_id=upload_result['public_id'], secure_url=upload_result['secure_url'], resource_type=upload_result['resource_type'], assessment_id=assessment.id)
-                db.session.add(new_file)
-        db.session.commit()
-        flash('Nova avaliação salva com sucesso!', 'success')
+        for uploaded, path in pending:
+            # Com a fila cheia o envio fica 'pending', com o arquivo em disco, até ao próximo sweep-uploads.
+            upload_queue.submit(uploaded.id, path, uploaded.original_filename)
+        flash('Nova avaliação salva com sucesso!' + (' Os anexos estão sendo enviados.' if pending else ''), 'success')
         return redirect(url_for('patient_detail', patient_id=patient.id))
     return render_template('add_edit_assessment.html', title='Nova Avaliação', form=form, patient=patient)
 
@@ -485,95 +714,473 @@ def add_assessment(patient_id):
 def view_assessment(assessment_id):
     assessment = Assessment.query.get_or_404(assessment_id)
     # if assessment.patient.clinic_id != current_user.clinic_id: abort(403)
-    return render_template('view_assessment.html', title='Detalhes da Avaliação', assessment=assessment)
+    return render_template('view_assessment.html', title='Detalhes da Avaliação', assessment=assessment, files=assessment.files.options(selectinload(UploadedFile.variants)).order_by(UploadedFile.id).all())
+
+@app.route('/files/<int:file_id>')
+#@login_required
+#@access_required
+def download_file(file_id):
+    uploaded = UploadedFile.query.get_or_404(file_id)
+    # if uploaded.assessment.clinic_id != current_user.clinic_id: abort(403)
+    if uploaded.status != UPLOAD_READY:
+        abort(404)
+    # ?size=thumb|web (padrão web) entrega a menor variante adequada já gerada; ?size=original, o arquivo enviado.
+    variant = pick_variant(uploaded, request.args.get('size', 'web'))
+    if variant is not None:
+        return storages[variant.storage].send(variant)
+    return storages[uploaded.storage].send(uploaded, uploaded.original_filename)
+
+# --- RELATÓRIOS ---
+def _report_period():
+    # Período pedido em ?start_date=&end_date= (AAAA-MM-DD); por omissão, ou com datas inválidas, o mês atual.
+    try:
+        return datetime.strptime(request.args['start_date'], '%Y-%m-%d').date(), datetime.strptime(request.args['end_date'], '%Y-%m-%d').date()
+    except (KeyError, ValueError):
+        start_date = date.today().replace(day=1)
+        next_month = start_date.replace(day=28) + timedelta(days=4)
+        return start_date, next_month - timedelta(days=next_month.day)
+
+def _report_filter(clinic_id, start_date, end_date):
+    # Intervalo semiaberto sobre start_time: usa o índice (clinic_id, start_time).
+    return (Appointment.clinic_id == clinic_id, Appointment.start_time >= datetime.combine(start_date, time.min), Appointment.start_time < datetime.combine(end_date + timedelta(days=1), time.min))
+
+def _financial_summary(clinic_id, start_date, end_date):
+    # Meses inteiros vêm do resumo mensal (uma linha por profissional e mês); só os meses parciais
+    # das pontas do período somam agendamentos, numa consulta agrupada por status cada.
+    status_counts = {'Concluído': 0, 'Agendado': 0, 'Cancelado': 0}
+    totals = {'billed': 0.0, 'received': 0.0}
+    end_exclusive = end_date + timedelta(days=1)
+    first_whole_month = start_date if start_date.day == 1 else (start_date.replace(day=28) + timedelta(days=4)).replace(day=1)
+    whole_months_end = end_exclusive.replace(day=1)
+    raw_ranges = [(start_date, end_exclusive)]
+    if first_whole_month < whole_months_end:
+        raw_ranges = [(start_date, first_whole_month), (whole_months_end, end_exclusive)]
+        status_columns = list(FINANCIAL_STATUS_COLUMNS.items())
+        rollup = db.session.query(func.coalesce(func.sum(MonthlyFinancialStat.billed), 0.0), func.coalesce(func.sum(MonthlyFinancialStat.received), 0.0), *[func.coalesce(func.sum(getattr(MonthlyFinancialStat, column)), 0) for _, column in status_columns]) \
+            .filter(MonthlyFinancialStat.clinic_id == clinic_id, MonthlyFinancialStat.month >= first_whole_month, MonthlyFinancialStat.month < whole_months_end).one()
+        totals['billed'] += rollup[0]
+        totals['received'] += rollup[1]
+        for (status, _), count in zip(status_columns, rollup[2:]):
+            if count: status_counts[status] = status_counts.get(status, 0) + count
+    for range_start, range_end in raw_ranges:
+        if range_start >= range_end:
+            continue
+        period = _report_filter(clinic_id, range_start, range_end - timedelta(days=1))
+        for status, count, billed, received in db.session.query(Appointment.status, func.count(Appointment.id), func.coalesce(func.sum(Appointment.session_price), 0.0), func.coalesce(func.sum(Appointment.amount_paid), 0.0)).filter(*period).group_by(Appointment.status):
+            status_counts[status] = status_counts.get(status, 0) + count
+            totals['billed'] += billed
+            totals['received'] += received
+    return {'total_cobrado': totals['billed'], 'total_recebido': totals['received'], 'status_counts': status_counts, 'total_appointments': sum(status_counts.values())}
+
+def _report_rows(period):
+    # Linhas do detalhe com o nome do paciente na mesma consulta, sem carregar objetos do ORM.
+    return db.session.query(Appointment.id, Appointment.start_time, Appointment.session_price, Appointment.amount_paid, Appointment.status, Patient.full_name.label('patient_name')).join(Patient, Appointment.patient_id == Patient.id).filter(*period)
 
 @app.route('/reports')
 #@login_required
 #@access_required
 def reports():
-    hoje = date.today()
-    start_date_str = request.args.get('start_date')
-    end_date_str = request.args.get('end_date')
-    if start_date_str and end_date_str:
-        start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
-        end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
-    else:
-        start_date = hoje.replace(day=1)
-        next_month = start_date.replace(day=28) + timedelta(days=4)
-        end_date = next_month - timedelta(days=next_month.day)
-    start_datetime = datetime.combine(start_date, time.min)
-    end_datetime = datetime.combine(end_date, time.max)
-    
+    start_date, end_date = _report_period()
     clinic_id_to_use = current_user.clinic_id if current_user.is_authenticated else 1
-    
-    financial_appointments = db.session.query(Appointment).join(User).filter(User.clinic_id == clinic_id_to_use, Appointment.start_time.between(start_datetime, end_datetime)).order_by(Appointment.start_time.desc()).all()
-    total_cobrado_periodo = sum(appt.session_price for appt in financial_appointments if appt.session_price)
-    total_recebido_periodo = sum(appt.amount_paid for appt in financial_appointments if appt.amount_paid)
-    start_of_current_month = hoje.replace(day=1)
-    appointments_this_month = db.session.query(Appointment).join(User).filter(User.clinic_id == clinic_id_to_use, Appointment.start_time >= start_of_current_month).all()
-    status_counts = {'Concluído': 0, 'Agendado': 0, 'Cancelado': 0}
-    for appt in appointments_this_month:
-        if appt.status in status_counts: status_counts[appt.status] += 1
-    return render_template('reports.html', financial_appointments=financial_appointments, total_cobrado=total_cobrado_periodo, total_recebido=total_recebido_periodo, start_date=start_date.strftime('%Y-%m-%d'), end_date=end_date.strftime('%Y-%m-%d'), status_counts=status_counts)
+    period = _report_filter(clinic_id_to_use, start_date, end_date)
+    cursor = request.args.get('cursor')
+    def load_page():
+        rows, next_cursor, prev_cursor = _keyset_page(_report_rows(period), [Appointment.start_time, Appointment.id], cursor, app.config['REPORT_ROWS_PER_PAGE'], descending=True)
+        return {'financial_appointments': [row._asdict() for row in rows], 'next_cursor': next_cursor, 'prev_cursor': prev_cursor}
+
+    cache_key = (start_date, end_date)
+    summary = clinic_cache.get_or_set('reports', clinic_id_to_use, cache_key, lambda: _financial_summary(clinic_id_to_use, start_date, end_date), ttl=app.config['REPORTS_CACHE_TTL'])
+    page = clinic_cache.get_or_set('reports', clinic_id_to_use, cache_key + (cursor,), load_page, ttl=app.config['REPORTS_CACHE_TTL'])
+    return render_template('reports.html', **summary, **page, start_date=start_date.strftime('%Y-%m-%d'), end_date=end_date.strftime('%Y-%m-%d'))
 
+def _money(value):
+    return f"{value or 0.0:.2f}".replace('.', ',')
+
+@app.route('/reports/export.csv')
+#@login_required
+#@access_required
+def export_reports():
+    start_date, end_date = _report_period()
+    clinic_id_to_use = current_user.clinic_id if current_user.is_authenticated else 1
+    # yield_per lê em lotes (cursor do lado do servidor no PostgreSQL): a memória não cresce com o período.
+    rows = _report_rows(_report_filter(clinic_id_to_use, start_date, end_date)).order_by(Appointment.start_time, Appointment.id).execution_options(yield_per=app.config['REPORT_EXPORT_BATCH'])
+
+    def generate():
+        # Separador ';', vírgula decimal e BOM UTF-8: o formato que o Excel em português abre diretamente.
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, delimiter=';')
+        writer.writerow(['Data', 'Paciente', 'Preço Sessão (R$)', 'Valor Pago (R$)', 'Saldo (R$)', 'Status'])
+        yield '\ufeff' + buffer.getvalue()
+        for row in rows:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow([row.start_time.strftime('%d/%m/%Y %H:%M'), row.patient_name, _money(row.session_price), _money(row.amount_paid), _money((row.amount_paid or 0) - (row.session_price or 0)), row.status])
+            yield buffer.getvalue()
+
+    filename = f"relatorio_{start_date.strftime('%Y%m%d')}_{end_date.strftime('%Y%m%d')}.csv"
+    return app.response_class(stream_with_context(generate()), mimetype='text/csv; charset=utf-8', headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+
+# --- INDICADORES ---
+@app.route('/api/analytics/<metric>')
+#@login_required
+#@access_required
+def api_analytics(metric):
+    if metric not in ANALYTICS_METRICS:
+        return jsonify({'status': 'error', 'message': 'Indicador desconhecido.'}), 404
+    clinic_id_to_use = current_user.clinic_id if current_user.is_authenticated else 1
+    start_date, end_date = _report_period()
+    timezone_offset = request.args.get('timezone_offset', 0, type=int)
+    compute = lambda: ANALYTICS_METRICS[metric](clinic_id_to_use, datetime.combine(start_date, time.min), datetime.combine(end_date + timedelta(days=1), time.min), timedelta(minutes=timezone_offset))
+    data = clinic_cache.get_or_set('analytics', clinic_id_to_use, (metric, start_date, end_date, timezone_offset), compute, ttl=app.config['ANALYTICS_CACHE_TTL'])
+    return jsonify({'metric': metric, 'start_date': start_date.isoformat(), 'end_date': end_date.isoformat(), 'results': data})
 
 # --- APIS ---
+STATUS_COLORS = {'Concluído': '#198754', 'Agendado': '#0dcaf0', 'Cancelado': '#6c757d'}
+
+def _parse_client_datetime(value):
+    # Normaliza datas ISO vindas do navegador (com 'Z' ou offset) para datetime "naive" em UTC, como são gravadas.
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def _serialize_appointment(appt, patient_name):
+    color = STATUS_COLORS.get(appt.status, '#6c757d')
+    # Gravado em UTC sem fuso: sai com +00:00 para o FullCalendar converter para a hora local do navegador.
+    return {'id': appt.id, 'title': patient_name, 'start': appt.start_time.replace(tzinfo=timezone.utc).isoformat(), 'color': color, 'borderColor': color, 'extendedProps': {'location': appt.location, 'status': appt.status, 'notes': appt.notes, 'session_price': appt.session_price, 'amount_paid': appt.amount_paid, 'payment_notes': appt.payment_notes, 'patient_id': appt.patient_id, 'recurrence_id': appt.recurrence_id}}
+
+def _agenda_cursor(clinic_id):
+    return db.session.query(Clinic.change_seq).filter(Clinic.id == clinic_id).scalar() or 0
+
+def _conditional_json(etag, cursor, build_payload):
+    # Responde 304 sem consultar os agendamentos quando o navegador já tem a versão atual.
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(build_payload())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Agenda-Cursor'] = str(cursor)
+    return response
+
 @app.route('/api/appointments')
 #@login_required
 #@access_required
 def api_appointments():
     clinic_id_to_use = current_user.clinic_id if current_user.is_authenticated else 1
-    appointments = db.session.query(Appointment).join(User).filter(User.clinic_id == clinic_id_to_use).all()
-    status_colors = {'Concluído': '#198754', 'Agendado': '#0dcaf0', 'Cancelado': '#6c757d'}
-    eventos = []
-    for appt in appointments:
-        eventos.append({'id': appt.id, 'title': appt.patient.full_name, 'start': appt.start_time.isoformat(), 'color': status_colors.get(appt.status, '#6c757d'), 'borderColor': status_colors.get(appt.status, '#6c757d'), 'extendedProps': {'location': appt.location, 'status': appt.status, 'notes': appt.notes, 'session_price': appt.session_price, 'amount_paid': appt.amount_paid, 'payment_notes': appt.payment_notes, 'patient_id': appt.patient_id, 'recurrence_id': appt.recurrence_id}})
-    return jsonify(eventos)
+    # O FullCalendar envia 'start' e 'end' com a janela visível; só essa janela é carregada.
+    try:
+        window_start = _parse_client_datetime(request.args['start']) if request.args.get('start') else None
+        window_end = _parse_client_datetime(request.args['end']) if request.args.get('end') else None
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Parâmetros de data inválidos.'}), 400
+    cursor = _agenda_cursor(clinic_id_to_use)
+    etag = f"agenda-{clinic_id_to_use}-{cursor}-{window_start and window_start.isoformat()}-{window_end and window_end.isoformat()}"
+    def build_payload():
+        query = db.session.query(Appointment, Patient.full_name).join(Patient, Appointment.patient_id == Patient.id).filter(Appointment.clinic_id == clinic_id_to_use)
+        if window_start: query = query.filter(Appointment.start_time >= window_start)
+        if window_end: query = query.filter(Appointment.start_time < window_end)
+        return [_serialize_appointment(appt, patient_name) for appt, patient_name in query.order_by(Appointment.start_time)]
+    return _conditional_json(etag, cursor, build_payload)
+
+@app.route('/api/appointments/changes')
+#@login_required
+def api_appointment_changes():
+    clinic_id_to_use = current_user.clinic_id if current_user.is_authenticated else 1
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({'status': 'error', 'message': 'Parâmetro "since" obrigatório.'}), 400
+    cursor = _agenda_cursor(clinic_id_to_use)
+    floor = db.session.query(Clinic.tombstone_floor).filter(Clinic.id == clinic_id_to_use).scalar() or 0
+    def build_payload():
+        if since < floor:
+            # Os apagamentos desde 'since' já foram limpos (prune-tombstones): o cliente recarrega a agenda inteira.
+            return {'cursor': cursor, 'resync': True, 'events': [], 'deleted': []}
+        if since >= cursor:
+            return {'cursor': cursor, 'events': [], 'deleted': []}
+        changed = db.session.query(Appointment, Patient.full_name).join(Patient, Appointment.patient_id == Patient.id).filter(Appointment.clinic_id == clinic_id_to_use, Appointment.updated_seq > since)
+        deleted = db.session.query(AppointmentTombstone.appointment_id).filter(AppointmentTombstone.clinic_id == clinic_id_to_use, AppointmentTombstone.deleted_seq > since)
+        return {'cursor': cursor, 'events': [_serialize_appointment(appt, patient_name) for appt, patient_name in changed], 'deleted': [appointment_id for (appointment_id,) in deleted]}
+    return _conditional_json(f"agenda-changes-{clinic_id_to_use}-{cursor}-{floor}-{since}", cursor, build_payload)
+
+def _publish_agenda_change(clinic_id, change_type, appointment_ids):
+    # Publicado só depois do commit: quem recebe o evento já encontra a alteração em /api/appointments/changes.
+    _invalidate_cached(clinic_id, 'appointment')
+    try:
+        agenda_broker.publish(clinic_id, {'type': change_type, 'ids': list(appointment_ids)})
+    except Exception as e:
+        app.logger.error(f"Erro ao publicar alteração da agenda: {e}")
+
+@app.route('/api/appointments/stream')
+#@login_required
+def api_appointment_stream():
+    clinic_id_to_use = current_user.clinic_id if current_user.is_authenticated else 1
+    heartbeat = app.config['AGENDA_STREAM_HEARTBEAT']
+    deadline = monotonic() + app.config['AGENDA_STREAM_MAX_SECONDS']
+    subscription = agenda_broker.subscribe(clinic_id_to_use)
+    # A ligação fica aberta vários minutos; não pode segurar uma conexão do pool da base de dados.
+    db.session.close()
+    def generate():
+        try:
+            yield 'retry: 5000\n\n'
+            # Ao fim do prazo a resposta termina; ao voltar a ligar, a agenda pede o que mudou entretanto (syncAgenda).
+            while (remaining := deadline - monotonic()) > 0:
+                message = subscription.get(timeout=min(heartbeat, remaining))
+                if message is None:
+                    yield ': keep-alive\n\n'
+                else:
+                    yield f"data: {json.dumps(message)}\n\n"
+        finally:
+            subscription.close()
+    return app.response_class(stream_with_context(generate()), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/appointments/cancel_series', methods=['POST'])
+#@login_required
+def cancel_appointment_series():
+    clinic_id_to_use = current_user.clinic_id if current_user.is_authenticated else 1
+    recurrence_id = (request.get_json() or {}).get('recurrence_id')
+    if not recurrence_id:
+        return jsonify({'status': 'error', 'message': 'Série não informada.'}), 400
+    # Um único UPDATE sobre o índice (recurrence_id, start_time); as linhas nunca passam pelo ORM.
+    seq = reserve_change_seq(db.session, clinic_id_to_use)
+    cancelled = db.session.execute(
+        db.update(Appointment)
+        .where(Appointment.recurrence_id == recurrence_id, Appointment.start_time >= datetime.utcnow(), Appointment.status == 'Agendado', Appointment.clinic_id == clinic_id_to_use)
+        .values(status='Cancelado', updated_seq=seq)
+        .returning(Appointment.id, Appointment.patient_id, Appointment.session_price, Appointment.user_id, Appointment.start_time)
+        .execution_options(synchronize_session=False)
+    ).all()
+    cancelled_ids = [row.id for row in cancelled]
+    # Sessões canceladas deixam de ser cobradas; o saldo recebe a diferença de uma só vez.
+    due_by_patient = defaultdict(float)
+    for row in cancelled: due_by_patient[row.patient_id] -= row.session_price or 0.0
+    for patient_id, due_delta in due_by_patient.items(): apply_balance_delta(db.session, patient_id, due_delta=due_delta)
+    # No resumo mensal as sessões passam de agendadas a canceladas; o valor do relatório não muda.
+    cancelled_by_month = defaultdict(int)
+    for row in cancelled: cancelled_by_month[(row.user_id, month_of(row.start_time))] += 1
+    for (user_id, month), count in cancelled_by_month.items(): apply_financial_delta(db.session, clinic_id_to_use, user_id, month, {'scheduled': -count, 'cancelled': count})
+    if not cancelled_ids:
+        db.session.rollback()
+        return jsonify({'status': 'success', 'message': 'Nenhum agendamento futuro desta série para cancelar.', 'cancelled_count': 0})
+    db.session.commit()
+    _publish_agenda_change(clinic_id_to_use, 'cancelled', cancelled_ids)
+    return jsonify({'status': 'success', 'message': f'{len(cancelled_ids)} agendamento(s) futuro(s) da série cancelado(s).', 'cancelled_count': len(cancelled_ids)})
 
 @app.route('/api/patients')
 #@login_required
 def api_patients():
     clinic_id_to_use = current_user.clinic_id if current_user.is_authenticated else 1
-    patients = Patient.query.filter_by(clinic_id=clinic_id_to_use).order_by(Patient.full_name).all()
-    return jsonify([{'id': p.id, 'name': p.full_name} for p in patients])
+    search_query = request.args.get('q', '').strip()
+    limit = max(1, min(request.args.get('limit', app.config['PATIENT_TYPEAHEAD_LIMIT'], type=int), 100))
+    cursor = request.args.get('cursor')
+    def build_page():
+        patients, next_cursor, prev_cursor = _patient_page(clinic_id_to_use, search_query, cursor, limit)
+        page = {'results': [{'id': patient.id, 'name': patient.full_name} for patient in patients], 'next_cursor': next_cursor, 'prev_cursor': prev_cursor}
+        if request.args.get('with_total') and not search_query:
+            page['total'] = _cached_count('patients', clinic_id_to_use, lambda: Patient.query.filter_by(clinic_id=clinic_id_to_use))
+        return page
+    page = clinic_cache.get_or_set('patients', clinic_id_to_use, (search_query.casefold(), limit, cursor, bool(request.args.get('with_total'))), build_page, ttl=app.config['PATIENT_TYPEAHEAD_TTL'])
+    return jsonify(page)
+
+@app.route('/api/exercises')
+#@login_required
+def api_exercises():
+    clinic_id_to_use = current_user.clinic_id if current_user.is_authenticated else 1
+    limit = max(1, min(request.args.get('limit', app.config['EXERCISES_PER_PAGE'], type=int), 100))
+    exercises, next_cursor, prev_cursor = _keyset_page(Exercise.query.filter_by(clinic_id=clinic_id_to_use), [Exercise.name, Exercise.id], request.args.get('cursor'), limit)
+    page = {'results': [{'id': exercise.id, 'name': exercise.name, 'description': exercise.description, 'video_url': exercise.video_url} for exercise in exercises], 'next_cursor': next_cursor, 'prev_cursor': prev_cursor}
+    if request.args.get('with_total'):
+        page['total'] = _cached_count('exercises', clinic_id_to_use, lambda: Exercise.query.filter_by(clinic_id=clinic_id_to_use))
+    return jsonify(page)
+
+def _expand_recurrence(first_start, weekdays, weeks):
+    # 'weekdays' vem numerado como no JavaScript (0 = domingo); sem dias escolhidos, repete o dia de first_start.
+    # A série começa no primeiro dia escolhido a partir de first_start (que só entra se o seu dia for um deles)
+    # e as semanas contam-se daí: sempre weeks * len(dias) sessões.
+    python_weekdays = {(day - 1) % 7 for day in weekdays} or {first_start.weekday()}
+    first = next(first_start + timedelta(days=offset) for offset in range(7) if (first_start + timedelta(days=offset)).weekday() in python_weekdays)
+    return [first + timedelta(days=offset) for offset in range(weeks * 7) if (first + timedelta(days=offset)).weekday() in python_weekdays]
+
+def _check_conflicts(clinic_id, user_id, location, starts, exclude_ids=()):
+    return find_conflicts(clinic_id, user_id, location, starts, timedelta(minutes=app.config['APPOINTMENT_DURATION_MINUTES']), check_location=app.config['CHECK_LOCATION_CONFLICTS'], exclude_ids=exclude_ids)
+
+def _conflict_response(conflicts):
+    return jsonify({'status': 'conflict', 'message': f'{len(conflicts)} horário(s) em conflito com outros agendamentos.', 'conflicts': conflicts}), 409
+
+@app.route('/api/cache/stats')
+#@login_required
+#@admin_required
+def api_cache_stats():
+    return jsonify(clinic_cache.stats())
+
+@app.route('/api/appointment/create_from_agenda', methods=['POST'])
+#@login_required
+def create_appointment_from_agenda():
+    clinic_id_to_use = current_user.clinic_id if current_user.is_authenticated else 1
+    professional = current_user if current_user.is_authenticated else User.query.get(1)
+    data = request.get_json() or {}
+    patient = Patient.query.filter_by(id=data.get('patient_id'), clinic_id=clinic_id_to_use).first()
+    if not patient:
+        return jsonify({'status': 'error', 'message': 'Paciente não encontrado.'}), 404
+    try:
+        first_start = _parse_client_datetime(data['start_datetime'])
+        session_price = float(data.get('session_price') or 0.0)
+        weeks_to_repeat = int(data.get('weeks_to_repeat') or 1)
+        # A recorrência é expandida na hora local do navegador, para que os dias da semana escolhidos não mudem ao passar para UTC.
+        utc_offset = timedelta(minutes=int(data.get('timezone_offset') or 0))
+        weekdays = [int(day) for day in data.get('weekdays') or []]
+        if any(not 0 <= day <= 6 for day in weekdays): raise ValueError('weekdays')
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'Dados do agendamento inválidos.'}), 400
+    is_recurring = bool(data.get('is_recurring'))
+    if is_recurring:
+        if not 1 <= weeks_to_repeat <= app.config['MAX_RECURRENCE_WEEKS']:
+            return jsonify({'status': 'error', 'message': f"O número de semanas deve estar entre 1 e {app.config['MAX_RECURRENCE_WEEKS']}."}), 400
+        occurrences = [local + utc_offset for local in _expand_recurrence(first_start - utc_offset, weekdays, weeks_to_repeat)]
+        recurrence_id = str(uuid.uuid4())
+    else:
+        occurrences = [first_start]
+        recurrence_id = None
+    location = data.get('location') or DEFAULT_LOCATION
+    if not data.get('force'):
+        conflicts = _check_conflicts(clinic_id_to_use, professional.id, location, occurrences)
+        if conflicts: return _conflict_response(conflicts)
+    try:
+        # A série inteira vai num único INSERT com RETURNING; o cursor da agenda é reservado uma só vez.
+        seq = reserve_change_seq(db.session, clinic_id_to_use)
+        rows = [{'start_time': start, 'location': location, 'status': 'Agendado', 'notes': data.get('notes'), 'session_price': session_price, 'amount_paid': 0.0, 'clinic_id': clinic_id_to_use, 'user_id': professional.id, 'patient_id': patient.id, 'is_recurring': is_recurring, 'recurrence_id': recurrence_id, 'updated_seq': seq} for start in occurrences]
+        created = db.session.execute(db.insert(Appointment).returning(Appointment.id, Appointment.start_time), rows).all()
+        created_ids = [appointment_id for appointment_id, _ in sorted(created, key=lambda row: row.start_time)]
+        apply_balance_delta(db.session, patient.id, due_delta=session_price * len(created_ids))
+        created_by_month = defaultdict(int)
+        for _, start in created: created_by_month[month_of(start)] += 1
+        for month, count in created_by_month.items(): apply_financial_delta(db.session, clinic_id_to_use, professional.id, month, {'billed': session_price * count, 'scheduled': count})
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'status': 'error', 'message': f'Ocorreu um erro interno: {e}'}), 500
+    _publish_agenda_change(clinic_id_to_use, 'created', created_ids)
+    message = 'Agendamento criado com sucesso.' if len(created_ids) == 1 else f'{len(created_ids)} agendamentos criados com sucesso.'
+    return jsonify({'status': 'success', 'message': message, 'ids': created_ids, 'recurrence_id': recurrence_id})
+
+@app.route('/api/patient/<int:patient_id>/financial_balance')
+#@login_required
+def api_patient_financial_balance(patient_id):
+    clinic_id_to_use = current_user.clinic_id if current_user.is_authenticated else 1
+    patient_balance = db.session.query(PatientBalance).join(Patient, PatientBalance.patient_id == Patient.id).filter(PatientBalance.patient_id == patient_id, Patient.clinic_id == clinic_id_to_use).first()
+    if patient_balance is None:
+        Patient.query.filter_by(id=patient_id, clinic_id=clinic_id_to_use).first_or_404()
+        return jsonify({'total_due': 0.0, 'total_paid': 0.0, 'balance': 0.0})
+    return jsonify({'total_due': patient_balance.total_due, 'total_paid': patient_balance.total_paid, 'balance': patient_balance.balance})
 
 @app.route('/api/appointment/<int:appointment_id>/<action>', methods=['POST'])
 #@login_required
 def handle_appointment_action(appointment_id, action):
     clinic_id_to_use = current_user.clinic_id if current_user.is_authenticated else 1
-    appointment = db.session.query(Appointment).join(User).filter(Appointment.id == appointment_id, User.clinic_id == clinic_id_to_use).first_or_404()
-    if action == 'complete': appointment.status = 'Concluído'; message = 'Agendamento marcado como concluído.'
-    elif action == 'cancel': appointment.status = 'Cancelado'; message = 'Agendamento cancelado com sucesso.'
-    elif action == 'delete': db.session.delete(appointment); message = 'Agendamento apagado permanentemente.'
+    appointment = Appointment.query.filter_by(id=appointment_id, clinic_id=clinic_id_to_use).first_or_404()
+    if action == 'complete': appointment.status = 'Concluído'; message = 'Agendamento marcado como concluído.'; change_type = 'updated'
+    elif action == 'cancel': appointment.status = 'Cancelado'; message = 'Agendamento cancelado com sucesso.'; change_type = 'cancelled'
+    elif action == 'delete': db.session.delete(appointment); message = 'Agendamento apagado permanentemente.'; change_type = 'deleted'
     else: return jsonify({'status': 'error', 'message': 'Ação inválida.'}), 400
     db.session.commit()
+    _publish_agenda_change(clinic_id_to_use, change_type, [appointment_id])
     return jsonify({'status': 'success', 'message': message})
 
 @app.route('/api/appointment/<int:appointment_id>/update', methods=['POST'])
 #@login_required
 def update_appointment(appointment_id):
     clinic_id_to_use = current_user.clinic_id if current_user.is_authenticated else 1
-    appointment = db.session.query(Appointment).join(User).filter(Appointment.id == appointment_id, User.clinic_id == clinic_id_to_use).first_or_404()
+    appointment = Appointment.query.filter_by(id=appointment_id, clinic_id=clinic_id_to_use).first_or_404()
     data = request.get_json()
     try:
-        if 'start_time' in data and data['start_time']: appointment.start_time = datetime.fromisoformat(data['start_time'].replace('Z', '+00:00'))
-        if 'location' in data: appointment.location = data['location']
+        new_start = _parse_client_datetime(data['start_time']) if data.get('start_time') else appointment.start_time
+        new_location = data['location'] if 'location' in data else appointment.location
+        moved = new_start != appointment.start_time or new_location != appointment.location
+        if moved and appointment.status != 'Cancelado' and not data.get('force'):
+            conflicts = _check_conflicts(clinic_id_to_use, appointment.user_id, new_location, [new_start], exclude_ids=[appointment.id])
+            if conflicts: return _conflict_response(conflicts)
+        appointment.start_time = new_start
+        appointment.location = new_location
         if 'notes' in data: appointment.notes = data['notes']
         if 'session_price' in data: appointment.session_price = float(data.get('session_price', 0.0) or 0.0)
         if 'amount_paid' in data: appointment.amount_paid = float(data.get('amount_paid', 0.0) or 0.0)
         if 'payment_notes' in data: appointment.payment_notes = data.get('payment_notes', '')
         db.session.commit()
+        _publish_agenda_change(clinic_id_to_use, 'updated', [appointment_id])
         return jsonify({'status': 'success', 'message': 'Agendamento atualizado com sucesso.'})
     except Exception as e:
         db.session.rollback()
         return jsonify({'status': 'error', 'message': f'Ocorreu um erro interno: {e}'}), 500
 
-# --- COMANDO PARA INICIALIZAR O BANCO DE DADOS ---
+# --- COMANDOS DE MANUTENÇÃO DO BANCO DE DADOS ---
 @app.cli.command("init-db")
 def init_db_command():
     db.create_all()
+    install_search_indexes(db.engine)
     print("Banco de dados inicializado e tabelas criadas.")
 
+@app.cli.command("reconcile-balances")
+def reconcile_balances_command():
+    total = rebuild_patient_balances(db.session)
+    db.session.commit()
+    print(f"Saldos financeiros recalculados para {total} pacientes.")
+
+@app.cli.command("rebuild-clinic-stats")
+def rebuild_clinic_stats_command():
+    total = rebuild_clinic_stats(db.session)
+    db.session.commit()
+    print(f"Estatísticas do painel recalculadas ({total} linhas).")
+
+@app.cli.command("refresh-age-bands")
+def refresh_age_bands_command():
+    # Executar diariamente (ex.: cron às 00:05): as faixas etárias mudam com a data, não com as gravações.
+    refresh_age_bands(db.session)
+    db.session.commit()
+    print("Faixas etárias atualizadas.")
+
+@app.cli.command("rebuild-monthly-financials")
+def rebuild_monthly_financials_command():
+    total = rebuild_monthly_financials(db.session)
+    db.session.commit()
+    print(f"Totais financeiros mensais recalculados ({total} linhas).")
+
+@app.cli.command("prune-tombstones")
+@click.option('--days', type=int, default=None, help='Idade mínima dos tombstones (padrão: TOMBSTONE_RETENTION_DAYS).')
+def prune_tombstones_command(days):
+    # Agendar diariamente (cron). Agendas abertas com um cursor anterior ao corte recebem 'resync' e recarregam tudo.
+    total = prune_tombstones(db.session, datetime.utcnow() - timedelta(days=app.config['TOMBSTONE_RETENTION_DAYS'] if days is None else days))
+    db.session.commit()
+    print(f"Tombstones de agendamentos apagados: {total}.")
+
+@app.cli.command("generate-variants")
+@click.option('--retry-failed', is_flag=True, help='Volta a tentar as variantes registadas como falhadas.')
+def generate_variants_command(retry_failed):
+    # Gera as variantes em falta dos anexos já enviados (arquivos antigos ou tarefas perdidas num reinício).
+    # Um anexo problemático fica registado e não interrompe os restantes.
+    if retry_failed:
+        FileVariant.query.filter_by(status=VARIANT_FAILED).delete(synchronize_session=False)
+        db.session.commit()
+    upload_ids = [upload_id for upload_id, in db.session.query(UploadedFile.id).filter(UploadedFile.status == UPLOAD_READY).order_by(UploadedFile.id)]
+    total, errors = 0, 0
+    for upload_id in upload_ids:
+        try:
+            total += generate_variants(storages, upload_id)
+        except Exception as e:
+            db.session.rollback()
+            errors += 1
+            app.logger.error(f"Erro ao gerar variantes do anexo {upload_id}: {e}")
+    failed = FileVariant.query.filter_by(status=VARIANT_FAILED).count()
+    print(f"Variantes geradas: {total} ({len(upload_ids)} anexos verificados, {failed} variantes com falha, {errors} anexos com erro).")
+
+@app.cli.command("sweep-uploads")
+@click.option('--stale-minutes', type=int, default=None, help='Idade mínima dos envios pendentes (padrão: UPLOAD_STALE_MINUTES).')
+def sweep_uploads_command(stale_minutes):
+    # Retoma os envios perdidos num reinício ou com a fila cheia e limpa os temporários órfãos; correr no arranque
+    # do serviço ou periodicamente (cron).
+    resumed, failed, removed = upload_queue.sweep(timedelta(minutes=app.config['UPLOAD_STALE_MINUTES'] if stale_minutes is None else stale_minutes))
+    print(f"Envios retomados: {resumed}; dados como falhados: {failed}; temporários apagados: {removed}.")
+
 if __name__ == '__main__':
     app.run(debug=True)
 
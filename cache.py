@@ -0,0 +1,122 @@
+import pickle
+import threading
+import time
+from collections import Counter, OrderedDict
+
+# Cache de dados (nunca de HTML) com TTL, particionado por (namespace, clínica).
+# Invalidar uma clínica incrementa a sua geração: as entradas antigas deixam de ser alcançáveis
+# e saem por LRU ou por expiração, sem varrer o armazenamento.
+# O InProcessBackend serve para um único processo; com vários workers do gunicorn use o RedisBackend
+# (CACHE_URL=redis://...), para que uma invalidação valha para todos.
+
+
+class InProcessBackend:
+    def __init__(self, max_entries=2000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def generation(self, scope):
+        return self._generations.get(scope, 0)
+
+    def bump_generation(self, scope):
+        with self._lock:
+            self._generations[scope] = self._generations.get(scope, 0) + 1
+
+
+class RedisBackend:
+    # A expiração fica a cargo do Redis; para LRU configure o servidor com maxmemory-policy allkeys-lru.
+    def __init__(self, url, prefix='clinic-cache'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("O pacote 'redis' é necessário para CACHE_URL=redis://...")
+        self._redis = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def __len__(self):
+        return self._redis.dbsize()
+
+    def _name(self, key):
+        return f'{self._prefix}:{key!r}'
+
+    def get(self, key):
+        data = self._redis.get(self._name(key))
+        return None if data is None else pickle.loads(data)
+
+    def set(self, key, value, ttl):
+        self._redis.set(self._name(key), pickle.dumps(value), ex=ttl)
+
+    def generation(self, scope):
+        return int(self._redis.get(self._name(('generation', scope))) or 0)
+
+    def bump_generation(self, scope):
+        self._redis.incr(self._name(('generation', scope)))
+
+
+class ClinicCache:
+    def __init__(self, backend=None, default_ttl=60):
+        self.backend = backend if backend is not None else InProcessBackend()
+        self.default_ttl = default_ttl
+        self._hits = Counter()
+        self._misses = Counter()
+        self._lock = threading.Lock()
+
+    def _key(self, namespace, clinic_id, key):
+        return (namespace, clinic_id, self.backend.generation((namespace, clinic_id)), key)
+
+    def get(self, namespace, clinic_id, key):
+        value = self.backend.get(self._key(namespace, clinic_id, key))
+        with self._lock:
+            (self._misses if value is None else self._hits)[namespace] += 1
+        return value
+
+    def set(self, namespace, clinic_id, key, value, ttl=None):
+        self.backend.set(self._key(namespace, clinic_id, key), value, ttl or self.default_ttl)
+
+    def get_or_set(self, namespace, clinic_id, key, compute, ttl=None):
+        value = self.get(namespace, clinic_id, key)
+        if value is None:
+            value = compute()
+            self.set(namespace, clinic_id, key, value, ttl)
+        return value
+
+    def invalidate(self, namespace, clinic_id):
+        self.backend.bump_generation((namespace, clinic_id))
+
+    def stats(self):
+        # Contadores deste processo, para dimensionar max_entries e os TTLs.
+        with self._lock:
+            namespaces = {namespace: {'hits': self._hits[namespace], 'misses': self._misses[namespace], 'hit_rate': round(self._hits[namespace] / (self._hits[namespace] + self._misses[namespace]), 3)} for namespace in set(self._hits) | set(self._misses)}
+        return {'entries': len(self.backend), 'namespaces': namespaces}
+
+
+def create_cache(url=None, max_entries=2000, default_ttl=60):
+    if not url or url.startswith('memory://'):
+        return ClinicCache(InProcessBackend(max_entries), default_ttl)
+    if url.startswith(('redis://', 'rediss://')):
+        return ClinicCache(RedisBackend(url), default_ttl)
+    raise ValueError(f'CACHE_URL não suportado: {url}')
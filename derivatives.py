@@ -0,0 +1,134 @@
+import logging
+import mimetypes
+import os
+import tempfile
+from PIL import Image, ImageOps
+from models import db, UploadedFile, FileVariant
+from storage import LocalStorage, VARIANT_PREFIX
+from uploads import UPLOAD_READY
+
+try:
+    import pypdfium2
+except ImportError:
+    pypdfium2 = None
+
+# Variantes dos anexos, geradas em segundo plano depois do envio (ver UploadQueue.on_ready) ou pelo comando
+# generate-variants. 'thumb' serve a lista da avaliação e 'web' a visualização; o original só é entregue quando
+# pedido. Imagens rasterizadas ganham as duas; PDFs só a miniatura da primeira página (pypdfium2, em requirements.txt;
+# sem ele os PDFs ficam sem miniatura). SVG e outros formatos que o Pillow não lê ficam só com o original.
+# Storage local: o Pillow reduz a imagem (orientação EXIF aplicada, JPEG progressivo) e a variante é gravada
+# pelo próprio storage, endereçada pelo conteúdo. Cloudinary: a variante é um URL de transformação (c_limit).
+
+VARIANT_SIZES = {'thumb': 320, 'web': 1600}  # do menor para o maior
+RASTER_CONTENT_TYPES = {'image/jpeg', 'image/png', 'image/webp', 'image/gif', 'image/bmp', 'image/tiff'}
+# Cada tipo tentado fica registado: 'ready' (gerada), 'skipped' (não seria menor que o original) ou 'failed'
+# (arquivo corrompido ou ilegível). Só os 'failed' voltam a ser tentados, e só com generate-variants --retry-failed.
+VARIANT_READY, VARIANT_SKIPPED, VARIANT_FAILED = 'ready', 'skipped', 'failed'
+JPEG_QUALITY = 80
+
+logger = logging.getLogger(__name__)
+
+
+def pick_variant(uploaded, size):
+    # A variante pedida ou, se ainda não existe, a próxima maior; None significa servir o original.
+    if size not in VARIANT_SIZES:
+        return None
+    available = {variant.kind: variant for variant in uploaded.variants if variant.status == VARIANT_READY}
+    kinds = list(VARIANT_SIZES)
+    return next((available[kind] for kind in kinds[kinds.index(size):] if kind in available), None)
+
+
+def _content_type(uploaded):
+    return uploaded.content_type or mimetypes.guess_type(uploaded.original_filename or uploaded.secure_url or '')[0] or ''
+
+
+def _variant_kinds(content_type):
+    if content_type in RASTER_CONTENT_TYPES:
+        return list(VARIANT_SIZES)
+    if content_type == 'application/pdf' and pypdfium2 is not None:
+        return ['thumb']
+    return []
+
+
+def _open_image(path, content_type, max_side):
+    if content_type == 'application/pdf':
+        pdf = pypdfium2.PdfDocument(path)
+        try:
+            page = pdf[0]
+            return page.render(scale=max_side / max(page.get_size())).to_pil()
+        finally:
+            pdf.close()
+    image = Image.open(path)
+    # Num JPEG, o draft descodifica já reduzido (1/2 a 1/8), sem ler a foto inteira em resolução total.
+    image.draft('RGB', (max_side, max_side))
+    return ImageOps.exif_transpose(image)
+
+
+def _render(path, content_type, max_side, directory):
+    image = _open_image(path, content_type, max_side)
+    image.thumbnail((max_side, max_side), Image.LANCZOS, reducing_gap=3.0)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    elif image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    os.makedirs(directory, exist_ok=True)
+    descriptor, output = tempfile.mkstemp(prefix=VARIANT_PREFIX, suffix='.jpg', dir=directory)
+    try:
+        with os.fdopen(descriptor, 'wb') as rendered:
+            image.save(rendered, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    except Exception:
+        os.remove(output)
+        raise
+    return output, image.size
+
+
+def _local_variant(storage, uploaded, content_type, max_side):
+    output, (width, height) = _render(storage.path(uploaded.public_id), content_type, max_side, storage.incoming_dir)
+    if content_type != 'application/pdf' and uploaded.size and os.path.getsize(output) >= uploaded.size:
+        # Não é menor do que o original: fica o original.
+        os.remove(output)
+        return None
+    return dict(storage.save(output, 'variant.jpg'), width=width, height=height)
+
+
+def _cloudinary_variant(uploaded, content_type, max_side):
+    import cloudinary.utils
+    options = {'resource_type': 'image', 'crop': 'limit', 'width': max_side, 'height': max_side, 'quality': 'auto', 'secure': True}
+    if content_type == 'application/pdf':
+        options.update(format='jpg', page=1)
+    else:
+        options.update(fetch_format='auto')
+    url = cloudinary.utils.cloudinary_url(uploaded.public_id, **options)[0]
+    return {'public_id': uploaded.public_id, 'secure_url': url, 'resource_type': 'image', 'content_type': 'image/jpeg' if content_type == 'application/pdf' else content_type}
+
+
+def generate_variants(storages, upload_id):
+    # Idempotente: só trata os tipos ainda sem registo. Cada tipo é gravado no seu próprio commit, para que uma
+    # falha a meio não deite fora o que já foi gerado. Devolve quantas variantes criou.
+    uploaded = db.session.get(UploadedFile, upload_id)
+    if uploaded is None or uploaded.status != UPLOAD_READY:
+        return 0
+    storage = storages[uploaded.storage]
+    content_type = _content_type(uploaded)
+    existing = {variant.kind for variant in uploaded.variants}
+    created = 0
+    for kind in _variant_kinds(content_type):
+        if kind in existing:
+            continue
+        try:
+            if isinstance(storage, LocalStorage):
+                stored = _local_variant(storage, uploaded, content_type, VARIANT_SIZES[kind])
+            else:
+                stored = _cloudinary_variant(uploaded, content_type, VARIANT_SIZES[kind])
+            variant = FileVariant(uploaded_file_id=upload_id, kind=kind, storage=storage.name, status=VARIANT_READY if stored else VARIANT_SKIPPED, **(stored or {}))
+        except Exception as error:
+            db.session.rollback()
+            logger.exception('Falha ao gerar a variante %s do anexo %s', kind, upload_id)
+            variant = FileVariant(uploaded_file_id=upload_id, kind=kind, storage=storage.name, status=VARIANT_FAILED, error=str(error)[:255])
+        db.session.add(variant)
+        db.session.commit()
+        created += variant.status == VARIANT_READY
+    return created
@@ -58,3 +58,21 @@ class ExerciseForm(FlaskForm):
     video_url = StringField('Link do Vídeo (YouTube, Vimeo, etc.)', validators=[Optional(), URL(message="Por favor, insira uma URL válida.")])
     submit = SubmitField('Salvar Exercício')
 
+
+class AssessmentForm(FlaskForm):
+    main_complaint = TextAreaField('Queixa Principal (QP)', validators=[Optional()])
+    history_of_present_illness = TextAreaField('História da Doença Atual (HDA)', validators=[Optional()])
+    past_medical_history = TextAreaField('História Patológica Pregressa (HPP)', validators=[Optional()])
+    medications = TextAreaField('Medicamentos em Uso', validators=[Optional()])
+    social_history = TextAreaField('História Social e Hábitos de Vida', validators=[Optional()])
+    inspection_notes = TextAreaField('Inspeção', validators=[Optional()])
+    palpation_notes = TextAreaField('Palpação', validators=[Optional()])
+    mobility_assessment = TextAreaField('Avaliação da Mobilidade', validators=[Optional()])
+    strength_assessment = TextAreaField('Avaliação da Força Muscular', validators=[Optional()])
+    neuro_assessment = TextAreaField('Avaliação Neurológica', validators=[Optional()])
+    functional_assessment = TextAreaField('Avaliação Funcional e Testes Específicos', validators=[Optional()])
+    files = MultipleFileField('Anexar Exames (imagens ou PDF)', validators=[Optional()])
+    diagnosis = TextAreaField('Diagnóstico Fisioterapêutico', validators=[Optional()])
+    goals = TextAreaField('Objetivos (Curto, Médio e Longo Prazo)', validators=[Optional()])
+    treatment_plan = TextAreaField('Plano de Tratamento', validators=[Optional()])
+    submit = SubmitField('Salvar Avaliação')
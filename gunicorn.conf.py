@@ -0,0 +1,9 @@
+import os
+
+# Lido pelo gunicorn no arranque (gunicorn app:app). A agenda mantém um pedido aberto por separador
+# (/api/appointments/stream): com workers síncronos cada separador prenderia um processo inteiro. Com gthread cada
+# ligação ocupa só uma thread, e o próprio stream termina a cada AGENDA_STREAM_MAX_SECONDS.
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
@@ -0,0 +1,42 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Fila de tarefas em segundo plano executadas neste processo, cada uma dentro de um app context.
+# Com workers=0 a tarefa corre no próprio chamador (scripts e testes, sem threads).
+# max_pending limita as tarefas à espera: com a fila cheia, submit devolve False na hora em vez de bloquear o pedido,
+# e quem submete decide o que fazer (os envios ficam 'pending' para o comando sweep-uploads).
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    def __init__(self, app, name, workers=2, max_pending=64):
+        self.app = app
+        self.name = name
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name) if workers else None
+        self._slots = threading.BoundedSemaphore(max_pending) if workers else None
+
+    def submit(self, function, *args):
+        # True se a tarefa foi aceite (ou já correu, com workers=0).
+        if self._executor is None:
+            self._run(function, args)
+            return True
+        if not self._slots.acquire(blocking=False):
+            logger.warning('Fila %s cheia: %s não foi submetida', self.name, function.__name__)
+            return False
+        try:
+            future = self._executor.submit(self._run, function, args)
+        except RuntimeError:
+            # Executor já encerrado (o processo está a terminar).
+            self._slots.release()
+            return False
+        future.add_done_callback(lambda _: self._slots.release())
+        return True
+
+    def _run(self, function, args):
+        with self.app.app_context():
+            try:
+                function(*args)
+            except Exception:
+                logger.exception('Falha na tarefa %s da fila %s', function.__name__, self.name)
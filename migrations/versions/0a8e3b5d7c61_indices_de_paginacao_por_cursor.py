@@ -0,0 +1,32 @@
+"""Índices para paginação por cursor de pacientes e exercícios
+
+Revision ID: 0a8e3b5d7c61
+Revises: f4b29a6c8d13
+Create Date: 2026-10-18 17:20:38.650142
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0a8e3b5d7c61'
+down_revision = 'f4b29a6c8d13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('patient', schema=None) as batch_op:
+        batch_op.create_index('ix_patient_clinic_id_full_name_id', ['clinic_id', 'full_name', 'id'], unique=False)
+
+    with op.batch_alter_table('exercise', schema=None) as batch_op:
+        batch_op.create_index('ix_exercise_clinic_id_name_id', ['clinic_id', 'name', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('exercise', schema=None) as batch_op:
+        batch_op.drop_index('ix_exercise_clinic_id_name_id')
+
+    with op.batch_alter_table('patient', schema=None) as batch_op:
+        batch_op.drop_index('ix_patient_clinic_id_full_name_id')
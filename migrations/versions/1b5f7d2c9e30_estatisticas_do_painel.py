@@ -0,0 +1,81 @@
+"""Estatísticas pré-calculadas do painel por clínica
+
+Revision ID: 1b5f7d2c9e30
+Revises: 0a8e3b5d7c61
+Create Date: 2026-10-18 17:55:12.408316
+
+"""
+from datetime import date
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1b5f7d2c9e30'
+down_revision = '0a8e3b5d7c61'
+branch_labels = None
+depends_on = None
+
+
+def _years_before(day, years):
+    try:
+        return day.replace(year=day.year - years)
+    except ValueError:
+        return day.replace(year=day.year - years, day=28)
+
+
+def upgrade():
+    clinic_stat = op.create_table('clinic_stat',
+    sa.Column('clinic_id', sa.Integer(), nullable=False),
+    sa.Column('dimension', sa.String(length=20), nullable=False),
+    sa.Column('bucket', sa.String(length=100), nullable=False),
+    sa.Column('value', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['clinic_id'], ['clinic.id'], ),
+    sa.PrimaryKeyConstraint('clinic_id', 'dimension', 'bucket')
+    )
+    patient_session_stat = op.create_table('patient_session_stat',
+    sa.Column('patient_id', sa.Integer(), nullable=False),
+    sa.Column('month', sa.Date(), nullable=False),
+    sa.Column('clinic_id', sa.Integer(), nullable=False),
+    sa.Column('completed', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['clinic_id'], ['clinic.id'], ),
+    sa.ForeignKeyConstraint(['patient_id'], ['patient.id'], ),
+    sa.PrimaryKeyConstraint('patient_id', 'month')
+    )
+    with op.batch_alter_table('patient_session_stat', schema=None) as batch_op:
+        batch_op.create_index('ix_patient_session_stat_clinic_id_month_completed', ['clinic_id', 'month', 'completed'], unique=False)
+
+    # Carga inicial (mesma regra do comando rebuild-clinic-stats).
+    patient = sa.table('patient', sa.column('id', sa.Integer), sa.column('clinic_id', sa.Integer), sa.column('gender', sa.String), sa.column('specialty', sa.String), sa.column('date_of_birth', sa.Date))
+    appointment = sa.table('appointment', sa.column('id', sa.Integer), sa.column('clinic_id', sa.Integer), sa.column('patient_id', sa.Integer), sa.column('status', sa.String), sa.column('start_time', sa.DateTime))
+    today = date.today()
+    age_band = sa.case(
+        (patient.c.date_of_birth > _years_before(today, 19), '0-18'),
+        (patient.c.date_of_birth > _years_before(today, 31), '19-30'),
+        (patient.c.date_of_birth > _years_before(today, 51), '31-50'),
+        else_='51+')
+    for dimension, bucket in (
+        ('gender', sa.func.coalesce(sa.func.nullif(patient.c.gender, ''), 'Não Esp.')),
+        ('specialty', sa.func.coalesce(sa.func.nullif(patient.c.specialty, ''), 'N/A')),
+        ('age_band', age_band),
+    ):
+        op.execute(clinic_stat.insert().from_select(
+            ['clinic_id', 'dimension', 'bucket', 'value'],
+            sa.select(patient.c.clinic_id, sa.literal(dimension), bucket, sa.func.count(patient.c.id)).group_by(patient.c.clinic_id, bucket)
+        ))
+    if op.get_bind().dialect.name == 'postgresql':
+        month = sa.cast(sa.func.date_trunc('month', appointment.c.start_time), sa.Date)
+    else:
+        month = sa.func.date(appointment.c.start_time, 'start of month')
+    op.execute(patient_session_stat.insert().from_select(
+        ['clinic_id', 'patient_id', 'month', 'completed'],
+        sa.select(appointment.c.clinic_id, appointment.c.patient_id, month, sa.func.count(appointment.c.id)).where(appointment.c.status == 'Concluído').group_by(appointment.c.clinic_id, appointment.c.patient_id, month)
+    ))
+
+
+def downgrade():
+    with op.batch_alter_table('patient_session_stat', schema=None) as batch_op:
+        batch_op.drop_index('ix_patient_session_stat_clinic_id_month_completed')
+
+    op.drop_table('patient_session_stat')
+    op.drop_table('clinic_stat')
@@ -0,0 +1,26 @@
+"""Índice de cobertura para o painel filtrado por profissional
+
+Revision ID: 2c7e9a4f1d86
+Revises: 1b5f7d2c9e30
+Create Date: 2026-10-18 18:12:47.219534
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2c7e9a4f1d86'
+down_revision = '1b5f7d2c9e30'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('appointment', schema=None) as batch_op:
+        batch_op.create_index('ix_appointment_user_id_status_start_time', ['user_id', 'status', 'start_time', 'patient_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('appointment', schema=None) as batch_op:
+        batch_op.drop_index('ix_appointment_user_id_status_start_time')
@@ -0,0 +1,26 @@
+"""Índice composto (user_id, start_time) para a janela da agenda
+
+Revision ID: 3c9a1f5e2b7d
+Revises: 1693e7f160b8
+Create Date: 2026-10-18 09:12:04.518230
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c9a1f5e2b7d'
+down_revision = '1693e7f160b8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('appointment', schema=None) as batch_op:
+        batch_op.create_index('ix_appointment_user_id_start_time', ['user_id', 'start_time'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('appointment', schema=None) as batch_op:
+        batch_op.drop_index('ix_appointment_user_id_start_time')
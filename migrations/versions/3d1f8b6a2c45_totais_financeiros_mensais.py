@@ -0,0 +1,55 @@
+"""Totais financeiros mensais por clínica e profissional
+
+Revision ID: 3d1f8b6a2c45
+Revises: 2c7e9a4f1d86
+Create Date: 2026-10-18 18:47:03.561920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3d1f8b6a2c45'
+down_revision = '2c7e9a4f1d86'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    monthly_financial_stat = op.create_table('monthly_financial_stat',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('month', sa.Date(), nullable=False),
+    sa.Column('clinic_id', sa.Integer(), nullable=False),
+    sa.Column('billed', sa.Float(), nullable=False),
+    sa.Column('received', sa.Float(), nullable=False),
+    sa.Column('scheduled', sa.Integer(), nullable=False),
+    sa.Column('completed', sa.Integer(), nullable=False),
+    sa.Column('cancelled', sa.Integer(), nullable=False),
+    sa.Column('no_show', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['clinic_id'], ['clinic.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'month')
+    )
+    with op.batch_alter_table('monthly_financial_stat', schema=None) as batch_op:
+        batch_op.create_index('ix_monthly_financial_stat_clinic_id_month', ['clinic_id', 'month'], unique=False)
+
+    # Carga inicial (mesma regra do comando rebuild-monthly-financials).
+    appointment = sa.table('appointment', sa.column('clinic_id', sa.Integer), sa.column('user_id', sa.Integer), sa.column('start_time', sa.DateTime), sa.column('status', sa.String), sa.column('session_price', sa.Float), sa.column('amount_paid', sa.Float))
+    if op.get_bind().dialect.name == 'postgresql':
+        month = sa.cast(sa.func.date_trunc('month', appointment.c.start_time), sa.Date)
+    else:
+        month = sa.func.date(appointment.c.start_time, 'start of month')
+    counts = [sa.func.coalesce(sa.func.sum(sa.case((appointment.c.status == status, 1), else_=0)), 0) for status in ('Agendado', 'Concluído', 'Cancelado', 'Faltou')]
+    op.execute(monthly_financial_stat.insert().from_select(
+        ['clinic_id', 'user_id', 'month', 'billed', 'received', 'scheduled', 'completed', 'cancelled', 'no_show'],
+        sa.select(appointment.c.clinic_id, appointment.c.user_id, month, sa.func.coalesce(sa.func.sum(appointment.c.session_price), 0.0), sa.func.coalesce(sa.func.sum(appointment.c.amount_paid), 0.0), *counts)
+        .group_by(appointment.c.clinic_id, appointment.c.user_id, month)
+    ))
+
+
+def downgrade():
+    with op.batch_alter_table('monthly_financial_stat', schema=None) as batch_op:
+        batch_op.drop_index('ix_monthly_financial_stat_clinic_id_month')
+
+    op.drop_table('monthly_financial_stat')
@@ -0,0 +1,26 @@
+"""Índice da linha do tempo de avaliações por paciente
+
+Revision ID: 4e2a9c7b5f18
+Revises: 3d1f8b6a2c45
+Create Date: 2026-10-18 19:20:31.904417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4e2a9c7b5f18'
+down_revision = '3d1f8b6a2c45'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('assessment', schema=None) as batch_op:
+        batch_op.create_index('ix_assessment_patient_id_created_at', ['patient_id', 'created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('assessment', schema=None) as batch_op:
+        batch_op.drop_index('ix_assessment_patient_id_created_at')
@@ -0,0 +1,66 @@
+"""Pesquisa de texto nas notas clínicas (registos SOAP e avaliações)
+
+Revision ID: 5f3b1d8e9a27
+Revises: 4e2a9c7b5f18
+Create Date: 2026-10-18 19:41:26.730514
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f3b1d8e9a27'
+down_revision = '4e2a9c7b5f18'
+branch_labels = None
+depends_on = None
+
+# Cópia de search.CLINICAL_SOURCES, para a migração não depender do código da aplicação.
+SOURCES = [
+    ('record', 'electronic_record', 0, ['medical_diagnosis', 'subjective_notes', 'objective_notes', 'assessment', 'plan']),
+    ('assessment', 'assessment', 1, ['main_complaint', 'history_of_present_illness', 'past_medical_history', 'medications', 'social_history',
+                                     'inspection_notes', 'palpation_notes', 'mobility_assessment', 'strength_assessment', 'neuro_assessment',
+                                     'functional_assessment', 'diagnosis', 'goals', 'treatment_plan']),
+]
+
+
+def _document(fields, alias=None):
+    prefix = f'{alias}.' if alias else ''
+    return " || ' ' || ".join(f"coalesce({prefix}{field}, '')" for field in fields)
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        op.execute("CREATE EXTENSION IF NOT EXISTS unaccent")
+        op.execute("DO $$ BEGIN "
+                   "IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'pt_unaccent') THEN "
+                   "CREATE TEXT SEARCH CONFIGURATION pt_unaccent (COPY = portuguese); "
+                   "ALTER TEXT SEARCH CONFIGURATION pt_unaccent ALTER MAPPING FOR hword, hword_part, word WITH unaccent, portuguese_stem; "
+                   "END IF; END $$")
+        for kind, table, parity, fields in SOURCES:
+            op.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_search ON {table} USING gin (to_tsvector('pt_unaccent', {_document(fields)}))")
+    elif bind.dialect.name == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE IF NOT EXISTS clinical_search USING fts5(kind UNINDEXED, source_id UNINDEXED, clinic_id UNINDEXED, patient_id UNINDEXED, body, tokenize='unicode61 remove_diacritics 2')")
+        for kind, table, parity, fields in SOURCES:
+            insert_row = (f"INSERT INTO clinical_search(rowid, kind, source_id, clinic_id, patient_id, body) "
+                          f"VALUES (new.id * 2 + {parity}, '{kind}', new.id, new.clinic_id, new.patient_id, {_document(fields, 'new')}); ")
+            delete_row = f"DELETE FROM clinical_search WHERE rowid = old.id * 2 + {parity}; "
+            op.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_search_ai AFTER INSERT ON {table} BEGIN {insert_row}END")
+            op.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_search_ad AFTER DELETE ON {table} BEGIN {delete_row}END")
+            op.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_search_au AFTER UPDATE ON {table} BEGIN {delete_row}{insert_row}END")
+            op.execute(f"INSERT INTO clinical_search(rowid, kind, source_id, clinic_id, patient_id, body) "
+                       f"SELECT id * 2 + {parity}, '{kind}', id, clinic_id, patient_id, {_document(fields)} FROM {table}")
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        for kind, table, parity, fields in SOURCES:
+            op.execute(f"DROP INDEX IF EXISTS ix_{table}_search")
+        op.execute("DROP TEXT SEARCH CONFIGURATION IF EXISTS pt_unaccent")
+    elif bind.dialect.name == 'sqlite':
+        for kind, table, parity, fields in SOURCES:
+            for suffix in ('ai', 'ad', 'au'):
+                op.execute(f"DROP TRIGGER IF EXISTS {table}_search_{suffix}")
+        op.execute("DROP TABLE IF EXISTS clinical_search")
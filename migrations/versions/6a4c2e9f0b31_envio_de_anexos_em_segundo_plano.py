@@ -0,0 +1,38 @@
+"""Envio de anexos em segundo plano (status do UploadedFile)
+
+Revision ID: 6a4c2e9f0b31
+Revises: 5f3b1d8e9a27
+Create Date: 2026-10-18 20:12:54.118207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a4c2e9f0b31'
+down_revision = '5f3b1d8e9a27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('uploaded_file', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('status', sa.String(length=20), server_default='ready', nullable=False))
+        batch_op.add_column(sa.Column('original_filename', sa.String(length=255), nullable=True))
+        batch_op.add_column(sa.Column('error', sa.String(length=255), nullable=True))
+        batch_op.alter_column('public_id', existing_type=sa.String(length=255), nullable=True)
+        batch_op.alter_column('secure_url', existing_type=sa.String(length=512), nullable=True)
+        batch_op.alter_column('resource_type', existing_type=sa.String(length=50), nullable=True)
+
+
+def downgrade():
+    # Envios que não chegaram a terminar não têm destino e não cabem no esquema antigo.
+    op.execute("DELETE FROM uploaded_file WHERE status <> 'ready'")
+    with op.batch_alter_table('uploaded_file', schema=None) as batch_op:
+        batch_op.alter_column('resource_type', existing_type=sa.String(length=50), nullable=False)
+        batch_op.alter_column('secure_url', existing_type=sa.String(length=512), nullable=False)
+        batch_op.alter_column('public_id', existing_type=sa.String(length=255), nullable=False)
+        batch_op.drop_column('error')
+        batch_op.drop_column('original_filename')
+        batch_op.drop_column('status')
@@ -0,0 +1,30 @@
+"""Armazenamento de anexos configurável (Cloudinary ou local)
+
+Revision ID: 7c5d3f0a1e42
+Revises: 6a4c2e9f0b31
+Create Date: 2026-10-18 20:48:09.305716
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c5d3f0a1e42'
+down_revision = '6a4c2e9f0b31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('uploaded_file', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('storage', sa.String(length=20), server_default='cloudinary', nullable=False))
+        batch_op.add_column(sa.Column('content_type', sa.String(length=100), nullable=True))
+        batch_op.add_column(sa.Column('size', sa.BigInteger(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('uploaded_file', schema=None) as batch_op:
+        batch_op.drop_column('size')
+        batch_op.drop_column('content_type')
+        batch_op.drop_column('storage')
@@ -0,0 +1,50 @@
+"""Cursor de alterações da agenda (change_seq, updated_seq e tombstones)
+
+Revision ID: 7e4d2a9c6f10
+Revises: 3c9a1f5e2b7d
+Create Date: 2026-10-18 10:03:41.220917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e4d2a9c6f10'
+down_revision = '3c9a1f5e2b7d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('clinic', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('change_seq', sa.BigInteger(), server_default='0', nullable=False))
+
+    with op.batch_alter_table('appointment', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_seq', sa.BigInteger(), server_default='0', nullable=False))
+        batch_op.create_index(batch_op.f('ix_appointment_updated_seq'), ['updated_seq'], unique=False)
+
+    op.create_table('appointment_tombstone',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('clinic_id', sa.Integer(), nullable=False),
+    sa.Column('appointment_id', sa.Integer(), nullable=False),
+    sa.Column('deleted_seq', sa.BigInteger(), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['clinic_id'], ['clinic.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('appointment_tombstone', schema=None) as batch_op:
+        batch_op.create_index('ix_appointment_tombstone_clinic_id_deleted_seq', ['clinic_id', 'deleted_seq'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('appointment_tombstone', schema=None) as batch_op:
+        batch_op.drop_index('ix_appointment_tombstone_clinic_id_deleted_seq')
+
+    op.drop_table('appointment_tombstone')
+    with op.batch_alter_table('appointment', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_appointment_updated_seq'))
+        batch_op.drop_column('updated_seq')
+
+    with op.batch_alter_table('clinic', schema=None) as batch_op:
+        batch_op.drop_column('change_seq')
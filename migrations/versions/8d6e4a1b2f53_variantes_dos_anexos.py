@@ -0,0 +1,39 @@
+"""Variantes dos anexos (miniaturas e versões web)
+
+Revision ID: 8d6e4a1b2f53
+Revises: 7c5d3f0a1e42
+Create Date: 2026-10-18 21:26:37.912480
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d6e4a1b2f53'
+down_revision = '7c5d3f0a1e42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('file_variant',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('uploaded_file_id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('storage', sa.String(length=20), nullable=False),
+    sa.Column('public_id', sa.String(length=255), nullable=False),
+    sa.Column('secure_url', sa.String(length=512), nullable=True),
+    sa.Column('resource_type', sa.String(length=50), nullable=True),
+    sa.Column('content_type', sa.String(length=100), nullable=True),
+    sa.Column('width', sa.Integer(), nullable=True),
+    sa.Column('height', sa.Integer(), nullable=True),
+    sa.Column('size', sa.BigInteger(), nullable=True),
+    sa.ForeignKeyConstraint(['uploaded_file_id'], ['uploaded_file.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('uploaded_file_id', 'kind', name='uq_file_variant_uploaded_file_id_kind')
+    )
+
+
+def downgrade():
+    op.drop_table('file_variant')
@@ -0,0 +1,32 @@
+"""Estado das variantes dos anexos (geradas, ignoradas ou falhadas)
+
+Revision ID: 9e7f5b2c3a64
+Revises: 8d6e4a1b2f53
+Create Date: 2026-10-19 10:14:22.604185
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e7f5b2c3a64'
+down_revision = '8d6e4a1b2f53'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('file_variant', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('status', sa.String(length=20), server_default='ready', nullable=False))
+        batch_op.add_column(sa.Column('error', sa.String(length=255), nullable=True))
+        batch_op.alter_column('public_id', existing_type=sa.String(length=255), nullable=True)
+
+
+def downgrade():
+    # Os marcadores sem arquivo não cabem no esquema antigo.
+    op.execute("DELETE FROM file_variant WHERE status <> 'ready'")
+    with op.batch_alter_table('file_variant', schema=None) as batch_op:
+        batch_op.alter_column('public_id', existing_type=sa.String(length=255), nullable=False)
+        batch_op.drop_column('error')
+        batch_op.drop_column('status')
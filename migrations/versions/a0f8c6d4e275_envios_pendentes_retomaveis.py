@@ -0,0 +1,28 @@
+"""Envios pendentes retomáveis (arquivo temporário e hora de entrada na fila)
+
+Revision ID: a0f8c6d4e275
+Revises: 9e7f5b2c3a64
+Create Date: 2026-10-19 16:02:47.318502
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a0f8c6d4e275'
+down_revision = '9e7f5b2c3a64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('uploaded_file', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('spool_path', sa.String(length=512), nullable=True))
+        batch_op.add_column(sa.Column('queued_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('uploaded_file', schema=None) as batch_op:
+        batch_op.drop_column('queued_at')
+        batch_op.drop_column('spool_path')
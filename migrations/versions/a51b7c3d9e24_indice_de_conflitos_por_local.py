@@ -0,0 +1,26 @@
+"""Índice (location, start_time) para a deteção de conflitos por local
+
+Revision ID: a51b7c3d9e24
+Revises: 7e4d2a9c6f10
+Create Date: 2026-10-18 11:27:15.604482
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a51b7c3d9e24'
+down_revision = '7e4d2a9c6f10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('appointment', schema=None) as batch_op:
+        batch_op.create_index('ix_appointment_location_start_time', ['location', 'start_time'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('appointment', schema=None) as batch_op:
+        batch_op.drop_index('ix_appointment_location_start_time')
@@ -0,0 +1,89 @@
+"""Clínica como termo indexado nas tabelas FTS5 (pesquisa de pacientes e notas)
+
+Revision ID: b1c9e7d5f386
+Revises: a0f8c6d4e275
+Create Date: 2026-10-19 17:25:09.884213
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b1c9e7d5f386'
+down_revision = 'a0f8c6d4e275'
+branch_labels = None
+depends_on = None
+
+# Cópia de search.CLINICAL_SOURCES, para a migração não depender do código da aplicação.
+SOURCES = [
+    ('record', 'electronic_record', 0, ['medical_diagnosis', 'subjective_notes', 'objective_notes', 'assessment', 'plan']),
+    ('assessment', 'assessment', 1, ['main_complaint', 'history_of_present_illness', 'past_medical_history', 'medications', 'social_history',
+                                     'inspection_notes', 'palpation_notes', 'mobility_assessment', 'strength_assessment', 'neuro_assessment',
+                                     'functional_assessment', 'diagnosis', 'goals', 'treatment_plan']),
+]
+TRIGGERS = ['patient_search_ai', 'patient_search_ad', 'patient_search_au'] + [
+    f'{table}_search_{suffix}' for kind, table, parity, fields in SOURCES for suffix in ('ai', 'ad', 'au')]
+
+
+def _document(fields, alias=None):
+    prefix = f'{alias}.' if alias else ''
+    return " || ' ' || ".join(f"coalesce({prefix}{field}, '')" for field in fields)
+
+
+def _drop_all():
+    for trigger in TRIGGERS:
+        op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    op.execute("DROP TABLE IF EXISTS patient_search")
+    op.execute("DROP TABLE IF EXISTS clinical_search")
+
+
+def upgrade():
+    # Só o SQLite usa FTS5; no PostgreSQL nada muda.
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    _drop_all()
+    op.execute("CREATE VIRTUAL TABLE patient_search USING fts5(search_name, clinic, tokenize='unicode61 remove_diacritics 2')")
+    op.execute("CREATE TRIGGER patient_search_ai AFTER INSERT ON patient BEGIN "
+               "INSERT INTO patient_search(rowid, search_name, clinic) VALUES (new.id, new.search_name, 'clinic' || new.clinic_id); END")
+    op.execute("CREATE TRIGGER patient_search_ad AFTER DELETE ON patient BEGIN "
+               "DELETE FROM patient_search WHERE rowid = old.id; END")
+    op.execute("CREATE TRIGGER patient_search_au AFTER UPDATE OF search_name, clinic_id ON patient BEGIN "
+               "DELETE FROM patient_search WHERE rowid = old.id; "
+               "INSERT INTO patient_search(rowid, search_name, clinic) VALUES (new.id, new.search_name, 'clinic' || new.clinic_id); END")
+    op.execute("INSERT INTO patient_search(rowid, search_name, clinic) SELECT id, search_name, 'clinic' || clinic_id FROM patient")
+    op.execute("CREATE VIRTUAL TABLE clinical_search USING fts5(kind UNINDEXED, source_id UNINDEXED, clinic, patient_id UNINDEXED, body, tokenize='unicode61 remove_diacritics 2')")
+    for kind, table, parity, fields in SOURCES:
+        insert_row = (f"INSERT INTO clinical_search(rowid, kind, source_id, clinic, patient_id, body) "
+                      f"VALUES (new.id * 2 + {parity}, '{kind}', new.id, 'clinic' || new.clinic_id, new.patient_id, {_document(fields, 'new')}); ")
+        delete_row = f"DELETE FROM clinical_search WHERE rowid = old.id * 2 + {parity}; "
+        op.execute(f"CREATE TRIGGER {table}_search_ai AFTER INSERT ON {table} BEGIN {insert_row}END")
+        op.execute(f"CREATE TRIGGER {table}_search_ad AFTER DELETE ON {table} BEGIN {delete_row}END")
+        op.execute(f"CREATE TRIGGER {table}_search_au AFTER UPDATE ON {table} BEGIN {delete_row}{insert_row}END")
+        op.execute(f"INSERT INTO clinical_search(rowid, kind, source_id, clinic, patient_id, body) "
+                   f"SELECT id * 2 + {parity}, '{kind}', id, 'clinic' || clinic_id, patient_id, {_document(fields)} FROM {table}")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    _drop_all()
+    op.execute("CREATE VIRTUAL TABLE patient_search USING fts5(search_name, content='patient', content_rowid='id', tokenize='unicode61 remove_diacritics 2')")
+    op.execute("CREATE TRIGGER patient_search_ai AFTER INSERT ON patient BEGIN "
+               "INSERT INTO patient_search(rowid, search_name) VALUES (new.id, new.search_name); END")
+    op.execute("CREATE TRIGGER patient_search_ad AFTER DELETE ON patient BEGIN "
+               "INSERT INTO patient_search(patient_search, rowid, search_name) VALUES ('delete', old.id, old.search_name); END")
+    op.execute("CREATE TRIGGER patient_search_au AFTER UPDATE OF search_name ON patient BEGIN "
+               "INSERT INTO patient_search(patient_search, rowid, search_name) VALUES ('delete', old.id, old.search_name); "
+               "INSERT INTO patient_search(rowid, search_name) VALUES (new.id, new.search_name); END")
+    op.execute("INSERT INTO patient_search(patient_search) VALUES ('rebuild')")
+    op.execute("CREATE VIRTUAL TABLE clinical_search USING fts5(kind UNINDEXED, source_id UNINDEXED, clinic_id UNINDEXED, patient_id UNINDEXED, body, tokenize='unicode61 remove_diacritics 2')")
+    for kind, table, parity, fields in SOURCES:
+        insert_row = (f"INSERT INTO clinical_search(rowid, kind, source_id, clinic_id, patient_id, body) "
+                      f"VALUES (new.id * 2 + {parity}, '{kind}', new.id, new.clinic_id, new.patient_id, {_document(fields, 'new')}); ")
+        delete_row = f"DELETE FROM clinical_search WHERE rowid = old.id * 2 + {parity}; "
+        op.execute(f"CREATE TRIGGER {table}_search_ai AFTER INSERT ON {table} BEGIN {insert_row}END")
+        op.execute(f"CREATE TRIGGER {table}_search_ad AFTER DELETE ON {table} BEGIN {delete_row}END")
+        op.execute(f"CREATE TRIGGER {table}_search_au AFTER UPDATE ON {table} BEGIN {delete_row}{insert_row}END")
+        op.execute(f"INSERT INTO clinical_search(rowid, kind, source_id, clinic_id, patient_id, body) "
+                   f"SELECT id * 2 + {parity}, '{kind}', id, clinic_id, patient_id, {_document(fields)} FROM {table}")
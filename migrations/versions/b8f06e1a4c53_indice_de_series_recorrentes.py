@@ -0,0 +1,26 @@
+"""Índice (recurrence_id, start_time) para o cancelamento de séries
+
+Revision ID: b8f06e1a4c53
+Revises: a51b7c3d9e24
+Create Date: 2026-10-18 12:05:52.331907
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8f06e1a4c53'
+down_revision = 'a51b7c3d9e24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('appointment', schema=None) as batch_op:
+        batch_op.create_index('ix_appointment_recurrence_id_start_time', ['recurrence_id', 'start_time'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('appointment', schema=None) as batch_op:
+        batch_op.drop_index('ix_appointment_recurrence_id_start_time')
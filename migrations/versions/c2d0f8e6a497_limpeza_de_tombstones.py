@@ -0,0 +1,30 @@
+"""Limpeza de tombstones da agenda (tombstone_floor por clínica)
+
+Revision ID: c2d0f8e6a497
+Revises: b1c9e7d5f386
+Create Date: 2026-10-20 09:37:14.205318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2d0f8e6a497'
+down_revision = 'b1c9e7d5f386'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('clinic', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('tombstone_floor', sa.BigInteger(), server_default='0', nullable=False))
+    with op.batch_alter_table('appointment_tombstone', schema=None) as batch_op:
+        batch_op.create_index('ix_appointment_tombstone_deleted_at', ['deleted_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('appointment_tombstone', schema=None) as batch_op:
+        batch_op.drop_index('ix_appointment_tombstone_deleted_at')
+    with op.batch_alter_table('clinic', schema=None) as batch_op:
+        batch_op.drop_column('tombstone_floor')
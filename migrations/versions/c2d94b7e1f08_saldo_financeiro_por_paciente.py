@@ -0,0 +1,40 @@
+"""Saldo financeiro agregado por paciente
+
+Revision ID: c2d94b7e1f08
+Revises: b8f06e1a4c53
+Create Date: 2026-10-18 13:40:09.872215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2d94b7e1f08'
+down_revision = 'b8f06e1a4c53'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    patient_balance = op.create_table('patient_balance',
+    sa.Column('patient_id', sa.Integer(), nullable=False),
+    sa.Column('total_due', sa.Float(), nullable=False),
+    sa.Column('total_paid', sa.Float(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['patient_id'], ['patient.id'], ),
+    sa.PrimaryKeyConstraint('patient_id')
+    )
+    # Carga inicial com os saldos de todos os pacientes existentes (mesma regra do comando reconcile-balances).
+    patient = sa.table('patient', sa.column('id', sa.Integer))
+    appointment = sa.table('appointment', sa.column('patient_id', sa.Integer), sa.column('status', sa.String), sa.column('session_price', sa.Float), sa.column('amount_paid', sa.Float))
+    due = sa.func.coalesce(sa.func.sum(sa.case((sa.func.coalesce(appointment.c.status, '') != 'Cancelado', appointment.c.session_price), else_=0.0)), 0.0)
+    paid = sa.func.coalesce(sa.func.sum(appointment.c.amount_paid), 0.0)
+    op.execute(patient_balance.insert().from_select(
+        ['patient_id', 'total_due', 'total_paid', 'updated_at'],
+        sa.select(patient.c.id, due, paid, sa.func.current_timestamp()).select_from(patient.outerjoin(appointment, appointment.c.patient_id == patient.c.id)).group_by(patient.c.id)
+    ))
+
+
+def downgrade():
+    op.drop_table('patient_balance')
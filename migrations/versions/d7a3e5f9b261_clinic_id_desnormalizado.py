@@ -0,0 +1,77 @@
+"""clinic_id desnormalizado em agendamentos, prontuários e avaliações
+
+Revision ID: d7a3e5f9b261
+Revises: c2d94b7e1f08
+Create Date: 2026-10-18 14:58:30.117406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7a3e5f9b261'
+down_revision = 'c2d94b7e1f08'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 5000
+
+
+def _backfill(table_name, owner_table_name, owner_fk):
+    # Preenche clinic_id em lotes por intervalo de id, cada um no seu próprio commit,
+    # para não segurar bloqueios sobre a tabela inteira em bases grandes.
+    table = sa.table(table_name, sa.column('id', sa.Integer), sa.column('clinic_id', sa.Integer), sa.column(owner_fk, sa.Integer))
+    owner = sa.table(owner_table_name, sa.column('id', sa.Integer), sa.column('clinic_id', sa.Integer))
+    owner_clinic = sa.select(owner.c.clinic_id).where(owner.c.id == table.c[owner_fk]).scalar_subquery()
+    bind = op.get_bind()
+    max_id = bind.execute(sa.select(sa.func.max(table.c.id))).scalar() or 0
+    with op.get_context().autocommit_block():
+        for lower in range(0, max_id, BATCH_SIZE):
+            bind.execute(table.update().where(table.c.id > lower, table.c.id <= lower + BATCH_SIZE).values(clinic_id=owner_clinic))
+
+
+def upgrade():
+    for table_name in ('appointment', 'electronic_record', 'assessment'):
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('clinic_id', sa.Integer(), nullable=True))
+
+    _backfill('appointment', 'user', 'user_id')
+    _backfill('electronic_record', 'patient', 'patient_id')
+    _backfill('assessment', 'patient', 'patient_id')
+
+    with op.batch_alter_table('appointment', schema=None) as batch_op:
+        batch_op.alter_column('clinic_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_foreign_key('fk_appointment_clinic_id_clinic', 'clinic', ['clinic_id'], ['id'])
+        batch_op.drop_index('ix_appointment_updated_seq')
+        batch_op.create_index('ix_appointment_clinic_id_start_time', ['clinic_id', 'start_time'], unique=False)
+        batch_op.create_index('ix_appointment_clinic_id_updated_seq', ['clinic_id', 'updated_seq'], unique=False)
+
+    with op.batch_alter_table('electronic_record', schema=None) as batch_op:
+        batch_op.alter_column('clinic_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_foreign_key('fk_electronic_record_clinic_id_clinic', 'clinic', ['clinic_id'], ['id'])
+        batch_op.create_index(batch_op.f('ix_electronic_record_clinic_id'), ['clinic_id'], unique=False)
+
+    with op.batch_alter_table('assessment', schema=None) as batch_op:
+        batch_op.alter_column('clinic_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_foreign_key('fk_assessment_clinic_id_clinic', 'clinic', ['clinic_id'], ['id'])
+        batch_op.create_index(batch_op.f('ix_assessment_clinic_id'), ['clinic_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('assessment', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_assessment_clinic_id'))
+        batch_op.drop_constraint('fk_assessment_clinic_id_clinic', type_='foreignkey')
+        batch_op.drop_column('clinic_id')
+
+    with op.batch_alter_table('electronic_record', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_electronic_record_clinic_id'))
+        batch_op.drop_constraint('fk_electronic_record_clinic_id_clinic', type_='foreignkey')
+        batch_op.drop_column('clinic_id')
+
+    with op.batch_alter_table('appointment', schema=None) as batch_op:
+        batch_op.drop_index('ix_appointment_clinic_id_updated_seq')
+        batch_op.drop_index('ix_appointment_clinic_id_start_time')
+        batch_op.create_index('ix_appointment_updated_seq', ['updated_seq'], unique=False)
+        batch_op.drop_constraint('fk_appointment_clinic_id_clinic', type_='foreignkey')
+        batch_op.drop_column('clinic_id')
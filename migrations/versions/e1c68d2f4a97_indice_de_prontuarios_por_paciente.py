@@ -0,0 +1,26 @@
+"""Índice (patient_id, record_date) nos prontuários
+
+Revision ID: e1c68d2f4a97
+Revises: d7a3e5f9b261
+Create Date: 2026-10-18 15:46:12.905331
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1c68d2f4a97'
+down_revision = 'd7a3e5f9b261'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('electronic_record', schema=None) as batch_op:
+        batch_op.create_index('ix_electronic_record_patient_id_record_date', ['patient_id', 'record_date'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('electronic_record', schema=None) as batch_op:
+        batch_op.drop_index('ix_electronic_record_patient_id_record_date')
@@ -0,0 +1,75 @@
+"""Pesquisa de pacientes sem acentos (search_name, trigramas/FTS5)
+
+Revision ID: f4b29a6c8d13
+Revises: e1c68d2f4a97
+Create Date: 2026-10-18 16:32:47.441860
+
+"""
+import re
+import unicodedata
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4b29a6c8d13'
+down_revision = 'e1c68d2f4a97'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 2000
+
+
+def _normalize(value):
+    # Cópia de models.normalize_search_text, para a migração não depender do código da aplicação.
+    decomposed = unicodedata.normalize('NFKD', value or '')
+    without_accents = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return re.sub(r'\s+', ' ', without_accents).strip().casefold()
+
+
+def upgrade():
+    with op.batch_alter_table('patient', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('search_name', sa.String(length=150), server_default='', nullable=False))
+
+    patient = sa.table('patient', sa.column('id', sa.Integer), sa.column('full_name', sa.String), sa.column('search_name', sa.String))
+    bind = op.get_bind()
+    last_id = 0
+    while True:
+        rows = bind.execute(sa.select(patient.c.id, patient.c.full_name).where(patient.c.id > last_id).order_by(patient.c.id).limit(BATCH_SIZE)).all()
+        if not rows:
+            break
+        bind.execute(patient.update().where(patient.c.id == sa.bindparam('patient_id')).values(search_name=sa.bindparam('normalized')),
+                     [{'patient_id': row.id, 'normalized': _normalize(row.full_name)} for row in rows])
+        last_id = rows[-1].id
+
+    with op.batch_alter_table('patient', schema=None) as batch_op:
+        batch_op.create_index('ix_patient_clinic_id_search_name', ['clinic_id', 'search_name'], unique=False)
+
+    if bind.dialect.name == 'postgresql':
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.execute("CREATE INDEX IF NOT EXISTS ix_patient_search_name_trgm ON patient USING gin (search_name gin_trgm_ops)")
+    elif bind.dialect.name == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE IF NOT EXISTS patient_search USING fts5(search_name, content='patient', content_rowid='id', tokenize='unicode61 remove_diacritics 2')")
+        op.execute("CREATE TRIGGER IF NOT EXISTS patient_search_ai AFTER INSERT ON patient BEGIN "
+                   "INSERT INTO patient_search(rowid, search_name) VALUES (new.id, new.search_name); END")
+        op.execute("CREATE TRIGGER IF NOT EXISTS patient_search_ad AFTER DELETE ON patient BEGIN "
+                   "INSERT INTO patient_search(patient_search, rowid, search_name) VALUES ('delete', old.id, old.search_name); END")
+        op.execute("CREATE TRIGGER IF NOT EXISTS patient_search_au AFTER UPDATE OF search_name ON patient BEGIN "
+                   "INSERT INTO patient_search(patient_search, rowid, search_name) VALUES ('delete', old.id, old.search_name); "
+                   "INSERT INTO patient_search(rowid, search_name) VALUES (new.id, new.search_name); END")
+        op.execute("INSERT INTO patient_search(patient_search) VALUES ('rebuild')")
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_patient_search_name_trgm")
+    elif bind.dialect.name == 'sqlite':
+        for trigger in ('patient_search_ai', 'patient_search_ad', 'patient_search_au'):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS patient_search")
+
+    with op.batch_alter_table('patient', schema=None) as batch_op:
+        batch_op.drop_index('ix_patient_clinic_id_search_name')
+        batch_op.drop_column('search_name')
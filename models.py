@@ -2,15 +2,30 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import date, datetime
+from collections import defaultdict
+from sqlalchemy import event, inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, validates
+import re
+import unicodedata
 import uuid
 
 db = SQLAlchemy()
 
+def normalize_search_text(value):
+    # "João  Dá-Silva" -> "joao da-silva": sem acentos, minúsculas e espaços únicos, para pesquisa indexada.
+    decomposed = unicodedata.normalize('NFKD', value or '')
+    without_accents = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return re.sub(r'\s+', ' ', without_accents).strip().casefold()
+
 class Clinic(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(150), nullable=False)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     access_expires_on = db.Column(db.DateTime, nullable=True)
+    change_seq = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    # Maior deleted_seq já apagado por prune_tombstones: cursores anteriores a ele têm de recarregar a agenda inteira.
+    tombstone_floor = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
     users = db.relationship('User', backref='clinic', lazy='dynamic')
     patients = db.relationship('Patient', backref='clinic', lazy='dynamic')
     exercises = db.relationship('Exercise', backref='clinic', lazy='dynamic')
@@ -40,11 +55,13 @@ class User(UserMixin, db.Model):
 class Patient(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     full_name = db.Column(db.String(150), nullable=False, index=True)
-    date_of_birth = db.Column(db.Date, nullable=False)
-    gender = db.Column(db.String(20), nullable=True)
+    search_name = db.Column(db.String(150), nullable=False, default='')
+    # active_history: as estatísticas do painel precisam do valor anterior destes campos ao mover o paciente de faixa.
+    date_of_birth = db.column_property(db.Column(db.Date, nullable=False), active_history=True)
+    gender = db.column_property(db.Column(db.String(20), nullable=True), active_history=True)
     phone = db.Column(db.String(20))
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    specialty = db.Column(db.String(100), nullable=True)
+    specialty = db.column_property(db.Column(db.String(100), nullable=True), active_history=True)
     clinic_id = db.Column(db.Integer, db.ForeignKey('clinic.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     portal_access_token = db.Column(db.String(36), unique=True, default=lambda: str(uuid.uuid4()))
@@ -52,6 +69,17 @@ class Patient(db.Model):
     records = db.relationship('ElectronicRecord', backref='patient', lazy='dynamic', cascade="all, delete-orphan")
     assessments = db.relationship('Assessment', backref='patient', lazy='dynamic', cascade="all, delete-orphan")
     prescribed_exercises = db.relationship('PrescribedExercise', backref='patient', lazy='dynamic', cascade="all, delete-orphan")
+    balance = db.relationship('PatientBalance', uselist=False, cascade="all, delete-orphan")
+
+    __table_args__ = (
+        db.Index('ix_patient_clinic_id_search_name', 'clinic_id', 'search_name'),
+        db.Index('ix_patient_clinic_id_full_name_id', 'clinic_id', 'full_name', 'id'),
+    )
+
+    @validates('full_name')
+    def _sync_search_name(self, key, value):
+        self.search_name = normalize_search_text(value)
+        return value
 
     @property
     def age(self):
@@ -61,6 +89,49 @@ class Patient(db.Model):
         return 0
     def __repr__(self): return f'<Patient {self.full_name}>'
 
+class PatientBalance(db.Model):
+    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), primary_key=True)
+    total_due = db.Column(db.Float, nullable=False, default=0.0)
+    total_paid = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @property
+    def balance(self):
+        return self.total_paid - self.total_due
+    def __repr__(self): return f'<PatientBalance {self.patient_id}: {self.balance:.2f}>'
+
+class ClinicStat(db.Model):
+    # Contagem de pacientes por dimensão ('gender', 'specialty', 'age_band') e valor, mantida pelos eventos do mapper.
+    clinic_id = db.Column(db.Integer, db.ForeignKey('clinic.id'), primary_key=True)
+    dimension = db.Column(db.String(20), primary_key=True)
+    bucket = db.Column(db.String(100), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+    def __repr__(self): return f'<ClinicStat {self.clinic_id} {self.dimension}={self.bucket}: {self.value}>'
+
+class PatientSessionStat(db.Model):
+    # Sessões concluídas por paciente e mês (primeiro dia do mês), para o ranking do painel.
+    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), primary_key=True)
+    month = db.Column(db.Date, primary_key=True)
+    clinic_id = db.Column(db.Integer, db.ForeignKey('clinic.id'), nullable=False)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    __table_args__ = (db.Index('ix_patient_session_stat_clinic_id_month_completed', 'clinic_id', 'month', 'completed'),)
+    def __repr__(self): return f'<PatientSessionStat {self.patient_id} {self.month}: {self.completed}>'
+
+class MonthlyFinancialStat(db.Model):
+    # Totais mensais por profissional (primeiro dia do mês), com a mesma regra do relatório financeiro:
+    # 'billed' soma session_price de todas as sessões do mês, 'received' soma amount_paid.
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    month = db.Column(db.Date, primary_key=True)
+    clinic_id = db.Column(db.Integer, db.ForeignKey('clinic.id'), nullable=False)
+    billed = db.Column(db.Float, nullable=False, default=0.0)
+    received = db.Column(db.Float, nullable=False, default=0.0)
+    scheduled = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    cancelled = db.Column(db.Integer, nullable=False, default=0)
+    no_show = db.Column(db.Integer, nullable=False, default=0)
+    __table_args__ = (db.Index('ix_monthly_financial_stat_clinic_id_month', 'clinic_id', 'month'),)
+    def __repr__(self): return f'<MonthlyFinancialStat {self.user_id} {self.month}: {self.billed:.2f}/{self.received:.2f}>'
+
 class Exercise(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(150), nullable=False)
@@ -69,6 +140,7 @@ class Exercise(db.Model):
     video_url = db.Column(db.String(255), nullable=True)
     clinic_id = db.Column(db.Integer, db.ForeignKey('clinic.id'), nullable=False)
     prescriptions = db.relationship('PrescribedExercise', backref='exercise', lazy='dynamic', cascade="all, delete-orphan")
+    __table_args__ = (db.Index('ix_exercise_clinic_id_name_id', 'clinic_id', 'name', 'id'),)
     def __repr__(self): return f'<Exercise {self.name}>'
 
 class PrescribedExercise(db.Model):
@@ -85,61 +157,418 @@ class PrescribedExercise(db.Model):
 
 class Appointment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    start_time = db.Column(db.DateTime, nullable=False)
+    # active_history: o saldo do paciente e as estatísticas do painel e financeiras precisam do valor anterior destes campos ao aplicar a diferença.
+    start_time = db.column_property(db.Column(db.DateTime, nullable=False), active_history=True)
     location = db.Column(db.String(150), nullable=False)
-    status = db.Column(db.String(30), default='Agendado')
+    status = db.column_property(db.Column(db.String(30), default='Agendado'), active_history=True)
     notes = db.Column(db.Text, nullable=True)
-    session_price = db.Column(db.Float, nullable=True)
-    amount_paid = db.Column(db.Float, default=0.0)
+    session_price = db.column_property(db.Column(db.Float, nullable=True), active_history=True)
+    amount_paid = db.column_property(db.Column(db.Float, default=0.0), active_history=True)
     payment_notes = db.Column(db.Text, nullable=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
+    clinic_id = db.Column(db.Integer, db.ForeignKey('clinic.id'), nullable=False)
+    user_id = db.column_property(db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False), active_history=True)
+    patient_id = db.column_property(db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False), active_history=True)
     is_recurring = db.Column(db.Boolean, default=False)
     recurrence_id = db.Column(db.String(36))
+    updated_seq = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    __table_args__ = (
+        db.Index('ix_appointment_clinic_id_start_time', 'clinic_id', 'start_time'),
+        db.Index('ix_appointment_clinic_id_updated_seq', 'clinic_id', 'updated_seq'),
+        db.Index('ix_appointment_user_id_start_time', 'user_id', 'start_time'),
+        # Cobre o ranking do painel por profissional: patient_id no fim evita ler a tabela.
+        db.Index('ix_appointment_user_id_status_start_time', 'user_id', 'status', 'start_time', 'patient_id'),
+        db.Index('ix_appointment_location_start_time', 'location', 'start_time'),
+        db.Index('ix_appointment_recurrence_id_start_time', 'recurrence_id', 'start_time'),
+    )
     def __repr__(self): return f'<Appointment for {self.patient.full_name} at {self.start_time}>'
 
+class AppointmentTombstone(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    clinic_id = db.Column(db.Integer, db.ForeignKey('clinic.id'), nullable=False)
+    appointment_id = db.Column(db.Integer, nullable=False)
+    deleted_seq = db.Column(db.BigInteger, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    __table_args__ = (db.Index('ix_appointment_tombstone_clinic_id_deleted_seq', 'clinic_id', 'deleted_seq'), db.Index('ix_appointment_tombstone_deleted_at', 'deleted_at'))
+    def __repr__(self): return f'<AppointmentTombstone {self.appointment_id} @{self.deleted_seq}>'
+
 class ElectronicRecord(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     record_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    medical_diagnosis = db.Column(db.Text, nullable=True)
-    subjective_notes = db.Column(db.Text, nullable=False)
-    objective_notes = db.Column(db.Text, nullable=False)
-    assessment = db.Column(db.Text, nullable=False)
-    plan = db.Column(db.Text, nullable=False)
+    # Textos do registo adiados: a linha do tempo do paciente só lê o cabeçalho; o corpo carrega-se num único SELECT ao ser acedido.
+    medical_diagnosis = db.deferred(db.Column(db.Text, nullable=True), group='body')
+    subjective_notes = db.deferred(db.Column(db.Text, nullable=False), group='body')
+    objective_notes = db.deferred(db.Column(db.Text, nullable=False), group='body')
+    assessment = db.deferred(db.Column(db.Text, nullable=False), group='body')
+    plan = db.deferred(db.Column(db.Text, nullable=False), group='body')
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
+    clinic_id = db.Column(db.Integer, db.ForeignKey('clinic.id'), nullable=False, index=True)
+    __table_args__ = (db.Index('ix_electronic_record_patient_id_record_date', 'patient_id', 'record_date'),)
     def __repr__(self): return f'<Record for {self.patient.full_name} on {self.record_date}>'
 
 class Assessment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
-    main_complaint = db.Column(db.Text, nullable=True)
-    history_of_present_illness = db.Column(db.Text, nullable=True)
-    past_medical_history = db.Column(db.Text, nullable=True)
-    medications = db.Column(db.Text, nullable=True)
-    social_history = db.Column(db.Text, nullable=True)
-    inspection_notes = db.Column(db.Text, nullable=True)
-    palpation_notes = db.Column(db.Text, nullable=True)
-    mobility_assessment = db.Column(db.Text, nullable=True)
-    strength_assessment = db.Column(db.Text, nullable=True)
-    neuro_assessment = db.Column(db.Text, nullable=True)
-    functional_assessment = db.Column(db.Text, nullable=True)
+    clinic_id = db.Column(db.Integer, db.ForeignKey('clinic.id'), nullable=False, index=True)
+    # Narrativas adiadas pelo mesmo motivo dos registos (grupo 'body').
+    main_complaint = db.deferred(db.Column(db.Text, nullable=True), group='body')
+    history_of_present_illness = db.deferred(db.Column(db.Text, nullable=True), group='body')
+    past_medical_history = db.deferred(db.Column(db.Text, nullable=True), group='body')
+    medications = db.deferred(db.Column(db.Text, nullable=True), group='body')
+    social_history = db.deferred(db.Column(db.Text, nullable=True), group='body')
+    inspection_notes = db.deferred(db.Column(db.Text, nullable=True), group='body')
+    palpation_notes = db.deferred(db.Column(db.Text, nullable=True), group='body')
+    mobility_assessment = db.deferred(db.Column(db.Text, nullable=True), group='body')
+    strength_assessment = db.deferred(db.Column(db.Text, nullable=True), group='body')
+    neuro_assessment = db.deferred(db.Column(db.Text, nullable=True), group='body')
+    functional_assessment = db.deferred(db.Column(db.Text, nullable=True), group='body')
     files = db.relationship('UploadedFile', backref='assessment', lazy='dynamic', cascade="all, delete-orphan")
-    diagnosis = db.Column(db.Text, nullable=True)
-    goals = db.Column(db.Text, nullable=True)
-    treatment_plan = db.Column(db.Text, nullable=True)
+    diagnosis = db.deferred(db.Column(db.Text, nullable=True), group='body')
+    goals = db.deferred(db.Column(db.Text, nullable=True), group='body')
+    treatment_plan = db.deferred(db.Column(db.Text, nullable=True), group='body')
+    __table_args__ = (db.Index('ix_assessment_patient_id_created_at', 'patient_id', 'created_at'),)
     def __repr__(self): return f'<Assessment for {self.patient.full_name} on {self.created_at}>'
 
 class UploadedFile(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    public_id = db.Column(db.String(255), nullable=False)
-    secure_url = db.Column(db.String(512), nullable=False)
-    resource_type = db.Column(db.String(50), nullable=False)
+    # public_id, secure_url e resource_type só são preenchidos quando o envio em segundo plano termina (status 'ready').
+    public_id = db.Column(db.String(255), nullable=True)
+    secure_url = db.Column(db.String(512), nullable=True)
+    resource_type = db.Column(db.String(50), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='ready', server_default='ready')
+    original_filename = db.Column(db.String(255), nullable=True)
+    error = db.Column(db.String(255), nullable=True)
+    # Backend onde o arquivo está (storage.create_storages); no 'local', public_id é o sha256 do conteúdo.
+    storage = db.Column(db.String(20), nullable=False, default='cloudinary', server_default='cloudinary')
+    content_type = db.Column(db.String(100), nullable=True)
+    size = db.Column(db.BigInteger, nullable=True)
+    # Enquanto 'pending': o arquivo em disco à espera do envio e quando foi entregue à fila (ver UploadQueue.sweep).
+    spool_path = db.Column(db.String(512), nullable=True)
+    queued_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow)
     assessment_id = db.Column(db.Integer, db.ForeignKey('assessment.id'), nullable=False)
+    variants = db.relationship('FileVariant', backref='uploaded_file', cascade="all, delete-orphan")
     def __repr__(self): return f'<File {self.public_id}>'
 
+class FileVariant(db.Model):
+    # Versões reduzidas de um anexo (derivatives.VARIANT_SIZES), gravadas no mesmo storage do original.
+    id = db.Column(db.Integer, primary_key=True)
+    uploaded_file_id = db.Column(db.Integer, db.ForeignKey('uploaded_file.id'), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)
+    storage = db.Column(db.String(20), nullable=False)
+    # 'ready', 'skipped' ou 'failed' (derivatives.VARIANT_*); só as 'ready' têm arquivo e são servidas.
+    status = db.Column(db.String(20), nullable=False, default='ready', server_default='ready')
+    error = db.Column(db.String(255), nullable=True)
+    public_id = db.Column(db.String(255), nullable=True)
+    secure_url = db.Column(db.String(512), nullable=True)
+    resource_type = db.Column(db.String(50), nullable=True)
+    content_type = db.Column(db.String(100), nullable=True)
+    width = db.Column(db.Integer, nullable=True)
+    height = db.Column(db.Integer, nullable=True)
+    size = db.Column(db.BigInteger, nullable=True)
+    __table_args__ = (db.UniqueConstraint('uploaded_file_id', 'kind', name='uq_file_variant_uploaded_file_id_kind'),)
+    def __repr__(self): return f'<FileVariant {self.kind} of {self.uploaded_file_id}>'
+
+
+# --- CLÍNICA DESNORMALIZADA ---
+# Agendamentos herdam a clínica do profissional; prontuários e avaliações, a do paciente.
+# Registado antes dos restantes before_flush, que dependem de clinic_id já preenchido.
+@event.listens_for(Session, 'before_flush')
+def assign_clinic_ids(session, flush_context, instances):
+    for obj in session.new:
+        if isinstance(obj, Appointment) and obj.clinic_id is None:
+            professional = obj.professional if obj.user_id is None else session.get(User, obj.user_id)
+            obj.clinic_id = professional.clinic_id if professional else None
+        elif isinstance(obj, (ElectronicRecord, Assessment)) and obj.clinic_id is None:
+            patient = obj.patient if obj.patient_id is None else session.get(Patient, obj.patient_id)
+            obj.clinic_id = patient.clinic_id if patient else None
+
+
+# --- CURSOR DE ALTERAÇÕES DA AGENDA ---
+def reserve_change_seq(session, clinic_id, count=1):
+    # Incrementa o contador da clínica de forma atómica; o bloqueio da linha serializa os escritores da mesma clínica.
+    session.execute(db.update(Clinic).where(Clinic.id == clinic_id).values(change_seq=Clinic.change_seq + count).execution_options(synchronize_session=False))
+    return session.execute(db.select(Clinic.change_seq).where(Clinic.id == clinic_id)).scalar_one()
+
+def prune_tombstones(session, before):
+    # Apaga os tombstones anteriores a 'before' e sobe o tombstone_floor de cada clínica afetada. Devolve quantos apagou.
+    floors = session.execute(db.select(AppointmentTombstone.clinic_id, db.func.max(AppointmentTombstone.deleted_seq)).where(AppointmentTombstone.deleted_at < before).group_by(AppointmentTombstone.clinic_id)).all()
+    pruned = 0
+    for clinic_id, floor in floors:
+        session.execute(db.update(Clinic).where(Clinic.id == clinic_id, Clinic.tombstone_floor < floor).values(tombstone_floor=floor).execution_options(synchronize_session=False))
+        pruned += session.execute(db.delete(AppointmentTombstone).where(AppointmentTombstone.clinic_id == clinic_id, AppointmentTombstone.deleted_seq <= floor)).rowcount
+    return pruned
+
+@event.listens_for(Session, 'before_flush')
+def stamp_appointment_changes(session, flush_context, instances):
+    touched, deleted = defaultdict(list), defaultdict(list)
+    for obj in session.new:
+        if isinstance(obj, Appointment): touched[obj.clinic_id].append(obj)
+    for obj in session.dirty:
+        if isinstance(obj, Appointment) and session.is_modified(obj, include_collections=False): touched[obj.clinic_id].append(obj)
+    for obj in session.deleted:
+        if isinstance(obj, Appointment): deleted[obj.clinic_id].append(obj)
+    for clinic_id in set(touched) | set(deleted):
+        if clinic_id is None: continue
+        seq = reserve_change_seq(session, clinic_id)
+        for appointment in touched[clinic_id]:
+            appointment.updated_seq = seq
+        for appointment in deleted[clinic_id]:
+            session.add(AppointmentTombstone(clinic_id=clinic_id, appointment_id=appointment.id, deleted_seq=seq))
+
+
+# --- INCREMENTOS COM CRIAÇÃO DA LINHA ---
+# INSERT ... ON CONFLICT DO UPDATE num só comando: duas transações que criam a mesma linha ao mesmo tempo somam-se
+# em vez de a segunda falhar na chave primária. Noutros bancos, UPDATE e INSERT se nada foi atualizado.
+UPSERT_INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+def upsert_increment(executor, table, key, deltas, values=None):
+    # executor: Connection (eventos do mapper) ou Session; 'values' são atribuídos tal como estão (ex.: updated_at).
+    values = values or {}
+    dialect = executor.dialect if hasattr(executor, 'dialect') else executor.get_bind().dialect
+    insert = UPSERT_INSERTS.get(dialect.name)
+    if insert is None:
+        condition = db.and_(*(table.c[name] == value for name, value in key.items()))
+        result = executor.execute(table.update().where(condition).values({column: table.c[column] + delta for column, delta in deltas.items()}, **values))
+        if result.rowcount == 0:
+            executor.execute(table.insert().values(**key, **deltas, **values))
+        return
+    statement = insert(table).values(**key, **deltas, **values)
+    increments = {column: table.c[column] + statement.excluded[column] for column in deltas}
+    executor.execute(statement.on_conflict_do_update(index_elements=[column.name for column in table.primary_key], set_=dict(increments, **values)))
+
+# --- SALDO FINANCEIRO DOS PACIENTES ---
+# Sessões canceladas não são cobradas; o valor pago conta sempre.
+def billable_amount(status, session_price):
+    return (session_price or 0.0) if status != 'Cancelado' else 0.0
+
+def apply_balance_delta(session, patient_id, due_delta=0.0, paid_delta=0.0):
+    if not due_delta and not paid_delta:
+        return
+    # Incremento atómico no SQL: duas gravações simultâneas no mesmo paciente não se sobrepõem, nem quando criam a linha.
+    upsert_increment(session, PatientBalance.__table__, {'patient_id': patient_id}, {'total_due': due_delta, 'total_paid': paid_delta}, {'updated_at': datetime.utcnow()})
+
+def _previous_value(state, key):
+    history = state.attrs[key].history
+    if history.deleted: return history.deleted[0]
+    if history.unchanged: return history.unchanged[0]
+    return getattr(state.obj(), key)
+
+@event.listens_for(Session, 'before_flush')
+def maintain_patient_balances(session, flush_context, instances):
+    deleted_patients = {obj.id for obj in session.deleted if isinstance(obj, Patient)}
+    deltas = defaultdict(lambda: [0.0, 0.0])
+    for obj in session.new:
+        if isinstance(obj, Patient) and obj.balance is None:
+            obj.balance = PatientBalance(total_due=0.0, total_paid=0.0)
+        elif isinstance(obj, Appointment):
+            deltas[obj.patient_id][0] += billable_amount(obj.status, obj.session_price)
+            deltas[obj.patient_id][1] += obj.amount_paid or 0.0
+    for obj in session.dirty:
+        if not isinstance(obj, Appointment) or not session.is_modified(obj, include_collections=False): continue
+        state = inspect(obj)
+        old_patient_id = _previous_value(state, 'patient_id')
+        deltas[old_patient_id][0] -= billable_amount(_previous_value(state, 'status'), _previous_value(state, 'session_price'))
+        deltas[old_patient_id][1] -= _previous_value(state, 'amount_paid') or 0.0
+        deltas[obj.patient_id][0] += billable_amount(obj.status, obj.session_price)
+        deltas[obj.patient_id][1] += obj.amount_paid or 0.0
+    for obj in session.deleted:
+        if isinstance(obj, Appointment):
+            state = inspect(obj)
+            patient_id = _previous_value(state, 'patient_id')
+            deltas[patient_id][0] -= billable_amount(_previous_value(state, 'status'), _previous_value(state, 'session_price'))
+            deltas[patient_id][1] -= _previous_value(state, 'amount_paid') or 0.0
+    for patient_id, (due_delta, paid_delta) in deltas.items():
+        if patient_id is not None and patient_id not in deleted_patients:
+            apply_balance_delta(session, patient_id, due_delta, paid_delta)
+
+def patient_balance_select():
+    # Recalcula todos os saldos num único INSERT ... SELECT agrupado (usado pelo comando de reconciliação e pela migração).
+    due = db.func.coalesce(db.func.sum(db.case((db.func.coalesce(Appointment.status, '') != 'Cancelado', Appointment.session_price), else_=0.0)), 0.0)
+    paid = db.func.coalesce(db.func.sum(Appointment.amount_paid), 0.0)
+    return db.select(Patient.id, due, paid, db.func.current_timestamp()).select_from(Patient).outerjoin(Appointment, Appointment.patient_id == Patient.id).group_by(Patient.id)
+
+def rebuild_patient_balances(session):
+    session.execute(db.delete(PatientBalance))
+    session.execute(db.insert(PatientBalance).from_select(['patient_id', 'total_due', 'total_paid', 'updated_at'], patient_balance_select()))
+    return session.scalar(db.select(db.func.count()).select_from(PatientBalance))
+
+
+# --- ESTATÍSTICAS DO PAINEL ---
+# As contagens por faixa etária dependem da data: os eventos usam a data de hoje e o comando
+# 'flask refresh-age-bands' (agendado para correr todas as noites) recalcula-as por completo.
+AGE_BANDS = ('0-18', '19-30', '31-50', '51+')
+_AGE_BAND_LIMITS = ((19, '0-18'), (31, '19-30'), (51, '31-50'))
+
+def years_before(day, years):
+    try:
+        return day.replace(year=day.year - years)
+    except ValueError:
+        return day.replace(year=day.year - years, day=28)
+
+def age_band(date_of_birth, today=None):
+    # Idade <= 18 equivale a ter nascido depois da data de hoje há 19 anos; o mesmo para as outras faixas.
+    today = today or date.today()
+    for years, label in _AGE_BAND_LIMITS:
+        if date_of_birth is None or date_of_birth > years_before(today, years):
+            return label
+    return AGE_BANDS[-1]
+
+def age_band_expression(column, today=None):
+    today = today or date.today()
+    return db.case(*[(column > years_before(today, years), label) for years, label in _AGE_BAND_LIMITS], else_=AGE_BANDS[-1])
+
+def month_start_expression(session, column):
+    if session.get_bind().dialect.name == 'postgresql':
+        return db.cast(db.func.date_trunc('month', column), db.Date)
+    return db.func.date(column, 'start of month')
+
+def _patient_stat_buckets(gender, specialty, date_of_birth):
+    return {'gender': gender or 'Não Esp.', 'specialty': specialty or 'N/A', 'age_band': age_band(date_of_birth)}
+
+def _completed_session_key(clinic_id, patient_id, status, start_time):
+    if status != 'Concluído' or start_time is None:
+        return None
+    return {'patient_id': patient_id, 'month': start_time.date().replace(day=1), 'clinic_id': clinic_id}
+
+def _bump(connection, table, key, deltas):
+    # Incremento atómico; a linha só é criada por incrementos positivos.
+    deltas = {column: delta for column, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    if min(deltas.values()) > 0:
+        upsert_increment(connection, table, key, deltas)
+        return
+    condition = db.and_(*(table.c[name] == value for name, value in key.items()))
+    connection.execute(table.update().where(condition).values({column: table.c[column] + delta for column, delta in deltas.items()}))
+
+def _shift_patient_stats(connection, clinic_id, buckets, delta):
+    for dimension, bucket in buckets.items():
+        _bump(connection, ClinicStat.__table__, {'clinic_id': clinic_id, 'dimension': dimension, 'bucket': bucket}, {'value': delta})
+
+@event.listens_for(Patient, 'after_insert')
+def count_inserted_patient(mapper, connection, target):
+    _shift_patient_stats(connection, target.clinic_id, _patient_stat_buckets(target.gender, target.specialty, target.date_of_birth), 1)
+
+@event.listens_for(Patient, 'after_update')
+def count_updated_patient(mapper, connection, target):
+    state = inspect(target)
+    old_clinic_id = _previous_value(state, 'clinic_id')
+    old = _patient_stat_buckets(_previous_value(state, 'gender'), _previous_value(state, 'specialty'), _previous_value(state, 'date_of_birth'))
+    new = _patient_stat_buckets(target.gender, target.specialty, target.date_of_birth)
+    changed = [dimension for dimension in old if old[dimension] != new[dimension] or old_clinic_id != target.clinic_id]
+    _shift_patient_stats(connection, old_clinic_id, {dimension: old[dimension] for dimension in changed}, -1)
+    _shift_patient_stats(connection, target.clinic_id, {dimension: new[dimension] for dimension in changed}, 1)
+
+@event.listens_for(Patient, 'before_delete')
+def drop_patient_session_stats(mapper, connection, target):
+    connection.execute(PatientSessionStat.__table__.delete().where(PatientSessionStat.patient_id == target.id))
+
+@event.listens_for(Patient, 'after_delete')
+def count_deleted_patient(mapper, connection, target):
+    state = inspect(target)
+    buckets = _patient_stat_buckets(_previous_value(state, 'gender'), _previous_value(state, 'specialty'), _previous_value(state, 'date_of_birth'))
+    _shift_patient_stats(connection, _previous_value(state, 'clinic_id'), buckets, -1)
+
+# Os caminhos em massa da agenda (criação de séries e cancel_series) só inserem ou cancelam sessões 'Agendado',
+# por isso não alteram as sessões concluídas.
+@event.listens_for(Appointment, 'after_insert')
+def count_inserted_appointment(mapper, connection, target):
+    key = _completed_session_key(target.clinic_id, target.patient_id, target.status, target.start_time)
+    if key:
+        _bump(connection, PatientSessionStat.__table__, key, {'completed': 1})
+
+@event.listens_for(Appointment, 'after_update')
+def count_updated_appointment(mapper, connection, target):
+    state = inspect(target)
+    old_key = _completed_session_key(_previous_value(state, 'clinic_id'), _previous_value(state, 'patient_id'), _previous_value(state, 'status'), _previous_value(state, 'start_time'))
+    new_key = _completed_session_key(target.clinic_id, target.patient_id, target.status, target.start_time)
+    if old_key == new_key:
+        return
+    if old_key:
+        _bump(connection, PatientSessionStat.__table__, old_key, {'completed': -1})
+    if new_key:
+        _bump(connection, PatientSessionStat.__table__, new_key, {'completed': 1})
+
+@event.listens_for(Appointment, 'after_delete')
+def count_deleted_appointment(mapper, connection, target):
+    state = inspect(target)
+    key = _completed_session_key(_previous_value(state, 'clinic_id'), _previous_value(state, 'patient_id'), _previous_value(state, 'status'), _previous_value(state, 'start_time'))
+    if key:
+        _bump(connection, PatientSessionStat.__table__, key, {'completed': -1})
+
+def refresh_age_bands(session, today=None):
+    band = age_band_expression(Patient.date_of_birth, today)
+    session.execute(db.delete(ClinicStat).where(ClinicStat.dimension == 'age_band'))
+    session.execute(db.insert(ClinicStat).from_select(['clinic_id', 'dimension', 'bucket', 'value'], db.select(Patient.clinic_id, db.literal('age_band'), band, db.func.count(Patient.id)).group_by(Patient.clinic_id, band)))
+
+def rebuild_clinic_stats(session):
+    # Recalcula todas as estatísticas a partir das tabelas de origem (comando 'flask rebuild-clinic-stats' e migração).
+    session.execute(db.delete(ClinicStat))
+    session.execute(db.delete(PatientSessionStat))
+    for dimension, column, fallback in (('gender', Patient.gender, 'Não Esp.'), ('specialty', Patient.specialty, 'N/A')):
+        bucket = db.func.coalesce(db.func.nullif(column, ''), fallback)
+        session.execute(db.insert(ClinicStat).from_select(['clinic_id', 'dimension', 'bucket', 'value'], db.select(Patient.clinic_id, db.literal(dimension), bucket, db.func.count(Patient.id)).group_by(Patient.clinic_id, bucket)))
+    refresh_age_bands(session)
+    month = month_start_expression(session, Appointment.start_time)
+    session.execute(db.insert(PatientSessionStat).from_select(['clinic_id', 'patient_id', 'month', 'completed'], db.select(Appointment.clinic_id, Appointment.patient_id, month, db.func.count(Appointment.id)).where(Appointment.status == 'Concluído').group_by(Appointment.clinic_id, Appointment.patient_id, month)))
+    return session.scalar(db.select(db.func.count()).select_from(ClinicStat))
+
+
+# --- TOTAIS FINANCEIROS MENSAIS ---
+# Mantidos pelos mesmos eventos do mapper; os caminhos em massa da agenda chamam apply_financial_delta.
+# Ainda não existe um status de falta na agenda: NO_SHOW_STATUS fica contado à parte quando for usado.
+NO_SHOW_STATUS = 'Faltou'
+FINANCIAL_STATUS_COLUMNS = {'Agendado': 'scheduled', 'Concluído': 'completed', 'Cancelado': 'cancelled', NO_SHOW_STATUS: 'no_show'}
+
+def financial_contribution(status, session_price, amount_paid, sign=1):
+    deltas = {'billed': sign * (session_price or 0.0), 'received': sign * (amount_paid or 0.0)}
+    if status in FINANCIAL_STATUS_COLUMNS:
+        deltas[FINANCIAL_STATUS_COLUMNS[status]] = sign
+    return deltas
+
+def month_of(moment):
+    return moment.date().replace(day=1)
+
+def _financial_key(clinic_id, user_id, start_time):
+    return {'user_id': user_id, 'month': month_of(start_time), 'clinic_id': clinic_id}
+
+def apply_financial_delta(session, clinic_id, user_id, month, deltas):
+    _bump(session, MonthlyFinancialStat.__table__, {'user_id': user_id, 'month': month, 'clinic_id': clinic_id}, deltas)
+
+def _previous_financials(state):
+    key = _financial_key(_previous_value(state, 'clinic_id'), _previous_value(state, 'user_id'), _previous_value(state, 'start_time'))
+    return key, financial_contribution(_previous_value(state, 'status'), _previous_value(state, 'session_price'), _previous_value(state, 'amount_paid'), sign=-1)
+
+@event.listens_for(Appointment, 'after_insert')
+def add_appointment_financials(mapper, connection, target):
+    _bump(connection, MonthlyFinancialStat.__table__, _financial_key(target.clinic_id, target.user_id, target.start_time), financial_contribution(target.status, target.session_price, target.amount_paid))
 
+@event.listens_for(Appointment, 'after_update')
+def update_appointment_financials(mapper, connection, target):
+    old_key, deltas = _previous_financials(inspect(target))
+    new_key = _financial_key(target.clinic_id, target.user_id, target.start_time)
+    if old_key != new_key:
+        _bump(connection, MonthlyFinancialStat.__table__, old_key, deltas)
+        deltas = {}
+    for column, delta in financial_contribution(target.status, target.session_price, target.amount_paid).items():
+        deltas[column] = deltas.get(column, 0) + delta
+    _bump(connection, MonthlyFinancialStat.__table__, new_key, deltas)
 
+@event.listens_for(Appointment, 'after_delete')
+def remove_appointment_financials(mapper, connection, target):
+    key, deltas = _previous_financials(inspect(target))
+    _bump(connection, MonthlyFinancialStat.__table__, key, deltas)
 
+@event.listens_for(User, 'before_delete')
+def drop_professional_financials(mapper, connection, target):
+    connection.execute(MonthlyFinancialStat.__table__.delete().where(MonthlyFinancialStat.user_id == target.id))
 
+def monthly_financial_select(session):
+    month = month_start_expression(session, Appointment.start_time)
+    counts = [db.func.coalesce(db.func.sum(db.case((Appointment.status == status, 1), else_=0)), 0) for status in FINANCIAL_STATUS_COLUMNS]
+    return db.select(Appointment.clinic_id, Appointment.user_id, month, db.func.coalesce(db.func.sum(Appointment.session_price), 0.0), db.func.coalesce(db.func.sum(Appointment.amount_paid), 0.0), *counts).group_by(Appointment.clinic_id, Appointment.user_id, month)
 
+def rebuild_monthly_financials(session):
+    session.execute(db.delete(MonthlyFinancialStat))
+    session.execute(db.insert(MonthlyFinancialStat).from_select(['clinic_id', 'user_id', 'month', 'billed', 'received', *FINANCIAL_STATUS_COLUMNS.values()], monthly_financial_select(session)))
+    return session.scalar(db.select(db.func.count()).select_from(MonthlyFinancialStat))
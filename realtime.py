@@ -0,0 +1,95 @@
+import json
+import queue
+import threading
+from collections import defaultdict
+
+# Canal de eventos da agenda por clínica. O InProcessBroker serve para um único processo (e para testes);
+# com vários workers do gunicorn use o RedisBroker, para que todos recebam as publicações.
+
+
+class InProcessSubscription:
+    def __init__(self, broker, clinic_id, max_pending):
+        self._broker = broker
+        self.clinic_id = clinic_id
+        self.queue = queue.Queue(maxsize=max_pending)
+
+    def get(self, timeout=None):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self._broker._unsubscribe(self)
+
+
+class InProcessBroker:
+    def __init__(self, max_pending=100):
+        self._max_pending = max_pending
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, clinic_id):
+        subscription = InProcessSubscription(self, clinic_id, self._max_pending)
+        with self._lock:
+            self._subscribers[clinic_id].add(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers[subscription.clinic_id].discard(subscription)
+            if not self._subscribers[subscription.clinic_id]:
+                del self._subscribers[subscription.clinic_id]
+
+    def publish(self, clinic_id, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(clinic_id, ()))
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(message)
+            except queue.Full:
+                # Um ecrã lento perde eventos, mas volta a ficar consistente no próximo /changes.
+                pass
+
+
+class RedisSubscription:
+    def __init__(self, pubsub):
+        self._pubsub = pubsub
+
+    def get(self, timeout=None):
+        message = self._pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout or 0)
+        if message is None:
+            return None
+        return json.loads(message['data'])
+
+    def close(self):
+        self._pubsub.close()
+
+
+class RedisBroker:
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("O pacote 'redis' é necessário para AGENDA_BROKER_URL=redis://...")
+        self._redis = redis.Redis.from_url(url)
+
+    @staticmethod
+    def _channel(clinic_id):
+        return f'agenda:{clinic_id}'
+
+    def subscribe(self, clinic_id):
+        pubsub = self._redis.pubsub()
+        pubsub.subscribe(self._channel(clinic_id))
+        return RedisSubscription(pubsub)
+
+    def publish(self, clinic_id, message):
+        self._redis.publish(self._channel(clinic_id), json.dumps(message))
+
+
+def create_broker(url=None):
+    if not url or url.startswith('memory://'):
+        return InProcessBroker()
+    if url.startswith(('redis://', 'rediss://')):
+        return RedisBroker(url)
+    raise ValueError(f'AGENDA_BROKER_URL não suportado: {url}')
@@ -0,0 +1,60 @@
+from bisect import bisect_left, bisect_right
+from datetime import timedelta
+from sqlalchemy import or_
+from models import db, Appointment, Patient
+
+
+class IntervalIndex:
+    # Intervalos [início, fim) ordenados pelo início. Como nenhum intervalo é maior que 'max_length',
+    # os candidatos a sobrepor [start, end) estão numa fatia contígua encontrada por bisect.
+    def __init__(self, intervals):
+        self._items = sorted(intervals, key=lambda item: item[0])
+        self._starts = [item[0] for item in self._items]
+        self._max_length = max((end - start for start, end, _ in self._items), default=timedelta(0))
+
+    def __len__(self):
+        return len(self._items)
+
+    def overlapping(self, start, end):
+        lo = bisect_right(self._starts, start - self._max_length)
+        hi = bisect_left(self._starts, end)
+        return [payload for item_start, item_end, payload in self._items[lo:hi] if item_start < end and item_end > start]
+
+
+# Local preenchido por omissão na agenda: identifica a clínica inteira, não uma sala, e por isso
+# nunca conta como local ocupado (vários profissionais atendem na clínica ao mesmo tempo).
+DEFAULT_LOCATION = 'Clínica'
+
+
+def find_conflicts(clinic_id, user_id, location, starts, duration, check_location=True, exclude_ids=()):
+    # Uma única consulta por intervalo indexado cobre todas as sessões pedidas (uma ou uma série inteira).
+    if not starts:
+        return []
+    starts = sorted(starts)
+    scope = Appointment.user_id == user_id
+    if check_location and location and location.strip().casefold() != DEFAULT_LOCATION.casefold():
+        scope = or_(scope, Appointment.location == location)
+    query = db.session.query(Appointment.id, Appointment.start_time, Appointment.user_id, Appointment.location, Patient.full_name) \
+        .join(Patient, Appointment.patient_id == Patient.id) \
+        .filter(Appointment.clinic_id == clinic_id, scope, Appointment.status != 'Cancelado',
+                Appointment.start_time > starts[0] - duration, Appointment.start_time < starts[-1] + duration)
+    if exclude_ids:
+        query = query.filter(Appointment.id.notin_(list(exclude_ids)))
+    index = IntervalIndex((row.start_time, row.start_time + duration, row) for row in query)
+    conflicts = []
+    if not index:
+        return conflicts
+    for start in starts:
+        clashes = index.overlapping(start, start + duration)
+        if clashes:
+            conflicts.append({
+                'start': start.isoformat(),
+                'conflicts': [{
+                    'id': row.id,
+                    'title': row.full_name,
+                    'start': row.start_time.isoformat(),
+                    'location': row.location,
+                    'reason': 'professional' if row.user_id == user_id else 'location',
+                } for row in clashes],
+            })
+    return conflicts
@@ -0,0 +1,224 @@
+import re
+from markupsafe import Markup, escape
+from sqlalchemy import DateTime, Float, Integer, String, case, func, literal, null, or_, text
+from models import db, Patient, ElectronicRecord, Assessment, normalize_search_text
+
+# Pesquisa de pacientes sobre a coluna normalizada Patient.search_name.
+# PostgreSQL: índice GIN com pg_trgm (prefixo, substring e semelhança tolerante a erros de digitação).
+# SQLite: tabela FTS5 mantida por triggers (prefixo por palavra, ordenado por bm25).
+# Sem nenhum dos dois, recorre a LIKE sobre search_name.
+#
+# Pesquisa nas notas clínicas (textos SOAP dos registos e narrativas das avaliações).
+# PostgreSQL: configuração pt_unaccent (unaccent + stemmer português) e índices GIN de expressão;
+# como são índices sobre as próprias colunas, acompanham qualquer INSERT/UPDATE sem código extra.
+# SQLite: tabela FTS5 clinical_search alimentada por triggers. O FTS5 não tem stemmer português,
+# por isso cada palavra é pesquisada como prefixo ("lombalgi"* cobre lombalgia e lombalgias).
+
+RECORD_SEARCH_FIELDS = ['medical_diagnosis', 'subjective_notes', 'objective_notes', 'assessment', 'plan']
+ASSESSMENT_SEARCH_FIELDS = ['main_complaint', 'history_of_present_illness', 'past_medical_history', 'medications', 'social_history',
+                            'inspection_notes', 'palpation_notes', 'mobility_assessment', 'strength_assessment', 'neuro_assessment',
+                            'functional_assessment', 'diagnosis', 'goals', 'treatment_plan']
+
+
+def _document_sql(fields, alias=None):
+    # Texto indexado de uma linha; no PostgreSQL tem de ser idêntico na consulta e no índice.
+    prefix = f'{alias}.' if alias else ''
+    return " || ' ' || ".join(f"coalesce({prefix}{field}, '')" for field in fields)
+
+
+# rowid da clinical_search: id * 2 para registos, id * 2 + 1 para avaliações (apagar por rowid não varre a tabela).
+CLINICAL_SOURCES = [('record', 'electronic_record', 0, RECORD_SEARCH_FIELDS), ('assessment', 'assessment', 1, ASSESSMENT_SEARCH_FIELDS)]
+
+POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_patient_search_name_trgm ON patient USING gin (search_name gin_trgm_ops)",
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    "DO $$ BEGIN "
+    "IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'pt_unaccent') THEN "
+    "CREATE TEXT SEARCH CONFIGURATION pt_unaccent (COPY = portuguese); "
+    "ALTER TEXT SEARCH CONFIGURATION pt_unaccent ALTER MAPPING FOR hword, hword_part, word WITH unaccent, portuguese_stem; "
+    "END IF; END $$",
+] + [
+    f"CREATE INDEX IF NOT EXISTS ix_{table}_search ON {table} USING gin (to_tsvector('pt_unaccent', {_document_sql(fields)}))"
+    for kind, table, parity, fields in CLINICAL_SOURCES
+]
+
+# Nas tabelas FTS5 a clínica é um termo indexado (coluna clinic, 'clinic12'), pedido no próprio MATCH: o índice só
+# devolve e ordena as linhas da clínica, em vez de classificar os resultados de todas e filtrar depois.
+SQLITE_CLINIC_TOKEN = "'clinic' || {}.clinic_id"
+SQLITE_TRIGGERS = ['patient_search_ai', 'patient_search_ad', 'patient_search_au'] + [
+    f'{table}_search_{suffix}' for kind, table, parity, fields in CLINICAL_SOURCES for suffix in ('ai', 'ad', 'au')]
+
+# Recria tudo: uma base com a estrutura antiga fica com a atual.
+SQLITE_DDL = [f"DROP TRIGGER IF EXISTS {trigger}" for trigger in SQLITE_TRIGGERS] + [
+    "DROP TABLE IF EXISTS patient_search",
+    "DROP TABLE IF EXISTS clinical_search",
+    "CREATE VIRTUAL TABLE patient_search USING fts5(search_name, clinic, tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER patient_search_ai AFTER INSERT ON patient BEGIN "
+    f"INSERT INTO patient_search(rowid, search_name, clinic) VALUES (new.id, new.search_name, {SQLITE_CLINIC_TOKEN.format('new')}); END",
+    "CREATE TRIGGER patient_search_ad AFTER DELETE ON patient BEGIN "
+    "DELETE FROM patient_search WHERE rowid = old.id; END",
+    "CREATE TRIGGER patient_search_au AFTER UPDATE OF search_name, clinic_id ON patient BEGIN "
+    "DELETE FROM patient_search WHERE rowid = old.id; "
+    f"INSERT INTO patient_search(rowid, search_name, clinic) VALUES (new.id, new.search_name, {SQLITE_CLINIC_TOKEN.format('new')}); END",
+    f"INSERT INTO patient_search(rowid, search_name, clinic) SELECT id, search_name, {SQLITE_CLINIC_TOKEN.format('patient')} FROM patient",
+    "CREATE VIRTUAL TABLE clinical_search USING fts5(kind UNINDEXED, source_id UNINDEXED, clinic, patient_id UNINDEXED, body, tokenize='unicode61 remove_diacritics 2')",
+]
+for kind, table, parity, fields in CLINICAL_SOURCES:
+    insert_row = (f"INSERT INTO clinical_search(rowid, kind, source_id, clinic, patient_id, body) "
+                  f"VALUES (new.id * 2 + {parity}, '{kind}', new.id, {SQLITE_CLINIC_TOKEN.format('new')}, new.patient_id, {_document_sql(fields, 'new')}); ")
+    delete_row = f"DELETE FROM clinical_search WHERE rowid = old.id * 2 + {parity}; "
+    SQLITE_DDL += [
+        f"CREATE TRIGGER {table}_search_ai AFTER INSERT ON {table} BEGIN {insert_row}END",
+        f"CREATE TRIGGER {table}_search_ad AFTER DELETE ON {table} BEGIN {delete_row}END",
+        f"CREATE TRIGGER {table}_search_au AFTER UPDATE ON {table} BEGIN {delete_row}{insert_row}END",
+    ]
+SQLITE_DDL += [
+    f"INSERT INTO clinical_search(rowid, kind, source_id, clinic, patient_id, body) "
+    f"SELECT id * 2 + {parity}, '{kind}', id, {SQLITE_CLINIC_TOKEN.format(table)}, patient_id, {_document_sql(fields)} FROM {table}"
+    for kind, table, parity, fields in CLINICAL_SOURCES
+]
+
+_sqlite_fts_available = {}
+
+
+def install_search_indexes(engine):
+    # Idempotente: usado pelo 'flask init-db'; em bases migradas o Alembic cria as mesmas estruturas.
+    statements = {'postgresql': POSTGRES_DDL, 'sqlite': SQLITE_DDL}.get(engine.dialect.name, [])
+    with engine.begin() as connection:
+        for statement in statements:
+            connection.execute(text(statement))
+    _sqlite_fts_available.clear()
+
+
+def _has_sqlite_fts(connection, table='patient_search'):
+    key = (str(connection.engine.url), table)
+    if key not in _sqlite_fts_available:
+        _sqlite_fts_available[key] = connection.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :table"), {'table': table}).first() is not None
+    return _sqlite_fts_available[key]
+
+
+def _fts_match_expression(normalized):
+    # Cada palavra vira um prefixo entre aspas: "joao"* "sil"*
+    return ' '.join('"{}"*'.format(token.replace('"', '""')) for token in re.findall(r'\w+', normalized))
+
+
+def _clinic_match(clinic_id, column, match):
+    # O termo da clínica e a pesquisa, esta restrita à coluna de texto (uma palavra como "clinic" não casa com a coluna clinic).
+    return f'clinic : "clinic{int(clinic_id)}" AND {column} : ({match})'
+
+
+def search_patients(clinic_id, term):
+    # Devolve uma consulta de Patient já filtrada pela clínica e ordenada por relevância.
+    normalized = normalize_search_text(term)
+    query = Patient.query.filter(Patient.clinic_id == clinic_id)
+    if not normalized:
+        return query.order_by(Patient.full_name)
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        similarity = func.similarity(Patient.search_name, normalized)
+        starts_with = case((Patient.search_name.startswith(normalized, autoescape=True), 0), else_=1)
+        return query.filter(or_(Patient.search_name.contains(normalized, autoescape=True), Patient.search_name.op('%')(normalized))) \
+            .order_by(starts_with, similarity.desc(), Patient.full_name)
+    match = _fts_match_expression(normalized)
+    if dialect == 'sqlite' and match and _has_sqlite_fts(db.session.connection()):
+        hits = text("SELECT rowid AS patient_id, rank FROM patient_search WHERE patient_search MATCH :match") \
+            .bindparams(match=_clinic_match(clinic_id, 'search_name', match)).columns(patient_id=Integer, rank=Float).subquery()
+        return query.join(hits, hits.c.patient_id == Patient.id).order_by(hits.c.rank, Patient.full_name)
+    starts_with = case((Patient.search_name.startswith(normalized, autoescape=True), 0), else_=1)
+    return query.filter(Patient.search_name.contains(normalized, autoescape=True)).order_by(starts_with, Patient.full_name)
+
+
+NOTE_HIT_COLUMNS = {'kind': String, 'source_id': Integer, 'patient_id': Integer, 'patient_name': String, 'happened_at': DateTime, 'rank': Float, 'snippet': String}
+
+# Marcadores de destaque que não aparecem em texto digitado; o trecho é escapado e só depois ganha <mark>.
+SNIPPET_START, SNIPPET_STOP = '\x02', '\x03'
+
+
+def _highlight(snippet):
+    if not snippet:
+        return None
+    snippet = re.sub(r'\s+', ' ', snippet).strip()
+    return Markup(str(escape(snippet)).replace(SNIPPET_START, '<mark>').replace(SNIPPET_STOP, '</mark>'))
+
+
+def _fts_notes_expression(normalized):
+    # Como _fts_match_expression, mas "ou"/"or" entre palavras vira OR do FTS5 e o plural em -s
+    # é retirado antes do prefixo ("lombalgias" procura "lombalgia"*), na falta de stemmer.
+    parts = []
+    for token in re.findall(r'\w+', normalized):
+        if token in ('ou', 'or'):
+            if parts and parts[-1] != 'OR':
+                parts.append('OR')
+            continue
+        if len(token) > 4 and token.endswith('s'):
+            token = token[:-1]
+        parts.append('"{}"*'.format(token))
+    if parts and parts[-1] == 'OR':
+        parts.pop()
+    return ' '.join(parts)
+
+
+def _postgres_notes(clinic_id, term, limit):
+    # O ts_headline só é calculado para as linhas que passam o LIMIT.
+    ranked = ' UNION ALL '.join(
+        f"SELECT '{kind}' AS kind, s.id AS source_id, s.patient_id, s.{'record_date' if kind == 'record' else 'created_at'} AS happened_at, "
+        f"{_document_sql(fields, 's')} AS document, ts_rank(to_tsvector('pt_unaccent', {_document_sql(fields, 's')}), q.query) AS rank "
+        f"FROM {table} s, q WHERE s.clinic_id = :clinic_id AND to_tsvector('pt_unaccent', {_document_sql(fields, 's')}) @@ q.query"
+        for kind, table, parity, fields in CLINICAL_SOURCES)
+    statement = text(
+        "WITH q AS (SELECT websearch_to_tsquery('pt_unaccent', :term) AS query), "
+        f"hits AS ({ranked} ORDER BY rank DESC LIMIT :limit) "
+        "SELECT hits.kind, hits.source_id, hits.patient_id, patient.full_name AS patient_name, hits.happened_at, hits.rank, "
+        "ts_headline('pt_unaccent', hits.document, q.query, :headline_options) AS snippet "
+        "FROM hits JOIN patient ON patient.id = hits.patient_id, q ORDER BY hits.rank DESC").columns(**NOTE_HIT_COLUMNS)
+    options = f'StartSel={SNIPPET_START}, StopSel={SNIPPET_STOP}, MaxFragments=2, MaxWords=20, MinWords=8, FragmentDelimiter=" … "'
+    return db.session.execute(statement, {'term': term, 'clinic_id': clinic_id, 'limit': limit, 'headline_options': options}).all()
+
+
+def _sqlite_notes(clinic_id, match, limit):
+    statement = text(
+        "SELECT clinical_search.kind, clinical_search.source_id, clinical_search.patient_id, patient.full_name AS patient_name, "
+        "coalesce(electronic_record.record_date, assessment.created_at) AS happened_at, clinical_search.rank AS rank, "
+        "snippet(clinical_search, 4, :start, :stop, ' … ', 16) AS snippet "
+        "FROM clinical_search JOIN patient ON patient.id = clinical_search.patient_id "
+        "LEFT JOIN electronic_record ON clinical_search.kind = 'record' AND electronic_record.id = clinical_search.source_id "
+        "LEFT JOIN assessment ON clinical_search.kind = 'assessment' AND assessment.id = clinical_search.source_id "
+        "WHERE clinical_search MATCH :match ORDER BY clinical_search.rank LIMIT :limit").columns(**NOTE_HIT_COLUMNS)
+    return db.session.execute(statement, {'match': _clinic_match(clinic_id, 'body', match), 'limit': limit, 'start': SNIPPET_START, 'stop': SNIPPET_STOP}).all()
+
+
+def _like_notes(clinic_id, term, limit):
+    # Sem índice de texto: LIKE sobre cada campo, sem ranking nem destaque, mais recentes primeiro.
+    rows = []
+    for kind, model, date_column, fields in (('record', ElectronicRecord, ElectronicRecord.record_date, RECORD_SEARCH_FIELDS),
+                                             ('assessment', Assessment, Assessment.created_at, ASSESSMENT_SEARCH_FIELDS)):
+        conditions = [getattr(model, field).contains(term, autoescape=True) for field in fields]
+        rows += db.session.query(literal(kind), model.id, model.patient_id, Patient.full_name, date_column, null(), null()) \
+            .join(Patient, Patient.id == model.patient_id).filter(model.clinic_id == clinic_id, or_(*conditions)).order_by(date_column.desc()).limit(limit).all()
+    return sorted(rows, key=lambda row: row[4], reverse=True)[:limit]
+
+
+def search_clinical_notes(clinic_id, term, limit=50):
+    # Devolve dicionários ordenados por relevância: tipo, id de origem, paciente, data e trecho com <mark>.
+    normalized = normalize_search_text(term)
+    if not normalized:
+        return []
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        rows = _postgres_notes(clinic_id, term, limit)
+    else:
+        match = _fts_notes_expression(normalized)
+        if dialect == 'sqlite' and match and _has_sqlite_fts(db.session.connection(), 'clinical_search'):
+            rows = _sqlite_notes(clinic_id, match, limit)
+        else:
+            rows = _like_notes(clinic_id, term.strip(), limit)
+    return [{
+        'kind': row[0],
+        'id': row[1],
+        'patient_id': row[2],
+        'patient_name': row[3],
+        'date': row[4],
+        'rank': row[5],
+        'snippet': _highlight(row[6]),
+    } for row in rows]
@@ -0,0 +1,155 @@
+import hashlib
+import mimetypes
+import os
+import shutil
+import tempfile
+from urllib.parse import quote
+from flask import Request, Response, redirect, send_file
+
+# Armazenamento dos anexos. Cada UploadedFile guarda o nome do backend onde está (coluna storage), por isso
+# mudar STORAGE_BACKEND só afeta os envios novos e os anexos antigos continuam a abrir.
+# CloudinaryStorage: como antes, o download redireciona para o secure_url.
+# LocalStorage: sem dependência de nuvem. Os arquivos ficam em root/ab/abcdef... pelo sha256 do conteúdo, e o mesmo
+# exame enviado duas vezes ocupa espaço uma vez só. Os downloads aceitam Range (send_file condicional) e podem ser
+# entregues pelo servidor web com X-Sendfile (USE_X_SENDFILE) ou X-Accel-Redirect do nginx (accel_prefix).
+
+CHUNK_SIZE = 64 * 1024
+# Prefixos dos temporários em incoming_dir (arquivos recebidos e variantes em geração); o sweep-uploads apaga os
+# que ficam para trás.
+UPLOAD_PREFIX, VARIANT_PREFIX = 'upload-', 'variant-'
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as stored:
+        for chunk in iter(lambda: stored.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Só estes tipos são mostrados no navegador; o resto (HTML, SVG, scripts...) vem como anexo application/octet-stream,
+# para um arquivo enviado nunca correr como página na origem da aplicação.
+INLINE_CONTENT_TYPES = {'image/jpeg', 'image/png', 'image/webp', 'image/gif', 'application/pdf'}
+
+
+def _resource_type(content_type):
+    return 'image' if content_type.startswith('image/') else 'raw'
+
+
+class SpooledUpload:
+    # Destino de um arquivo do multipart: grava em disco à medida que o corpo chega e calcula o sha256 pelo caminho.
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        descriptor, self.path = tempfile.mkstemp(prefix=UPLOAD_PREFIX, dir=directory)
+        self._file = os.fdopen(descriptor, 'w+b')
+        self._hash = hashlib.sha256()
+        self.claimed = False
+
+    def write(self, data):
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def discard(self):
+        self._file.close()
+        if not self.claimed:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+def spooling_request_class(directory):
+    # O Werkzeug passa a escrever cada arquivo enviado diretamente em 'directory', em blocos, sem o manter em memória.
+    # Arquivos que ninguém reclamou (formulário inválido, campo vazio) são apagados quando o pedido fecha.
+    class SpoolingRequest(Request):
+        def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+            spooled = SpooledUpload(directory)
+            self.__dict__.setdefault('_spooled_uploads', []).append(spooled)
+            return spooled
+
+        def close(self):
+            super().close()
+            for spooled in self.__dict__.get('_spooled_uploads', ()):
+                spooled.discard()
+    return SpoolingRequest
+
+
+def spool_file(file, directory):
+    # Devolve (caminho, sha256) de um FileStorage já em disco; fora do SpoolingRequest copia-o em blocos.
+    if isinstance(file.stream, SpooledUpload):
+        file.stream.flush()
+        file.stream.claimed = True
+        return file.stream.path, file.stream.hexdigest()
+    spooled = SpooledUpload(directory)
+    shutil.copyfileobj(file.stream, spooled, CHUNK_SIZE)
+    spooled.claimed = True
+    spooled.close()
+    return spooled.path, spooled.hexdigest()
+
+
+class CloudinaryStorage:
+    name = 'cloudinary'
+    # Diretório próprio: o sweep-uploads só limpa temporários desta aplicação.
+    incoming_dir = os.path.join(tempfile.gettempdir(), 'fisio-uploads')
+
+    def save(self, path, filename, digest=None):
+        import cloudinary.uploader
+        result = cloudinary.uploader.upload(path)
+        return {'public_id': result['public_id'], 'secure_url': result['secure_url'], 'resource_type': result['resource_type'],
+                'content_type': mimetypes.guess_type(filename or '')[0], 'size': result.get('bytes')}
+
+    def send(self, item, download_name=None):
+        return redirect(item.secure_url)
+
+
+class LocalStorage:
+    name = 'local'
+
+    def __init__(self, root, accel_prefix=None):
+        self.root = root
+        self.incoming_dir = os.path.join(root, 'incoming')
+        self.accel_prefix = accel_prefix
+
+    def _relative_path(self, public_id):
+        return os.path.join(public_id[:2], public_id)
+
+    def path(self, public_id):
+        return os.path.join(self.root, self._relative_path(public_id))
+
+    def save(self, path, filename, digest=None):
+        # Consome 'path': move-o para o endereço do conteúdo ou, se esse conteúdo já existe, apaga-o.
+        digest = digest or _file_sha256(path)
+        target = self.path(digest)
+        size = os.path.getsize(path)
+        if os.path.exists(target):
+            os.remove(path)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(path, target)
+        content_type = mimetypes.guess_type(filename or '')[0] or 'application/octet-stream'
+        return {'public_id': digest, 'secure_url': None, 'resource_type': _resource_type(content_type), 'content_type': content_type, 'size': size}
+
+    def send(self, item, download_name=None):
+        # item: UploadedFile ou FileVariant.
+        inline = item.content_type in INLINE_CONTENT_TYPES
+        mimetype = item.content_type if inline else 'application/octet-stream'
+        download_name = download_name or item.public_id
+        if self.accel_prefix:
+            response = Response(mimetype=mimetype)
+            response.headers['X-Accel-Redirect'] = self.accel_prefix.rstrip('/') + '/' + self._relative_path(item.public_id).replace(os.sep, '/')
+            response.headers['Content-Disposition'] = f"{'inline' if inline else 'attachment'}; filename*=UTF-8''{quote(download_name)}"
+        else:
+            # Conteúdo imutável por public_id: ETag forte e pedidos Range (206) tratados pelo send_file.
+            response = send_file(self.path(item.public_id), mimetype=mimetype, as_attachment=not inline, download_name=download_name, conditional=True, etag=item.public_id)
+        response.headers['X-Content-Type-Options'] = 'nosniff'
+        return response
+
+
+def create_storages(local_root, accel_prefix=None):
+    return {'cloudinary': CloudinaryStorage(), 'local': LocalStorage(local_root, accel_prefix)}
@@ -0,0 +1,68 @@
+import os
+import sys
+import tempfile
+from datetime import date
+
+import pytest
+
+# A aplicação lê a configuração na importação: a base de testes e os envios locais têm de estar definidos antes.
+TEST_DIR = tempfile.mkdtemp(prefix='fisio-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(TEST_DIR, 'test.db')
+os.environ.setdefault('MERCADO_PAGO_ACCESS_TOKEN', 'test')
+os.environ['STORAGE_BACKEND'] = 'local'
+os.environ['STORAGE_LOCAL_DIR'] = os.path.join(TEST_DIR, 'storage')
+os.environ['UPLOAD_WORKERS'] = '0'
+os.environ['DERIVATIVE_WORKERS'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as fisio  # noqa: E402
+from models import db, Clinic, User, Patient  # noqa: E402
+
+
+# Cada pedido do cliente de teste abre o seu próprio app context, como em produção (o Flask-Login guarda o
+# utilizador em g); os auxiliares abrem um contexto curto e devolvem ids, não objetos ligados a uma sessão.
+@pytest.fixture
+def app():
+    original_config = dict(fisio.app.config)
+    fisio.app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with fisio.app.app_context():
+        db.drop_all()
+        db.create_all()
+        fisio.install_search_indexes(db.engine)
+    fisio.clinic_cache.backend = type(fisio.clinic_cache.backend)()
+    yield fisio.app
+    fisio.app.config.update(original_config)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def create(instance):
+    with fisio.app.app_context():
+        db.session.add(instance)
+        db.session.commit()
+        return instance.id
+
+
+@pytest.fixture
+def clinic_id(app):
+    return create(Clinic(name='Clínica Teste'))
+
+
+def make_user(clinic_id, name):
+    user = User(name=name, email=f'{name.lower()}@example.com', clinic_id=clinic_id)
+    user.set_password('senha')
+    return create(user)
+
+
+def make_patient(clinic_id, user_id, full_name='João Silva', **fields):
+    fields = dict(dict(date_of_birth=date(1980, 1, 1), gender='Masculino', phone='1'), **fields)
+    return create(Patient(full_name=full_name, clinic_id=clinic_id, user_id=user_id, **fields))
+
+
+def login(client, user_id):
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
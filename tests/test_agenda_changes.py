@@ -0,0 +1,94 @@
+import time
+from datetime import datetime, timedelta
+
+from conftest import login, make_patient, make_user
+from models import db, Appointment, AppointmentTombstone
+
+
+def _cursor(client):
+    return int(client.get('/api/appointments').headers['X-Agenda-Cursor'])
+
+
+def _book(client, patient_id):
+    response = client.post('/api/appointment/create_from_agenda', json={'patient_id': patient_id, 'start_datetime': '2030-03-04T10:00:00', 'session_price': 100})
+    assert response.status_code == 200
+
+
+def test_patient_rename_changes_etag_and_delta(app, client, clinic_id):
+    ana = make_user(clinic_id, 'Ana')
+    patient = make_patient(clinic_id, ana, 'Nome Antigo')
+    login(client, ana)
+    _book(client, patient)
+    before = client.get('/api/appointments')
+    cursor = int(before.headers['X-Agenda-Cursor'])
+    assert client.get('/api/appointments', headers={'If-None-Match': before.headers['ETag']}).status_code == 304
+    response = client.post(f'/patient/{patient}/edit', data={'full_name': 'Nome Novo', 'date_of_birth': '1980-01-01', 'gender': 'Masculino', 'phone': '1', 'specialty': 'Pilates'})
+    assert response.status_code == 302
+    after = client.get('/api/appointments', headers={'If-None-Match': before.headers['ETag']})
+    assert after.status_code == 200
+    assert [event['title'] for event in after.get_json()] == ['Nome Novo']
+    delta = client.get(f'/api/appointments/changes?since={cursor}').get_json()
+    assert [event['title'] for event in delta['events']] == ['Nome Novo']
+
+
+def test_patient_delete_sends_tombstones(app, client, clinic_id):
+    ana = make_user(clinic_id, 'Ana')
+    patient = make_patient(clinic_id, ana)
+    login(client, ana)
+    _book(client, patient)
+    with app.app_context():
+        appointment_id = db.session.query(Appointment.id).scalar()
+    cursor = _cursor(client)
+    client.post(f'/patient/{patient}/delete')
+    delta = client.get(f'/api/appointments/changes?since={cursor}').get_json()
+    assert delta['deleted'] == [appointment_id]
+
+
+def test_times_round_trip_in_utc(app, client, clinic_id):
+    ana = make_user(clinic_id, 'Ana')
+    patient = make_patient(clinic_id, ana)
+    login(client, ana)
+    # O navegador (UTC-3) marca 10:00 locais e envia toISOString().
+    assert client.post('/api/appointment/create_from_agenda', json={'patient_id': patient, 'start_datetime': '2030-03-04T13:00:00.000Z', 'timezone_offset': 180}).status_code == 200
+    [event] = client.get('/api/appointments').get_json()
+    assert event['start'] == '2030-03-04T13:00:00+00:00'
+    assert client.post(f"/api/appointment/{event['id']}/update", json={'start_time': event['start']}).get_json()['status'] == 'success'
+    [again] = client.get('/api/appointments').get_json()
+    assert again['start'] == event['start']
+    [delta] = client.get('/api/appointments/changes?since=0').get_json()['events']
+    assert delta['start'] == event['start']
+    # A janela do FullCalendar chega com o offset local e é comparada em UTC.
+    assert len(client.get('/api/appointments', query_string={'start': '2030-03-04T10:00:00-03:00', 'end': '2030-03-04T11:00:00-03:00'}).get_json()) == 1
+    assert client.get('/api/appointments', query_string={'start': '2030-03-04T10:30:00-03:00', 'end': '2030-03-05T00:00:00-03:00'}).get_json() == []
+
+
+def test_agenda_stream_ends_after_its_time_limit(app, client, clinic_id):
+    login(client, make_user(clinic_id, 'Ana'))
+    app.config.update(AGENDA_STREAM_HEARTBEAT=1, AGENDA_STREAM_MAX_SECONDS=1)
+    started = time.monotonic()
+    body = client.get('/api/appointments/stream').get_data(as_text=True)
+    assert body.startswith('retry: 5000')
+    assert time.monotonic() - started < 5
+
+
+def test_pruned_tombstones_force_a_full_resync(app, client, clinic_id):
+    ana = make_user(clinic_id, 'Ana')
+    patient = make_patient(clinic_id, ana)
+    login(client, ana)
+    for start in ('2030-03-04T10:00:00', '2030-03-05T10:00:00'):
+        assert client.post('/api/appointment/create_from_agenda', json={'patient_id': patient, 'start_datetime': start}).status_code == 200
+    first, second = [event['id'] for event in client.get('/api/appointments').get_json()]
+    stale_cursor = _cursor(client)
+    assert client.post(f'/api/appointment/{first}/delete').status_code == 200
+    recent_cursor = _cursor(client)
+    assert client.post(f'/api/appointment/{second}/delete').status_code == 200
+    with app.app_context():
+        # O primeiro apagamento passa do prazo de retenção; o segundo fica.
+        AppointmentTombstone.query.filter_by(appointment_id=first).update({'deleted_at': datetime.utcnow() - timedelta(days=60)})
+        db.session.commit()
+    result = app.test_cli_runner().invoke(args=['prune-tombstones', '--days', '30'])
+    assert result.exit_code == 0 and '1.' in result.output
+    stale = client.get(f'/api/appointments/changes?since={stale_cursor}').get_json()
+    assert stale['resync'] is True and stale['deleted'] == []
+    recent = client.get(f'/api/appointments/changes?since={recent_cursor}').get_json()
+    assert 'resync' not in recent and recent['deleted'] == [second]
@@ -0,0 +1,50 @@
+from datetime import datetime
+
+import pytest
+
+from conftest import create, login, make_patient, make_user
+from models import Appointment, NO_SHOW_STATUS
+
+PERIOD = {'start_date': '2020-03-01', 'end_date': '2020-03-31'}
+
+
+def _metric(client, metric, **params):
+    response = client.get(f'/api/analytics/{metric}', query_string={**PERIOD, **params})
+    assert response.status_code == 200
+    return response.get_json()['results']
+
+
+@pytest.mark.parametrize('metric', ['attendance', 'revenue', 'retention'])
+def test_metrics_on_an_empty_clinic(app, client, clinic_id, metric):
+    login(client, make_user(clinic_id, 'Ana'))
+    assert _metric(client, metric) == []
+
+
+def test_metrics_on_populated_data(app, client, clinic_id):
+    ana, bruno = make_user(clinic_id, 'Ana'), make_user(clinic_id, 'Bruno')
+    patient_a = make_patient(clinic_id, ana, 'Paciente A', specialty='Pilates')
+    patient_b = make_patient(clinic_id, bruno, 'Paciente B')
+    sessions = [
+        # Segundas-feiras da Ana; a primeira e a última sessão concluídas distam quatro semanas.
+        (ana, patient_a, datetime(2020, 3, 2, 10), 'Concluído', 100.0, 100.0),
+        (ana, patient_a, datetime(2020, 3, 9, 10), 'Cancelado', 100.0, 0.0),
+        (ana, patient_a, datetime(2020, 3, 16, 10), NO_SHOW_STATUS, 100.0, 0.0),
+        (ana, patient_a, datetime(2020, 3, 30, 10), 'Concluído', 100.0, 50.0),
+        # Quarta-feira 01:00 em UTC, terça 22:00 em UTC-3.
+        (bruno, patient_b, datetime(2020, 3, 4, 1), 'Concluído', 80.0, 0.0),
+    ]
+    for user_id, patient_id, start, status, price, paid in sessions:
+        create(Appointment(user_id=user_id, patient_id=patient_id, clinic_id=clinic_id, start_time=start, status=status, session_price=price, amount_paid=paid, location='Clínica'))
+    login(client, ana)
+    attendance = {(row['professional'], row['weekday']): row for row in _metric(client, 'attendance')}
+    assert set(attendance) == {('Ana', 1), ('Bruno', 3)}
+    assert (attendance['Ana', 1]['total'], attendance['Ana', 1]['cancel_rate'], attendance['Ana', 1]['no_show_rate']) == (4, 0.25, 0.25)
+    assert {(row['professional'], row['weekday_name']) for row in _metric(client, 'attendance', timezone_offset=180)} == {('Ana', 'Segunda'), ('Bruno', 'Terça')}
+    assert _metric(client, 'revenue') == [
+        {'specialty': 'Pilates', 'billed': 300.0, 'received': 150.0, 'completed_sessions': 2},
+        {'specialty': 'N/A', 'billed': 80.0, 'received': 0.0, 'completed_sessions': 1},
+    ]
+    [cohort] = _metric(client, 'retention')
+    assert (cohort['cohort'], cohort['patients']) == ('2020-03', 2)
+    assert cohort['retention'][:6] == [1.0, 0.5, 0.5, 0.5, 0.5, 0.0]
+    assert client.get('/api/analytics/desconhecido').status_code == 404
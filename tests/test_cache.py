@@ -0,0 +1,42 @@
+from conftest import login, make_patient, make_user
+
+
+def _book(client, patient_id, start='2030-03-04T10:00:00', price=100):
+    assert client.post('/api/appointment/create_from_agenda', json={'patient_id': patient_id, 'start_datetime': start, 'session_price': price}).status_code == 200
+
+
+def test_cached_dashboard_changes_after_a_patient_is_added(app, client, clinic_id):
+    ana = make_user(clinic_id, 'Ana')
+    login(client, ana)
+    assert 'aria-valuemax="1"' not in client.get('/dashboard').get_data(as_text=True)
+    assert client.post('/patient/add', data={'full_name': 'Maria', 'date_of_birth': '1990-05-01', 'gender': 'Feminino', 'phone': '1', 'specialty': 'Pilates'}).status_code == 302
+    assert 'aria-valuemax="1"' in client.get('/dashboard').get_data(as_text=True)
+
+
+def test_cached_patient_list_changes_after_writes(app, client, clinic_id):
+    ana = make_user(clinic_id, 'Ana')
+    patient = make_patient(clinic_id, ana, 'Maria')
+    login(client, ana)
+    assert client.get('/api/patients?with_total=1').get_json()['total'] == 1
+    assert client.post('/patient/add', data={'full_name': 'Joana', 'date_of_birth': '1990-05-01', 'gender': 'Feminino', 'phone': '1', 'specialty': ''}).status_code == 302
+    page = client.get('/api/patients?with_total=1').get_json()
+    assert (page['total'], [result['name'] for result in page['results']]) == (2, ['Joana', 'Maria'])
+    assert client.post(f'/patient/{patient}/edit', data={'full_name': 'Mariana', 'date_of_birth': '1980-01-01', 'gender': 'Feminino', 'phone': '1', 'specialty': ''}).status_code == 302
+    assert [result['name'] for result in client.get('/api/patients?with_total=1').get_json()['results']] == ['Joana', 'Mariana']
+    assert [result['name'] for result in client.get('/api/patients?q=mari').get_json()['results']] == ['Mariana']
+
+
+def test_cached_reports_and_analytics_change_after_a_booking(app, client, clinic_id):
+    ana = make_user(clinic_id, 'Ana')
+    patient = make_patient(clinic_id, ana)
+    login(client, ana)
+    period = {'start_date': '2030-03-01', 'end_date': '2030-03-31'}
+    assert '0 atendimentos' in client.get('/reports', query_string=period).get_data(as_text=True)
+    assert client.get('/api/analytics/revenue', query_string=period).get_json()['results'] == []
+    _book(client, patient)
+    assert '1 atendimentos' in client.get('/reports', query_string=period).get_data(as_text=True)
+    [revenue] = client.get('/api/analytics/revenue', query_string=period).get_json()['results']
+    assert revenue['billed'] == 100.0
+    event_id = client.get('/api/appointments').get_json()[0]['id']
+    assert client.post(f'/api/appointment/{event_id}/update', json={'session_price': 150}).status_code == 200
+    assert client.get('/api/analytics/revenue', query_string=period).get_json()['results'][0]['billed'] == 150.0
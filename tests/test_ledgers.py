@@ -0,0 +1,56 @@
+import pytest
+
+from conftest import fisio, login, make_patient, make_user
+from models import db, Appointment, PatientBalance
+
+
+def _balances():
+    with fisio.app.app_context():
+        return {balance.patient_id: (round(balance.total_due, 2), round(balance.total_paid, 2)) for balance in PatientBalance.query}
+
+
+def _assert_ledger_matches_rebuild(app):
+    ledger = _balances()
+    result = app.test_cli_runner().invoke(args=['reconcile-balances'])
+    assert result.exit_code == 0, result.output
+    assert ledger == _balances()
+
+
+@pytest.fixture
+def agenda(app, client, clinic_id):
+    # Dois pacientes da mesma profissional, com uma série semanal (seg/qua, 3 semanas) e uma sessão avulsa.
+    ana = make_user(clinic_id, 'Ana')
+    patients = [make_patient(clinic_id, ana, 'Paciente A'), make_patient(clinic_id, ana, 'Paciente B')]
+    login(client, ana)
+    series = client.post('/api/appointment/create_from_agenda', json={'patient_id': patients[0], 'start_datetime': '2030-03-04T10:00:00', 'session_price': 120, 'is_recurring': True, 'weeks_to_repeat': 3, 'weekdays': [1, 3]})
+    single = client.post('/api/appointment/create_from_agenda', json={'patient_id': patients[1], 'start_datetime': '2030-03-04T14:00:00', 'session_price': 90})
+    assert series.status_code == single.status_code == 200
+    with app.app_context():
+        appointments = [(appointment.id, appointment.recurrence_id) for appointment in Appointment.query.order_by(Appointment.start_time, Appointment.id)]
+    return patients, appointments
+
+
+def test_balances_match_reconcile_after_every_write_path(app, client, agenda):
+    patients, appointments = agenda
+    _assert_ledger_matches_rebuild(app)
+    (first, recurrence_id), (second, _), (third, _) = appointments[:3]
+    assert client.post(f'/api/appointment/{first}/complete').status_code == 200
+    _assert_ledger_matches_rebuild(app)
+    assert client.post(f'/api/appointment/{first}/update', json={'session_price': 150, 'amount_paid': 100}).status_code == 200
+    _assert_ledger_matches_rebuild(app)
+    assert client.post(f'/api/appointment/{second}/cancel').status_code == 200
+    _assert_ledger_matches_rebuild(app)
+    assert client.post(f'/api/appointment/{third}/delete').status_code == 200
+    _assert_ledger_matches_rebuild(app)
+    assert client.post('/api/appointments/cancel_series', json={'recurrence_id': recurrence_id}).status_code == 200
+    _assert_ledger_matches_rebuild(app)
+    assert _balances()[patients[0]] == (150.0, 100.0)
+
+
+def test_first_charge_creates_a_missing_balance_row(app, client, agenda):
+    patients, _ = agenda
+    with app.app_context():
+        PatientBalance.query.filter_by(patient_id=patients[1]).delete()
+        db.session.commit()
+    assert client.post('/api/appointment/create_from_agenda', json={'patient_id': patients[1], 'start_datetime': '2030-03-08T14:00:00', 'session_price': 80}).status_code == 200
+    assert _balances()[patients[1]] == (80.0, 0.0)
@@ -0,0 +1,47 @@
+from conftest import create, fisio, login, make_patient, make_user
+from models import Exercise
+
+
+def _walk(client, url, limit):
+    # Percorre as páginas com next_cursor e volta com prev_cursor a partir da última.
+    forward, cursor = [], None
+    while True:
+        page = client.get(url, query_string={'limit': limit, **({'cursor': cursor} if cursor else {})}).get_json()
+        forward.append([result['id'] for result in page['results']])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    backward, cursor = [forward[-1]], page['prev_cursor']
+    while cursor is not None:
+        page = client.get(url, query_string={'limit': limit, 'cursor': cursor}).get_json()
+        backward.insert(0, [result['id'] for result in page['results']])
+        cursor = page['prev_cursor']
+    return forward, backward
+
+
+def test_patient_pages_are_stable_and_do_not_overlap(app, client, clinic_id):
+    ana = make_user(clinic_id, 'Ana')
+    # Nomes repetidos: o id desempata a ordem.
+    names = ['Maria', 'José', 'Ana', 'Maria', 'Bruno', 'Carla', 'Maria', 'Ana', 'Zé', 'Lia', 'Rui', 'Eva', 'Ivo']
+    expected = [patient_id for _, patient_id in sorted((name, make_patient(clinic_id, ana, name)) for name in names)]
+    login(client, ana)
+    forward, backward = _walk(client, '/api/patients', 4)
+    assert [len(page) for page in forward] == [4, 4, 4, 1]
+    assert [patient_id for page in forward for patient_id in page] == expected
+    assert backward == forward
+    # Uma inserção antes do cursor não repete nem salta linhas na página seguinte.
+    first = client.get('/api/patients', query_string={'limit': 4}).get_json()
+    make_patient(clinic_id, ana, 'Aaron')
+    fisio.clinic_cache.invalidate('patients', clinic_id)
+    second = client.get('/api/patients', query_string={'limit': 4, 'cursor': first['next_cursor']}).get_json()
+    assert [result['id'] for result in second['results']] == expected[4:8]
+
+
+def test_exercise_pages_are_stable_and_do_not_overlap(app, client, clinic_id):
+    ana = make_user(clinic_id, 'Ana')
+    expected = [exercise_id for _, exercise_id in sorted((name, create(Exercise(name=name, clinic_id=clinic_id))) for name in ['Ponte', 'Agachamento', 'Prancha', 'Ponte', 'Remada', 'Alongamento', 'Agachamento'])]
+    login(client, ana)
+    forward, backward = _walk(client, '/api/exercises', 3)
+    assert [exercise_id for page in forward for exercise_id in page] == expected
+    assert backward == forward
+    assert client.get('/api/exercises', query_string={'cursor': 'lixo'}).get_json()['results'][0]['id'] == expected[0]
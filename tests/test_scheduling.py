@@ -0,0 +1,110 @@
+from conftest import login, make_patient, make_user
+
+
+def _book(client, patient_id, location=None, start='2030-03-04T10:00:00'):
+    payload = {'patient_id': patient_id, 'start_datetime': start, 'session_price': 100}
+    if location is not None:
+        payload['location'] = location
+    return client.post('/api/appointment/create_from_agenda', json=payload)
+
+
+def test_two_professionals_same_time_at_default_location_do_not_conflict(app, client, clinic_id):
+    ana, bruno = make_user(clinic_id, 'Ana'), make_user(clinic_id, 'Bruno')
+    patient_a, patient_b = make_patient(clinic_id, ana, 'Paciente A'), make_patient(clinic_id, bruno, 'Paciente B')
+    for check_location in (False, True):
+        app.config['CHECK_LOCATION_CONFLICTS'] = check_location
+        start = '2030-03-04T10:00:00' if check_location else '2030-03-05T10:00:00'
+        login(client, ana)
+        assert _book(client, patient_a, 'Clínica', start).status_code == 200
+        login(client, bruno)
+        # Sem local informado, a agenda usa o mesmo local genérico.
+        response = _book(client, patient_b, None, start)
+        assert response.status_code == 200, response.get_json()
+
+
+def test_location_conflicts_are_opt_in(app, client, clinic_id):
+    ana, bruno = make_user(clinic_id, 'Ana'), make_user(clinic_id, 'Bruno')
+    patient_a, patient_b = make_patient(clinic_id, ana, 'Paciente A'), make_patient(clinic_id, bruno, 'Paciente B')
+    assert app.config['CHECK_LOCATION_CONFLICTS'] is False
+    login(client, ana)
+    assert _book(client, patient_a, 'Sala 1').status_code == 200
+    login(client, bruno)
+    assert _book(client, patient_b, 'Sala 1').status_code == 200
+    app.config['CHECK_LOCATION_CONFLICTS'] = True
+    login(client, ana)
+    response = _book(client, patient_b, 'Sala 1', '2030-03-04T10:30:00')
+    assert response.status_code == 409
+    assert {conflict['reason'] for entry in response.get_json()['conflicts'] for conflict in entry['conflicts']} == {'professional', 'location'}
+
+
+def test_same_professional_still_conflicts(app, client, clinic_id):
+    ana = make_user(clinic_id, 'Ana')
+    patient = make_patient(clinic_id, ana)
+    login(client, ana)
+    assert _book(client, patient).status_code == 200
+    assert _book(client, patient).status_code == 409
+
+
+def test_invalid_weekdays_are_rejected(app, client, clinic_id):
+    ana = make_user(clinic_id, 'Ana')
+    patient = make_patient(clinic_id, ana)
+    login(client, ana)
+    for weekdays in (['x'], [7], [-1], [None]):
+        response = client.post('/api/appointment/create_from_agenda', json={'patient_id': patient, 'start_datetime': '2030-03-04T10:00:00', 'is_recurring': True, 'weeks_to_repeat': 2, 'weekdays': weekdays})
+        assert response.status_code == 400, weekdays
+        assert response.get_json()['status'] == 'error'
+    # Segunda (1) e quarta (3) durante duas semanas, a partir de segunda, 4 de março.
+    response = client.post('/api/appointment/create_from_agenda', json={'patient_id': patient, 'start_datetime': '2030-03-04T10:00:00', 'is_recurring': True, 'weeks_to_repeat': 2, 'weekdays': ['1', 3]})
+    assert response.status_code == 200
+    assert len(client.get('/api/appointments').get_json()) == 4
+
+
+def _series(client, patient, start):
+    response = client.post('/api/appointment/create_from_agenda', json={'patient_id': patient, 'start_datetime': start, 'session_price': 100, 'is_recurring': True, 'weeks_to_repeat': 2, 'weekdays': [1, 3]})
+    assert response.status_code == 200
+    return client.get('/api/appointments/changes?since=0').get_json()['events']
+
+
+def test_cancel_series_cancels_only_future_scheduled_sessions(app, client, clinic_id):
+    ana = make_user(clinic_id, 'Ana')
+    patient = make_patient(clinic_id, ana)
+    login(client, ana)
+    past = _series(client, patient, '2020-03-02T10:00:00')
+    future = [event for event in _series(client, patient, '2030-03-04T10:00:00') if event not in past]
+    assert len(past) == len(future) == 4
+    completed = future[0]['id']
+    assert client.post(f'/api/appointment/{completed}/complete').status_code == 200
+    cursor = int(client.get('/api/appointments').headers['X-Agenda-Cursor'])
+    for series in (past, future):
+        assert client.post('/api/appointments/cancel_series', json={'recurrence_id': series[0]['extendedProps']['recurrence_id']}).status_code == 200
+    delta = client.get(f'/api/appointments/changes?since={cursor}').get_json()
+    assert sorted(event['id'] for event in delta['events']) == sorted(event['id'] for event in future[1:])
+    statuses = {event['id']: event['extendedProps']['status'] for event in client.get('/api/appointments').get_json()}
+    assert {statuses[event['id']] for event in past} == {'Agendado'}
+    assert statuses[completed] == 'Concluído'
+    assert {statuses[event['id']] for event in future[1:]} == {'Cancelado'}
+    assert client.post('/api/appointments/cancel_series', json={}).status_code == 400
+
+
+def _series_starts(client, patient, start, weekdays, weeks):
+    response = client.post('/api/appointment/create_from_agenda', json={'patient_id': patient, 'start_datetime': start, 'is_recurring': True, 'weeks_to_repeat': weeks, 'weekdays': weekdays})
+    assert response.status_code == 200
+    return sorted(event['start'][:10] for event in client.get('/api/appointments').get_json())
+
+
+def test_series_weeks_count_from_the_first_selected_weekday(app, client, clinic_id):
+    ana = make_user(clinic_id, 'Ana')
+    patient = make_patient(clinic_id, ana)
+    login(client, ana)
+    # Domingo, 3 de março, com seg/qua/sex durante 10 semanas: 30 sessões, a primeira na segunda seguinte.
+    starts = _series_starts(client, patient, '2030-03-03T10:00:00', [1, 3, 5], 10)
+    assert len(starts) == 30
+    assert (starts[0], starts[-1]) == ('2030-03-04', '2030-05-10')
+
+
+def test_series_skips_a_start_day_that_was_not_selected(app, client, clinic_id):
+    ana = make_user(clinic_id, 'Ana')
+    patient = make_patient(clinic_id, ana)
+    login(client, ana)
+    # Quarta, 6 de março, com só as segundas durante 2 semanas: a quarta não é marcada.
+    assert _series_starts(client, patient, '2030-03-06T10:00:00', [1], 2) == ['2030-03-11', '2030-03-18']
@@ -0,0 +1,24 @@
+from conftest import create, fisio, make_patient, make_user
+from models import db, Clinic, ElectronicRecord
+from search import search_clinical_notes, search_patients
+
+
+def test_search_is_scoped_to_the_clinic_inside_the_index(app, clinic_id):
+    other_clinic = create(Clinic(name='Outra Clínica'))
+    ours = make_patient(clinic_id, make_user(clinic_id, 'Ana'), 'João Lombar')
+    theirs = make_patient(other_clinic, make_user(other_clinic, 'Bruno'), 'João Cervical')
+    for patient, clinic in ((ours, clinic_id), (theirs, other_clinic)):
+        create(ElectronicRecord(patient_id=patient, clinic_id=clinic, medical_diagnosis='Lombalgia crónica', subjective_notes='dor ao sentar', objective_notes='-', assessment='-', plan='-'))
+    with app.app_context():
+        assert [patient.id for patient in search_patients(clinic_id, 'joao')] == [ours]
+        assert [patient.id for patient in search_patients(other_clinic, 'joão')] == [theirs]
+        # "clinic" não pode casar com o termo da clínica.
+        assert search_patients(clinic_id, 'clinic').all() == []
+        assert [hit['patient_id'] for hit in search_clinical_notes(clinic_id, 'lombalgias ou cervical')] == [ours]
+        assert search_clinical_notes(clinic_id, 'clinic') == []
+        rows = db.session.execute(db.text("SELECT rowid FROM clinical_search WHERE clinical_search MATCH 'clinic : \"clinic' || :clinic || '\"'"), {'clinic': other_clinic}).all()
+        assert len(rows) == 1
+        # Mudar o paciente de clínica acompanha o índice.
+        db.session.get(fisio.Patient, ours).clinic_id = other_clinic
+        db.session.commit()
+        assert search_patients(clinic_id, 'joao').all() == []
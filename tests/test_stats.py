@@ -0,0 +1,123 @@
+from datetime import date, datetime, time, timedelta
+
+from conftest import fisio, login, make_patient, make_user
+from models import db, Appointment, ClinicStat, MonthlyFinancialStat, Patient, PatientSessionStat, _bump, apply_financial_delta
+
+
+def test_bump_creates_a_missing_key_and_adds_to_an_existing_one(app, clinic_id):
+    key = {'clinic_id': clinic_id, 'dimension': 'gender', 'bucket': 'Outro'}
+    with app.app_context():
+        with db.engine.begin() as connection:
+            _bump(connection, ClinicStat.__table__, key, {'value': 1})
+            _bump(connection, ClinicStat.__table__, key, {'value': 2})
+            # Só incrementos positivos criam a linha.
+            _bump(connection, ClinicStat.__table__, dict(key, bucket='Nenhum'), {'value': -1})
+        assert [(stat.bucket, stat.value) for stat in ClinicStat.query.filter_by(clinic_id=clinic_id, dimension='gender')] == [('Outro', 3)]
+
+
+def test_financial_delta_upserts_the_professional_month(app, clinic_id):
+    ana = make_user(clinic_id, 'Ana')
+    month = date(2030, 3, 1)
+    with app.app_context():
+        apply_financial_delta(db.session, clinic_id, ana, month, {'billed': 100.0, 'scheduled': 1})
+        apply_financial_delta(db.session, clinic_id, ana, month, {'billed': 50.0, 'scheduled': 1})
+        db.session.commit()
+        stat = db.session.get(MonthlyFinancialStat, (ana, month))
+        assert (stat.clinic_id, stat.billed, stat.scheduled) == (clinic_id, 150.0, 2)
+
+
+def _dashboard_stats():
+    # Linhas que chegaram a zero ficam na tabela; a reconstrução só cria as que contam.
+    with fisio.app.app_context():
+        clinic = {(stat.clinic_id, stat.dimension, stat.bucket, stat.value) for stat in ClinicStat.query if stat.value}
+        sessions = {(stat.clinic_id, stat.patient_id, stat.month, stat.completed) for stat in PatientSessionStat.query if stat.completed}
+        return clinic, sessions
+
+
+def _assert_stats_match_rebuild(app):
+    incremental = _dashboard_stats()
+    result = app.test_cli_runner().invoke(args=['rebuild-clinic-stats'])
+    assert result.exit_code == 0, result.output
+    assert incremental == _dashboard_stats()
+
+
+def _patient_form(full_name, gender='Feminino', specialty='Pilates', date_of_birth='1990-05-01'):
+    return {'full_name': full_name, 'date_of_birth': date_of_birth, 'gender': gender, 'phone': '1', 'specialty': specialty}
+
+
+def test_dashboard_stats_match_rebuild_after_every_write_path(app, client, clinic_id):
+    ana = make_user(clinic_id, 'Ana')
+    login(client, ana)
+    for name, gender in (('Maria', 'Feminino'), ('José', 'Masculino')):
+        assert client.post('/patient/add', data=_patient_form(name, gender)).status_code == 302
+    _assert_stats_match_rebuild(app)
+    with app.app_context():
+        maria, jose = [patient.id for patient in Patient.query.order_by(Patient.full_name.desc())]
+    assert client.post(f'/patient/{jose}/edit', data=_patient_form('José', 'Masculino', 'Osteopatia', '1950-01-01')).status_code == 302
+    _assert_stats_match_rebuild(app)
+    for patient, start in ((maria, '2030-03-04T10:00:00'), (maria, '2030-03-05T10:00:00'), (jose, '2030-03-06T10:00:00')):
+        assert client.post('/api/appointment/create_from_agenda', json={'patient_id': patient, 'start_datetime': start, 'session_price': 100}).status_code == 200
+    ids = [event['id'] for event in client.get('/api/appointments').get_json()]
+    for appointment_id in ids:
+        assert client.post(f'/api/appointment/{appointment_id}/complete').status_code == 200
+    _assert_stats_match_rebuild(app)
+    # Uma sessão concluída muda de mês, outra é apagada e um paciente sai com as suas sessões.
+    assert client.post(f'/api/appointment/{ids[0]}/update', json={'start_time': '2030-04-01T10:00:00Z'}).status_code == 200
+    _assert_stats_match_rebuild(app)
+    assert client.post(f'/api/appointment/{ids[1]}/delete').status_code == 200
+    _assert_stats_match_rebuild(app)
+    assert client.post(f'/patient/{jose}/delete').status_code == 302
+    _assert_stats_match_rebuild(app)
+    clinic, sessions = _dashboard_stats()
+    assert (clinic_id, 'gender', 'Feminino', 1) in clinic and not any(bucket == 'Masculino' for _, _, bucket, _ in clinic)
+    assert sessions == {(clinic_id, maria, date(2030, 4, 1), 1)}
+
+
+def _financials():
+    with fisio.app.app_context():
+        return {(stat.clinic_id, stat.user_id, stat.month): (round(stat.billed, 2), round(stat.received, 2), stat.scheduled, stat.completed, stat.cancelled, stat.no_show)
+                for stat in MonthlyFinancialStat.query if any((stat.billed, stat.received, stat.scheduled, stat.completed, stat.cancelled, stat.no_show))}
+
+
+def _assert_financials_match_rebuild(app):
+    incremental = _financials()
+    result = app.test_cli_runner().invoke(args=['rebuild-monthly-financials'])
+    assert result.exit_code == 0, result.output
+    assert incremental == _financials()
+
+
+def _raw_summary(clinic_id, start, end):
+    # A regra do relatório aplicada diretamente aos agendamentos do período.
+    appointments = Appointment.query.filter(Appointment.clinic_id == clinic_id, Appointment.start_time >= datetime.combine(start, time.min), Appointment.start_time < datetime.combine(end + timedelta(days=1), time.min)).all()
+    counts = {'Concluído': 0, 'Agendado': 0, 'Cancelado': 0}
+    for appointment in appointments:
+        counts[appointment.status] = counts.get(appointment.status, 0) + 1
+    return {'total_cobrado': round(sum(a.session_price or 0 for a in appointments), 2), 'total_recebido': round(sum(a.amount_paid or 0 for a in appointments), 2), 'status_counts': counts, 'total_appointments': len(appointments)}
+
+
+def test_monthly_financials_match_rebuild_and_partial_months_match_raw_sums(app, client, clinic_id):
+    ana, bruno = make_user(clinic_id, 'Ana'), make_user(clinic_id, 'Bruno')
+    patient_a, patient_b = make_patient(clinic_id, ana, 'Paciente A'), make_patient(clinic_id, bruno, 'Paciente B')
+    login(client, ana)
+    # Série de 2 a 27 de março de 2030 (seg/qua/sex), mais uma sessão no fim de fevereiro e outra em abril.
+    assert client.post('/api/appointment/create_from_agenda', json={'patient_id': patient_a, 'start_datetime': '2030-02-25T10:00:00', 'session_price': 100, 'is_recurring': True, 'weeks_to_repeat': 6, 'weekdays': [1, 3, 5]}).status_code == 200
+    login(client, bruno)
+    for start in ('2030-02-27T15:00:00', '2030-04-02T15:00:00'):
+        assert client.post('/api/appointment/create_from_agenda', json={'patient_id': patient_b, 'start_datetime': start, 'session_price': 80}).status_code == 200
+    _assert_financials_match_rebuild(app)
+    events = sorted(client.get('/api/appointments').get_json(), key=lambda event: event['start'])
+    first, second, third, fourth = [event['id'] for event in events[:4]]
+    assert client.post(f'/api/appointment/{first}/complete').status_code == 200
+    assert client.post(f'/api/appointment/{first}/update', json={'session_price': 120, 'amount_paid': 120}).status_code == 200
+    assert client.post(f'/api/appointment/{second}/cancel').status_code == 200
+    assert client.post(f'/api/appointment/{third}/update', json={'start_time': '2030-05-06T13:00:00Z'}).status_code == 200
+    assert client.post(f'/api/appointment/{fourth}/delete').status_code == 200
+    _assert_financials_match_rebuild(app)
+    assert client.post('/api/appointments/cancel_series', json={'recurrence_id': events[0]['extendedProps']['recurrence_id']}).status_code == 200
+    _assert_financials_match_rebuild(app)
+    with app.app_context():
+        # Pontas parciais (fevereiro e abril) mais março inteiro vindo do resumo mensal; um só mês parcial; um dia.
+        for start, end in ((date(2030, 2, 26), date(2030, 4, 15)), (date(2030, 3, 10), date(2030, 3, 20)), (date(2030, 2, 1), date(2030, 5, 31)), (date(2030, 3, 4), date(2030, 3, 4))):
+            summary = fisio._financial_summary(clinic_id, start, end)
+            summary = dict(summary, total_cobrado=round(summary['total_cobrado'], 2), total_recebido=round(summary['total_recebido'], 2))
+            assert summary == _raw_summary(clinic_id, start, end), (start, end)
@@ -0,0 +1,93 @@
+import io
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from PIL import Image
+
+from conftest import create, fisio, make_patient, make_user
+from jobs import JobQueue
+from models import db, Assessment, FileVariant, UploadedFile
+from uploads import UPLOAD_FAILED, UPLOAD_PENDING, UPLOAD_READY
+
+
+def test_full_queue_rejects_without_blocking(app):
+    jobs = JobQueue(app, 'teste', workers=1, max_pending=1)
+    release = threading.Event()
+    assert jobs.submit(release.wait, 5)
+    started = time.monotonic()
+    assert jobs.submit(release.wait, 5) is False
+    assert time.monotonic() - started < 1
+    release.set()
+
+
+def _spool(directory, name, content, age):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    with open(path, 'wb') as spooled:
+        spooled.write(content)
+    os.utime(path, (time.time() - age, time.time() - age))
+    return path
+
+
+def test_sweep_resumes_or_fails_stale_uploads_and_removes_orphans(app, clinic_id):
+    patient = make_patient(clinic_id, make_user(clinic_id, 'Ana'))
+    assessment = create(Assessment(patient_id=patient, clinic_id=clinic_id))
+    incoming = fisio.upload_queue.storage.incoming_dir
+    old = datetime.utcnow() - timedelta(hours=2)
+    kept = _spool(incoming, 'upload-perdido', b'exame', 7200)
+    resumed = create(UploadedFile(status=UPLOAD_PENDING, original_filename='exame.txt', spool_path=kept, queued_at=old, assessment_id=assessment))
+    lost = create(UploadedFile(status=UPLOAD_PENDING, original_filename='outro.txt', spool_path=os.path.join(incoming, 'upload-sumiu'), queued_at=old, assessment_id=assessment))
+    recent = create(UploadedFile(status=UPLOAD_PENDING, original_filename='novo.txt', spool_path=_spool(incoming, 'upload-recente', b'novo', 0), assessment_id=assessment))
+    orphan = _spool(incoming, 'upload-orfao', b'lixo', 7200)
+    fresh_orphan = _spool(incoming, 'upload-a-chegar', b'ainda a chegar', 0)
+    with app.app_context():
+        assert fisio.upload_queue.sweep(timedelta(minutes=30)) == (1, 1, 1)
+        statuses = {uploaded.id: uploaded for uploaded in UploadedFile.query}
+        assert statuses[resumed].status == UPLOAD_READY and statuses[resumed].spool_path is None
+        assert statuses[lost].status == UPLOAD_FAILED
+        assert statuses[recent].status == UPLOAD_PENDING
+        assert db.session.get(UploadedFile, resumed).public_id
+    assert not os.path.exists(kept) and not os.path.exists(orphan)
+    assert os.path.exists(fresh_orphan)
+
+
+def _upload(client, patient, filename, content):
+    response = client.post(f'/patient/{patient}/add_assessment', data={'files': [(io.BytesIO(content), filename)]}, content_type='multipart/form-data')
+    assert response.status_code == 302
+    with fisio.app.app_context():
+        return db.session.query(UploadedFile.id).filter_by(original_filename=filename).scalar()
+
+
+def test_active_content_is_downloaded_as_attachment(app, client, clinic_id):
+    patient = make_patient(clinic_id, make_user(clinic_id, 'Ana'))
+    for filename in ('x.html', 'desenho.svg'):
+        response = client.get(f'/files/{_upload(client, patient, filename, b"<svg onload=alert(1)><script>alert(1)</script>")}')
+        assert response.status_code == 200
+        assert response.mimetype == 'application/octet-stream'
+        assert response.headers['Content-Disposition'].startswith('attachment')
+        assert response.headers['X-Content-Type-Options'] == 'nosniff'
+
+
+def test_pdf_is_shown_inline(app, client, clinic_id):
+    patient = make_patient(clinic_id, make_user(clinic_id, 'Ana'))
+    response = client.get(f'/files/{_upload(client, patient, "exame.pdf", b"%PDF-1.4 ...")}?size=original')
+    assert response.mimetype == 'application/pdf'
+    assert response.headers['Content-Disposition'].startswith('inline')
+    assert response.headers['X-Content-Type-Options'] == 'nosniff'
+
+
+def _variants(upload_id):
+    with fisio.app.app_context():
+        return {variant.kind: variant.status for variant in FileVariant.query.filter_by(uploaded_file_id=upload_id)}
+
+
+def test_only_raster_images_and_pdfs_get_variants(app, client, clinic_id):
+    patient = make_patient(clinic_id, make_user(clinic_id, 'Ana'))
+    assert _variants(_upload(client, patient, 'desenho.svg', b'<svg xmlns="http://www.w3.org/2000/svg"/>')) == {}
+    photo, pdf = io.BytesIO(), io.BytesIO()
+    Image.effect_noise((2000, 1500), 64).convert('RGB').save(photo, 'JPEG', quality=95)
+    Image.new('RGB', (600, 800), 'white').save(pdf, 'PDF')
+    assert _variants(_upload(client, patient, 'foto.jpg', photo.getvalue())) == {'thumb': 'ready', 'web': 'ready'}
+    assert _variants(_upload(client, patient, 'exame.pdf', pdf.getvalue())) == {'thumb': 'ready'}
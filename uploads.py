@@ -0,0 +1,91 @@
+import logging
+import os
+import time
+from datetime import datetime
+from sqlalchemy import or_
+from models import db, UploadedFile
+from storage import spool_file, UPLOAD_PREFIX, VARIANT_PREFIX
+
+# Envio dos anexos das avaliações fora do pedido. O pedido grava a avaliação e uma linha UploadedFile 'pending'
+# por arquivo (já em disco, ver storage.spooling_request_class) e entrega o envio ao UploadQueue; as tarefas correm
+# numa JobQueue limitada, gravam no storage configurado e preenchem a linha ('ready' ou 'failed'). Um arquivo lento
+# já não derruba o formulário. on_ready(upload_id) é chamado depois de cada envio bem-sucedido.
+# As tarefas vivem só na memória do processo: um reinício, ou a fila cheia, deixa linhas 'pending' com o arquivo
+# em disco (spool_path). O comando sweep-uploads retoma-as (ver sweep) e apaga os temporários órfãos.
+
+UPLOAD_PENDING, UPLOAD_READY, UPLOAD_FAILED = 'pending', 'ready', 'failed'
+
+logger = logging.getLogger(__name__)
+
+
+class UploadQueue:
+    def __init__(self, storage, jobs, on_ready=None):
+        self.storage = storage
+        self.jobs = jobs
+        self.on_ready = on_ready
+
+    def spool(self, file):
+        # O FileStorage deixa de existir no fim do pedido: o worker recebe o caminho do arquivo em disco e o seu sha256.
+        return spool_file(file, self.storage.incoming_dir)
+
+    def submit(self, upload_id, spooled, filename):
+        # Chamar só depois do commit da linha 'pending' (com spool_path), para o worker a encontrar. Não bloqueia:
+        # com a fila cheia devolve False e o envio fica 'pending' até ao próximo sweep.
+        return self.jobs.submit(self._run, upload_id, spooled, filename)
+
+    def sweep(self, stale_after):
+        # Envios 'pending' há mais de stale_after: com o arquivo temporário ainda em disco o envio corre aqui mesmo,
+        # sem ele a linha passa a 'failed'. Depois apaga os temporários mais antigos que isso que nenhuma linha
+        # reclama. Devolve (retomados, falhados, temporários apagados).
+        cutoff = datetime.utcnow() - stale_after
+        is_stale = (UploadedFile.status == UPLOAD_PENDING, or_(UploadedFile.queued_at < cutoff, UploadedFile.queued_at.is_(None)))
+        stale = db.session.query(UploadedFile.id, UploadedFile.spool_path, UploadedFile.original_filename).filter(*is_stale).order_by(UploadedFile.id).all()
+        resumed = failed = 0
+        for upload_id, path, filename in stale:
+            # A linha é reclamada antes do envio: dois sweeps ao mesmo tempo não enviam o mesmo arquivo.
+            claimed = UploadedFile.query.filter(UploadedFile.id == upload_id, *is_stale).update({'queued_at': datetime.utcnow()}, synchronize_session=False)
+            db.session.commit()
+            if not claimed:
+                continue
+            if path and os.path.exists(path):
+                self._run(upload_id, (path, None), filename)
+                resumed += 1
+            else:
+                UploadedFile.query.filter_by(id=upload_id, status=UPLOAD_PENDING).update({'status': UPLOAD_FAILED, 'error': 'Arquivo temporário perdido antes do envio; envie-o novamente.', 'spool_path': None}, synchronize_session=False)
+                db.session.commit()
+                failed += 1
+        return resumed, failed, self._remove_orphans(time.time() - stale_after.total_seconds())
+
+    def _remove_orphans(self, older_than):
+        directory = self.storage.incoming_dir
+        if not os.path.isdir(directory):
+            return 0
+        claimed = {os.path.basename(path) for path, in db.session.query(UploadedFile.spool_path).filter(UploadedFile.status == UPLOAD_PENDING, UploadedFile.spool_path.isnot(None))}
+        removed = 0
+        for entry in os.scandir(directory):
+            if not entry.is_file() or not entry.name.startswith((UPLOAD_PREFIX, VARIANT_PREFIX)) or entry.name in claimed:
+                continue
+            try:
+                if entry.stat().st_mtime < older_than:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def _run(self, upload_id, spooled, filename):
+        path, digest = spooled
+        try:
+            changes = dict(self.storage.save(path, filename, digest), storage=self.storage.name, status=UPLOAD_READY, error=None, spool_path=None)
+        except Exception as error:
+            logger.exception('Falha ao enviar o anexo %s', upload_id)
+            changes = {'status': UPLOAD_FAILED, 'error': str(error)[:255], 'spool_path': None}
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        UploadedFile.query.filter_by(id=upload_id).update(changes)
+        db.session.commit()
+        if changes['status'] == UPLOAD_READY and self.on_ready:
+            self.on_ready(upload_id)